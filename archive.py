@@ -0,0 +1,779 @@
+# -*- coding: utf-8 -*-
+import os, sys, io, codecs, json, time, shutil, tempfile, threading, mimetypes
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
+if sys.version_info[0] == 3:
+	import xmlrpc.client as xmlrpc_client
+	from urllib.parse import urlparse
+	from urllib.request import urlopen
+	text_type = str
+	from .wordpress_xmlrpc import *
+	from .wordpress_xmlrpc.methods.posts import *
+	from .wordpress_xmlrpc.methods.taxonomies import *
+	from .wordpress_xmlrpc.methods.media import *
+	from .wordpress_xmlrpc.methods.options import *
+	from . import common, executor, store, upload
+else:
+	import xmlrpclib as xmlrpc_client
+	from urlparse import urlparse
+	from urllib2 import urlopen
+	text_type = unicode
+	from wordpress_xmlrpc import *
+	from wordpress_xmlrpc.methods.posts import *
+	from wordpress_xmlrpc.methods.taxonomies import *
+	from wordpress_xmlrpc.methods.media import *
+	from wordpress_xmlrpc.methods.options import *
+	import common, executor, store, upload
+
+# bumped whenever the shape of the JSON lines records changes
+FORMAT_VERSION = 1
+
+# the order records are written in, so whatever a record refers to usually comes before it
+KINDS = ['site', 'option', 'term', 'post', 'media']
+
+# post fields copied over as they are when a post is imported
+POST_FIELDS = ['post_type', 'post_status', 'post_title', 'post_content', 'post_excerpt', 'post_name', 'post_password',
+	'post_format', 'comment_status', 'ping_status', 'sticky', 'menu_order', 'post_date_gmt']
+
+# errors kept for the report, the rest are only counted
+MAX_ERRORS = 100
+
+# records written between two progress callbacks of an export
+PROGRESS_EVERY = 50
+
+""" Yields the items of a paged listing, fetch(offset) returning one page at a time """
+def pages(fetch, page_size):
+	offset = 0
+
+	while True:
+		items = fetch(offset)
+		for item in items:
+			yield item
+
+		if len(items) < page_size:
+			return
+
+		offset += page_size
+
+""" Returns the post types worth exporting """
+def post_types(client):
+	if not client.supports('wp.getPostTypes'):
+		return ['post', 'page']
+
+	# attachments are exported from the media library instead
+	return sorted(name for name in client.call(GetPostTypes()) if name not in ('attachment', 'revision', 'nav_menu_item'))
+
+"""
+Yields every option, term, post and media item of a site as plain records, one page at a time so only
+a page is ever held in memory, called from a worker thread.
+"""
+def site_records(client, page_size = 100):
+	yield {'kind': 'site', 'url': client.url, 'exported': time.strftime('%Y%m%dT%H:%M:%S', time.gmtime()), 'version': FORMAT_VERSION}
+
+	if client.supports('wp.getOptions'):
+		for option in client.call(GetOptions([])):
+			yield {'kind': 'option', 'name': option.name, 'value': option.value, 'read_only': option.read_only}
+
+	# results_class = None keeps the responses as the structs WordPress sent, ids and dates included
+	for taxonomy in [t.name for t in client.call(GetTaxonomies())]:
+		fetch = lambda offset: client.call(GetTerms(taxonomy, {'number': page_size, 'offset': offset}, results_class = None))
+		for term in pages(fetch, page_size):
+			yield dict(term, kind = 'term')
+
+	for post_type in post_types(client):
+		filter = {'post_type': post_type, 'post_status': 'any', 'orderby': 'ID', 'order': 'ASC', 'number': page_size}
+		fetch = lambda offset: client.call(GetPosts(dict(filter, offset = offset), results_class = None))
+		for post in pages(fetch, page_size):
+			yield dict(post, kind = 'post')
+
+	fetch = lambda offset: client.call(GetMediaLibrary({'number': page_size, 'offset': offset}, results_class = None))
+	for item in pages(fetch, page_size):
+		yield dict(item, kind = 'media')
+
+""" Returns a date as WordPress writes it in WXR files """
+def wxr_date(value):
+	value = str(value or '')
+	if len(value) < 17:
+		return '0000-00-00 00:00:00'
+
+	return value[0:4] + '-' + value[4:6] + '-' + value[6:8] + ' ' + value[9:17]
+
+""" Returns a WXR date as an XML-RPC date """
+def xmlrpc_date(value):
+	value = str(value or '').replace('-', '').replace(' ', 'T')
+	if not value or value.startswith('00000000'):
+		return None
+
+	return xmlrpc_client.DateTime(value)
+
+def cdata(text):
+	return '<![CDATA[' + text_type(text or '').replace(']]>', ']]]]><![CDATA[>') + ']]>'
+
+class JsonLinesWriter(object):
+	""" Writes records one JSON object per line """
+	def __init__(self, f):
+		self.f = f
+
+	def write(self, record):
+		# dates are written the way XML-RPC sends them
+		self.f.write(json.dumps(record, sort_keys = True, default = str) + '\n')
+
+	def close(self):
+		pass
+
+class WxrWriter(object):
+	""" Writes records as a WordPress eXtended RSS file, the format of WordPress' own exports """
+	def __init__(self, f):
+		self.f = f
+		self.site = {}
+		self.options = {}
+		# terms of the taxonomy being written, held back until all of them are in so parents can be found
+		self.terms = []
+		self.started = False
+
+	def write(self, record):
+		kind = record['kind']
+
+		if kind == 'site':
+			self.site = record
+			return
+
+		if kind == 'option':
+			self.options[record['name']] = record['value']
+			return
+
+		self.start()
+
+		if kind == 'term':
+			if self.terms and self.terms[0]['taxonomy'] != record['taxonomy']:
+				self.write_terms()
+			self.terms.append(record)
+			return
+
+		self.write_terms()
+
+		if kind == 'post':
+			self.write_item(record, record.get('post_type', 'post'))
+		elif kind == 'media':
+			self.write_media(record)
+
+	""" Writes the channel header, once the options it is made of have been seen """
+	def start(self):
+		if self.started:
+			return
+
+		self.started = True
+		url = self.options.get('blog_url') or self.site.get('url', '')
+
+		self.f.write('<?xml version="1.0" encoding="UTF-8" ?>\n')
+		self.f.write('<rss version="2.0" xmlns:excerpt="http://wordpress.org/export/1.2/excerpt/" xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+			'xmlns:wfw="http://wellformedweb.org/CommentAPI/" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:wp="http://wordpress.org/export/1.2/">\n')
+		self.f.write('<channel>\n')
+		self.f.write('\t<title>' + escape(self.options.get('blog_title', '')) + '</title>\n')
+		self.f.write('\t<link>' + escape(url) + '</link>\n')
+		self.f.write('\t<description>' + escape(self.options.get('blog_tagline', '')) + '</description>\n')
+		self.f.write('\t<wp:wxr_version>1.2</wp:wxr_version>\n')
+		self.f.write('\t<wp:base_site_url>' + escape(url) + '</wp:base_site_url>\n')
+		self.f.write('\t<wp:base_blog_url>' + escape(url) + '</wp:base_blog_url>\n')
+
+	""" Writes the held back terms of a taxonomy, every parent before its children since WXR refers to parents by slug """
+	def write_terms(self):
+		terms, self.terms = self.terms, []
+
+		slugs = dict((str(term['term_id']), term['slug']) for term in terms)
+		children = {}
+		for term in terms:
+			parent = str(term.get('parent', '0') or '0')
+			children.setdefault(parent if parent in slugs else '0', []).append(term)
+
+		written = set()
+		pending = list(reversed(children.get('0', [])))
+		while pending:
+			term = pending.pop()
+			written.add(str(term['term_id']))
+			self.write_term(term, slugs.get(str(term.get('parent', '0') or '0'), ''))
+			pending.extend(reversed(children.get(str(term['term_id']), [])))
+
+		# terms whose parents loop back on them can't come after their parent, but still go in
+		for term in terms:
+			if str(term['term_id']) not in written:
+				self.write_term(term, slugs.get(str(term.get('parent', '0') or '0'), ''))
+
+	def write_term(self, term, parent):
+		self.f.write('\t<wp:term><wp:term_id>' + str(term['term_id']) + '</wp:term_id>'
+			'<wp:term_taxonomy>' + escape(term['taxonomy']) + '</wp:term_taxonomy>'
+			'<wp:term_slug>' + escape(term['slug']) + '</wp:term_slug>'
+			'<wp:term_parent>' + escape(parent) + '</wp:term_parent>'
+			'<wp:term_name>' + cdata(term['name']) + '</wp:term_name>'
+			'<wp:term_description>' + cdata(term.get('description', '')) + '</wp:term_description></wp:term>\n')
+
+	def write_item(self, post, post_type, extra = ''):
+		meta = [(f['key'], f['value']) for f in post.get('custom_fields', []) or []]
+
+		thumbnail = post.get('post_thumbnail')
+		if isinstance(thumbnail, dict) and thumbnail.get('attachment_id'):
+			meta.append(('_thumbnail_id', thumbnail['attachment_id']))
+
+		lines = [
+			'\t<item>',
+			'\t\t<title>' + escape(post.get('post_title', '')) + '</title>',
+			'\t\t<link>' + escape(post.get('link', '')) + '</link>',
+			'\t\t<guid isPermaLink="false">' + escape(post.get('guid', '')) + '</guid>',
+			'\t\t<content:encoded>' + cdata(post.get('post_content', '')) + '</content:encoded>',
+			'\t\t<excerpt:encoded>' + cdata(post.get('post_excerpt', '')) + '</excerpt:encoded>',
+			'\t\t<wp:post_id>' + str(post['post_id']) + '</wp:post_id>',
+			'\t\t<wp:post_date>' + wxr_date(post.get('post_date')) + '</wp:post_date>',
+			'\t\t<wp:post_date_gmt>' + wxr_date(post.get('post_date_gmt')) + '</wp:post_date_gmt>',
+			'\t\t<wp:comment_status>' + escape(post.get('comment_status', 'closed')) + '</wp:comment_status>',
+			'\t\t<wp:ping_status>' + escape(post.get('ping_status', 'closed')) + '</wp:ping_status>',
+			'\t\t<wp:post_name>' + escape(post.get('post_name', '')) + '</wp:post_name>',
+			'\t\t<wp:status>' + escape(post.get('post_status', 'publish')) + '</wp:status>',
+			'\t\t<wp:post_parent>' + str(post.get('post_parent', 0)) + '</wp:post_parent>',
+			'\t\t<wp:menu_order>' + str(post.get('menu_order', 0)) + '</wp:menu_order>',
+			'\t\t<wp:post_type>' + escape(post_type) + '</wp:post_type>',
+			'\t\t<wp:post_password>' + escape(post.get('post_password', '')) + '</wp:post_password>',
+			'\t\t<wp:is_sticky>' + ('1' if post.get('sticky') else '0') + '</wp:is_sticky>',
+		]
+
+		if extra:
+			lines.append(extra)
+
+		for term in post.get('terms', []) or []:
+			lines.append('\t\t<category domain=' + quoteattr(term['taxonomy']) + ' nicename=' + quoteattr(term['slug']) + '>' + cdata(term['name']) + '</category>')
+
+		for key, value in meta:
+			lines.append('\t\t<wp:postmeta><wp:meta_key>' + escape(key) + '</wp:meta_key><wp:meta_value>' + cdata(value) + '</wp:meta_value></wp:postmeta>')
+
+		lines.append('\t</item>\n')
+		self.f.write('\n'.join(lines))
+
+	def write_media(self, item):
+		post = {
+			'post_id': item['attachment_id'],
+			'post_title': item.get('title', ''),
+			'post_content': item.get('description', ''),
+			'post_excerpt': item.get('caption', ''),
+			'post_date_gmt': item.get('date_created_gmt'),
+			'post_parent': item.get('parent', 0),
+			'post_status': 'inherit',
+			'link': item.get('link', ''),
+		}
+		self.write_item(post, 'attachment', '\t\t<wp:attachment_url>' + escape(item.get('link', '')) + '</wp:attachment_url>')
+
+	def close(self):
+		self.start()
+		self.write_terms()
+		self.f.write('</channel>\n</rss>\n')
+
+""" Returns True if a path names a WXR file rather than a JSON lines one """
+def is_wxr(path):
+	return os.path.splitext(path)[1].lower() in ('.xml', '.wxr')
+
+"""
+Writes every record of a site to path as WXR or JSON lines, depending on its extension, called from a worker thread.
+progress(counts) is called every PROGRESS_EVERY records. Returns the number of records written per kind.
+"""
+def export_site(client, path, progress = None, page_size = 100):
+	counts = dict((kind, 0) for kind in KINDS)
+	tmp = path + '.tmp'
+
+	with codecs.open(tmp, 'w', 'utf-8') as f:
+		writer = WxrWriter(f) if is_wxr(path) else JsonLinesWriter(f)
+
+		for n, record in enumerate(site_records(client, page_size)):
+			writer.write(record)
+			counts[record['kind']] += 1
+
+			if progress != None and n % PROGRESS_EVERY == 0:
+				progress(counts)
+
+		writer.close()
+
+	# only a complete export replaces an earlier one
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(tmp, path)
+
+	return counts
+
+""" Yields the records of a JSON lines export """
+def read_json_lines(f):
+	for line in f:
+		if line.strip():
+			yield json.loads(line)
+
+""" Returns the namespace and local name of an ElementTree tag """
+def split_tag(tag):
+	if tag.startswith('{'):
+		namespace, _, name = tag[1:].partition('}')
+		return namespace, name
+
+	return '', tag
+
+""" Returns the text of the children of an element by local name, the way WXR is laid out """
+def children(elem):
+	fields = {}
+	for child in elem:
+		namespace, name = split_tag(child.tag)
+		if name == 'encoded':
+			name = 'excerpt' if 'excerpt' in namespace else 'content'
+		fields.setdefault(name, (child.text or '').strip() if name not in ('content', 'excerpt') else (child.text or ''))
+
+	return fields
+
+""" Turns a <wp:term>, <wp:category> or <wp:tag> into a term record """
+def wxr_term(elem, kind):
+	fields = children(elem)
+
+	if kind == 'category':
+		taxonomy, slug, parent, name, description = 'category', 'category_nicename', 'category_parent', 'cat_name', 'category_description'
+	elif kind == 'tag':
+		taxonomy, slug, parent, name, description = 'post_tag', 'tag_slug', None, 'tag_name', 'tag_description'
+	else:
+		taxonomy, slug, parent, name, description = fields.get('term_taxonomy'), 'term_slug', 'term_parent', 'term_name', 'term_description'
+
+	return {
+		'kind': 'term',
+		'term_id': fields.get('term_id', ''),
+		'taxonomy': taxonomy,
+		'slug': fields.get(slug, ''),
+		'name': fields.get(name, ''),
+		'description': fields.get(description, ''),
+		'parent_slug': fields.get(parent, '') if parent else '',
+	}
+
+""" Turns an <item> into a post or media record """
+def wxr_item(elem):
+	fields = children(elem)
+	terms = []
+	meta = []
+
+	for child in elem:
+		namespace, name = split_tag(child.tag)
+		if name == 'category' and not namespace and child.get('domain'):
+			terms.append({'taxonomy': child.get('domain'), 'slug': child.get('nicename', ''), 'name': (child.text or '').strip()})
+		elif name == 'postmeta':
+			entry = children(child)
+			meta.append({'key': entry.get('meta_key', ''), 'value': entry.get('meta_value', '')})
+
+	if fields.get('post_type') == 'attachment':
+		return {
+			'kind': 'media',
+			'attachment_id': fields.get('post_id', ''),
+			'parent': fields.get('post_parent', '0'),
+			'title': fields.get('title', ''),
+			'description': fields.get('content', ''),
+			'caption': fields.get('excerpt', ''),
+			'link': fields.get('attachment_url') or fields.get('link', ''),
+		}
+
+	post = {
+		'kind': 'post',
+		'post_id': fields.get('post_id', ''),
+		'post_title': fields.get('title', ''),
+		'post_content': fields.get('content', ''),
+		'post_excerpt': fields.get('excerpt', ''),
+		'post_type': fields.get('post_type', 'post'),
+		'post_status': fields.get('status', 'publish'),
+		'post_name': fields.get('post_name', ''),
+		'post_parent': fields.get('post_parent', '0'),
+		'post_password': fields.get('post_password', ''),
+		'comment_status': fields.get('comment_status', 'open'),
+		'ping_status': fields.get('ping_status', 'open'),
+		'menu_order': int(fields.get('menu_order') or 0),
+		'sticky': fields.get('is_sticky') == '1',
+		'post_date_gmt': xmlrpc_date(fields.get('post_date_gmt')),
+		'terms': [t for t in terms if t['taxonomy'] != 'post_format'],
+		'custom_fields': [m for m in meta if m['key'] != '_thumbnail_id'],
+	}
+
+	for term in terms:
+		if term['taxonomy'] == 'post_format':
+			post['post_format'] = term['slug'].replace('post-format-', '')
+
+	for entry in meta:
+		if entry['key'] == '_thumbnail_id':
+			post['post_thumbnail'] = {'attachment_id': entry['value']}
+
+	return post
+
+""" Yields the records of a WXR file as it is parsed, forgetting every element once it has been turned into a record """
+def read_wxr(f):
+	channel = None
+
+	for event, elem in iterparse(f, events = ('start', 'end')):
+		namespace, name = split_tag(elem.tag)
+
+		if event == 'start':
+			if name == 'channel':
+				channel = elem
+			continue
+
+		record = None
+		if name == 'item':
+			record = wxr_item(elem)
+		elif namespace.startswith('http://wordpress.org/export/') and name in ('term', 'category', 'tag'):
+			record = wxr_term(elem, name)
+
+		if record != None:
+			yield record
+
+			# what has been read is no longer needed
+			if channel != None:
+				channel.clear()
+
+""" Yields the records of an export file, WXR or JSON lines depending on its extension """
+def read_records(path):
+	if is_wxr(path):
+		with open(path, 'rb') as f:
+			for record in read_wxr(f):
+				yield record
+	else:
+		with io.open(path, 'r', encoding = 'utf-8') as f:
+			for record in read_json_lines(f):
+				yield record
+
+""" Downloads a URL into a temporary file without holding it in memory, returns the file's path """
+def download(url):
+	suffix = os.path.splitext(urlparse(url).path)[1]
+	handle, path = tempfile.mkstemp(prefix = 'sublpress-import-', suffix = suffix)
+
+	with os.fdopen(handle, 'wb') as f:
+		response = urlopen(url, timeout = 60)
+		try:
+			shutil.copyfileobj(response, f, 64 * 1024)
+		finally:
+			response.close()
+
+	return path
+
+class Importer(object):
+	"""
+	Recreates the records of an export on a site, remapping the ids they refer to as it goes.
+
+	Records are read one at a time and sent on pool with at most concurrency in flight, so
+	reading never gets ahead of sending by more than that. References to terms and posts
+	that are still being created wait for them, and references to ones further down the
+	file are fixed once everything else has been imported. Terms whose slug the site already
+	has are reused rather than created again.
+	"""
+	def __init__(self, client, pool, concurrency = 4, options = False, progress = None):
+		self.client = client
+		self.pool = pool
+		self.concurrency = concurrency
+		self.options = options
+		self.progress = progress
+		self.lock = threading.Lock()
+		self.slots = threading.BoundedSemaphore(concurrency)
+		self.ids = {'term': {}, 'post': {}, 'media': {}}
+		self.slugs = {}
+		self.known_taxonomies = set()
+		self.running = {}
+		self.fixups = []
+		self.writable_options = {}
+		self.counts = dict((kind, {'imported': 0, 'reused': 0, 'failed': 0}) for kind in KINDS)
+		self.errors = []
+		self.cancelled = False
+		self.started = None
+		self.finished = None
+
+	""" Imports every record, returns once all of them have been sent, called from a worker thread """
+	def run(self, records):
+		self.started = time.time()
+		kind = None
+
+		for record in records:
+			if self.cancelled:
+				break
+
+			# posts look their terms up by slug, so those have to exist first, references to posts wait on their own
+			if kind == 'term' and record['kind'] != kind:
+				self.drain()
+			kind = record['kind']
+
+			if kind == 'option':
+				if not record.get('read_only'):
+					self.writable_options[record['name']] = record['value']
+			elif kind == 'term':
+				self.submit(kind, record['term_id'], self.create_term, self.term_content(record))
+			elif kind == 'post':
+				self.submit(kind, record['post_id'], self.create_post, self.post_content(record))
+			elif kind == 'media':
+				self.submit(kind, record['attachment_id'], self.create_media, self.media_content(record))
+
+		self.drain()
+
+		# the term stores don't know about the terms just created
+		if self.counts['term']['imported']:
+			store.forget_terms(store.site_key(self.client))
+
+		if not self.cancelled:
+			self.fix()
+			self.set_options()
+
+		self.finished = time.time()
+		return self.report()
+
+	""" Stops reading, whatever is in flight still finishes """
+	def cancel(self):
+		self.cancelled = True
+
+	""" Sends fn(content) on the pool once a slot is free, and maps old_id to what it returns """
+	def submit(self, kind, old_id, fn, content):
+		if content == None:
+			return
+
+		self.slots.acquire()
+		future = self.pool.submit(fn, (content, ), executor.BACKGROUND)
+
+		with self.lock:
+			self.running[(kind, str(old_id))] = future
+
+		future.add_done_callback(lambda f: self.created(kind, str(old_id), content, f))
+
+	""" Called when a record has been created or has failed """
+	def created(self, kind, old_id, content, future):
+		with self.lock:
+			self.running.pop((kind, old_id), None)
+
+			if future.error != None:
+				self.counts[kind]['failed'] += 1
+				if len(self.errors) < MAX_ERRORS:
+					self.errors.append(kind + ' ' + old_id + ': ' + str(future.error))
+			else:
+				new_id, reused = future.value
+				self.ids[kind][old_id] = str(new_id)
+				self.counts[kind]['reused' if reused else 'imported'] += 1
+
+				if kind == 'term':
+					self.slugs[(content['taxonomy'], content['slug'])] = str(new_id)
+
+				for fixup in content.get('_fixups', []):
+					self.fixups.append((kind, str(new_id)) + fixup)
+
+		self.slots.release()
+
+		if self.progress != None:
+			self.progress(self)
+
+	""" Waits for everything in flight """
+	def drain(self):
+		while True:
+			with self.lock:
+				futures = list(self.running.values())
+
+			if not futures:
+				return
+
+			for future in futures:
+				future.event.wait()
+
+	""" Returns the new id of a record imported earlier, waiting for it if it is still being created, None if it isn't known yet """
+	def resolve(self, kind, old_id):
+		old_id = str(old_id or '')
+		if old_id in ('', '0'):
+			return None
+
+		with self.lock:
+			future = self.running.get((kind, old_id))
+
+		if future != None:
+			future.event.wait()
+
+		with self.lock:
+			return self.ids[kind].get(old_id)
+
+	""" Remembers the slugs of the terms a taxonomy already has on the site, so they are reused """
+	def load_taxonomy(self, taxonomy):
+		if taxonomy in self.known_taxonomies:
+			return
+
+		self.known_taxonomies.add(taxonomy)
+		for term in self.client.call(GetTerms(taxonomy)):
+			self.slugs.setdefault((taxonomy, term.slug), str(term.id))
+
+	""" Returns the new id of a term referred to by old id or by slug """
+	def term_id(self, taxonomy, old_id = None, slug = None):
+		new_id = self.resolve('term', old_id)
+		if new_id == None and slug:
+			with self.lock:
+				new_id = self.slugs.get((taxonomy, slug))
+
+		return new_id
+
+	def term_content(self, record):
+		taxonomy = record['taxonomy']
+		self.load_taxonomy(taxonomy)
+
+		content = {'taxonomy': taxonomy, 'name': record['name'], 'slug': record['slug'], 'description': record.get('description', '')}
+
+		old_parent = str(record.get('parent', '') or '')
+		if old_parent not in ('', '0') or record.get('parent_slug'):
+			parent = self.term_id(taxonomy, old_parent, record.get('parent_slug'))
+			if parent != None:
+				content['parent'] = parent
+			else:
+				content['_fixups'] = [('parent', 'term', old_parent or record.get('parent_slug'))]
+
+		return content
+
+	def post_content(self, record):
+		content = {}
+		for field in POST_FIELDS:
+			if record.get(field) not in (None, ''):
+				content[field] = record[field]
+
+		# dates come out of JSON lines as text
+		if 'post_date_gmt' in content and not isinstance(content['post_date_gmt'], xmlrpc_client.DateTime):
+			date = xmlrpc_date(content['post_date_gmt'])
+			if date != None:
+				content['post_date_gmt'] = date
+			else:
+				del content['post_date_gmt']
+
+		terms = {}
+		for term in record.get('terms', []) or []:
+			self.load_taxonomy(term['taxonomy'])
+			new_id = self.term_id(term['taxonomy'], term.get('term_id'), term.get('slug'))
+			if new_id != None:
+				terms.setdefault(term['taxonomy'], []).append(new_id)
+		if terms:
+			content['terms'] = terms
+
+		# protected fields can't be set through XML-RPC
+		fields = [{'key': f['key'], 'value': f['value']} for f in record.get('custom_fields', []) or [] if not f['key'].startswith('_')]
+		if fields:
+			content['custom_fields'] = fields
+
+		fixups = []
+
+		parent = record.get('post_parent')
+		if str(parent or '0') != '0':
+			new_parent = self.resolve('post', parent)
+			if new_parent != None:
+				content['post_parent'] = new_parent
+			else:
+				fixups.append(('post_parent', 'post', str(parent)))
+
+		# media is imported after posts, so featured images are set once it has been
+		# WordPress sends an empty array rather than a struct when there is none
+		thumbnail = record.get('post_thumbnail')
+		if isinstance(thumbnail, dict) and thumbnail.get('attachment_id'):
+			fixups.append(('post_thumbnail', 'media', str(thumbnail['attachment_id'])))
+
+		if fixups:
+			content['_fixups'] = fixups
+
+		return content
+
+	def media_content(self, record):
+		if not record.get('link'):
+			return None
+
+		content = {'link': record['link'], 'post_id': self.resolve('post', record.get('parent'))}
+
+		# WXR files list attachments among posts, so their parent may come further down
+		if content['post_id'] == None and str(record.get('parent') or '0') != '0':
+			content['_fixups'] = [('post_parent', 'post', str(record['parent']))]
+
+		return content
+
+	""" Creates a term, or reuses the one the site already has with the same slug, called from a worker thread """
+	def create_term(self, content):
+		with self.lock:
+			existing = self.slugs.get((content['taxonomy'], content['slug']))
+
+		if existing != None:
+			return existing, True
+
+		term = dict((k, v) for k, v in content.items() if not k.startswith('_'))
+		return self.client.call(NewTerm(term)), False
+
+	""" Creates a post, called from a worker thread """
+	def create_post(self, content):
+		post = dict((k, v) for k, v in content.items() if not k.startswith('_'))
+		return self.client.call(NewPost(post)), False
+
+	""" Downloads a media item from the site it was exported from and uploads it, called from a worker thread """
+	def create_media(self, content):
+		path = download(content['link'])
+		try:
+			name = os.path.basename(urlparse(content['link']).path) or 'upload'
+			result = upload.StreamingUpload(self.client, path, name, mimetypes.guess_type(name)[0], post_id = content['post_id']).run()
+		finally:
+			os.remove(path)
+
+		return result['id'], False
+
+	""" Points records at what they referred to further down the file, now that it has been imported """
+	def fix(self):
+		for kind, new_id, field, target_kind, old_ref in self.fixups:
+			if kind == 'term':
+				target = self.term_id(self.term_taxonomy(new_id), old_ref, old_ref)
+			else:
+				target = self.resolve(target_kind, old_ref)
+
+			if target == None:
+				continue
+
+			try:
+				if kind == 'term':
+					self.client.call(EditTerm(new_id, {'taxonomy': self.term_taxonomy(new_id), 'parent': target}))
+				else:
+					self.client.call(EditPost(new_id, {field: target}))
+			except Exception as e:
+				if len(self.errors) < MAX_ERRORS:
+					self.errors.append(kind + ' ' + new_id + ' ' + field + ': ' + str(e))
+
+	""" Returns the taxonomy of a term created by this import """
+	def term_taxonomy(self, new_id):
+		for (taxonomy, slug), term_id in self.slugs.items():
+			if term_id == new_id:
+				return taxonomy
+
+		return None
+
+	""" Sets the options that were exported and can be written, if asked to """
+	def set_options(self):
+		if not self.options or not self.writable_options:
+			return
+
+		try:
+			self.client.call(SetOptions(self.writable_options))
+			self.counts['option']['imported'] = len(self.writable_options)
+		except Exception as e:
+			self.counts['option']['failed'] = len(self.writable_options)
+			self.errors.append('options: ' + str(e))
+
+	""" Returns a plain text summary of the import """
+	def report(self):
+		lines = []
+
+		for kind, label in [('term', 'Terms'), ('post', 'Posts'), ('media', 'Media'), ('option', 'Options')]:
+			counts = self.counts[kind]
+			lines.append('%-8s %6d imported %6d reused %6d failed' % (label, counts['imported'], counts['reused'], counts['failed']))
+
+		if self.started != None and self.finished != None:
+			lines.append('Took %.1f s' % (self.finished - self.started))
+
+		if self.cancelled:
+			lines.append('Cancelled before the end of the file.')
+
+		if self.errors:
+			lines.append('')
+			lines.append('Errors:')
+			lines.extend('  ' + error for error in self.errors)
+
+		return '\n'.join(lines) + '\n'
+
+	""" Writes which new id every exported id became, for anything that needs to follow the records to their new site """
+	def save_ids(self, path):
+		with open(path, 'w') as f:
+			json.dump(self.ids, f)
+
+# exports and imports read and write on jobs, so a long one can't hold up the shared pool, and imports send on workers
+jobs = executor.WorkerPool(2)
+workers = executor.WorkerPool(4)
+
+# imports that are still reading their file
+running = []
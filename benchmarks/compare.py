@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Compares two result files written by benchmarks.run and flags regressions.
+
+	python -m Sublpress.benchmarks.compare before.json after.json [--threshold 0.1]
+
+Exits with status 1 if any scenario got slower or hungrier than the threshold allows.
+"""
+import sys, json, argparse
+
+# metrics where a higher number is worse
+WORSE_WHEN_HIGHER = ['p50_ms', 'p95_ms', 'peak_bytes', 'sent_wire', 'received_wire']
+
+# metrics where a lower number is worse
+WORSE_WHEN_LOWER = ['ops_per_second']
+
+def main():
+	options = argparse.ArgumentParser(description = 'Compare two Sublpress benchmark runs.')
+	options.add_argument('before')
+	options.add_argument('after')
+	options.add_argument('--threshold', type = float, default = 0.1, help = 'relative change tolerated before a metric counts as a regression')
+	args = options.parse_args()
+
+	with open(args.before) as f:
+		before = json.load(f)['scenarios']
+	with open(args.after) as f:
+		after = json.load(f)['scenarios']
+
+	regressions = []
+
+	for name in sorted(set(before) & set(after)):
+		for metric in WORSE_WHEN_HIGHER + WORSE_WHEN_LOWER:
+			old, new = before[name].get(metric), after[name].get(metric)
+			if not old or new == None:
+				continue
+
+			change = (new - old) / float(old)
+			worse = change > args.threshold if metric in WORSE_WHEN_HIGHER else change < -args.threshold
+			flag = '  REGRESSION' if worse else ''
+
+			print('%-16s %-16s %14.2f -> %14.2f  %+7.1f%%%s' % (name, metric, old, new, change * 100, flag))
+
+			if worse:
+				regressions.append((name, metric))
+
+	if regressions:
+		print(str(len(regressions)) + ' regression(s)')
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
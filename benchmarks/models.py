@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Compares construction time and memory per object of WordPressPost against
+its compact stand-in from models.compact().
+
+Run from the directory that contains the Sublpress package:
+
+	python -m Sublpress.benchmarks.models [number of posts]
+"""
+import sys, types, time, json, tracemalloc
+import xmlrpc.client as xmlrpc_client
+
+# wordpress_xmlrpc imports the editor modules, which don't exist outside Sublime Text
+for name in ('sublime', 'sublime_plugin'):
+	sys.modules.setdefault(name, types.ModuleType(name))
+
+from ..wordpress_xmlrpc.wordpress import WordPressPost
+from .. import models
+from .parse_posts import make_response
+
+""" Returns the best wall time over a few runs, and the memory held per object by one run """
+def measure(build, structs, runs = 5):
+	best = None
+	for i in range(runs):
+		start = time.perf_counter()
+		build(structs)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best == None else min(best, elapsed)
+
+	tracemalloc.start()
+	objects = build(structs)
+	held = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+
+	return {'seconds': best, 'bytes_per_object': held / float(len(objects))}
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+	# the listing projection is what list views keep alive
+	structs = xmlrpc_client.loads(make_response(count))[0][0]
+	for struct in structs:
+		for key in list(struct.keys()):
+			if key not in ('post_id', 'post_title', 'post_parent', 'post_status', 'post_type', 'post_modified_gmt'):
+				del struct[key]
+
+	compact = models.compact(WordPressPost)
+	results = {
+		'benchmark': 'models',
+		'posts': count,
+		'default': measure(lambda s: [WordPressPost(raw) for raw in s], structs),
+		'compact': measure(lambda s: [compact.from_xmlrpc(raw) for raw in s], structs),
+	}
+
+	for name in ('default', 'compact'):
+		print('%-8s %8.1f ms  %8.0f bytes/object' % (name, results[name]['seconds'] * 1000, results[name]['bytes_per_object']))
+	print(json.dumps(results))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Compares parsing a large wp.getPosts response with the default unmarshaller
+plus WordPressPost against parser.TypedParser.
+
+Run from the directory that contains the Sublpress package:
+
+	python -m Sublpress.benchmarks.parse_posts [number of posts]
+"""
+import sys, types, time, json, tracemalloc
+import xmlrpc.client as xmlrpc_client
+
+# wordpress_xmlrpc imports the editor modules, which don't exist outside Sublime Text
+for name in ('sublime', 'sublime_plugin'):
+	sys.modules.setdefault(name, types.ModuleType(name))
+
+from ..wordpress_xmlrpc.wordpress import WordPressPost
+from .. import parser
+
+""" Returns a wp.getPosts response for count synthetic posts, shaped like WordPress' own """
+def make_response(count):
+	date = xmlrpc_client.DateTime('20130325T10:18:55')
+	content = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 40
+	posts = []
+
+	for i in range(count):
+		posts.append({
+			'post_id': str(i + 1),
+			'post_title': 'Post number %d' % i,
+			'post_date': date,
+			'post_date_gmt': date,
+			'post_modified': date,
+			'post_modified_gmt': date,
+			'post_status': 'publish',
+			'post_type': 'post',
+			'post_name': 'post-number-%d' % i,
+			'post_author': '1',
+			'post_password': '',
+			'post_excerpt': '',
+			'post_content': content,
+			'post_parent': '0',
+			'post_mime_type': '',
+			'link': 'http://example.com/?p=%d' % i,
+			'guid': 'http://example.com/?p=%d' % i,
+			'menu_order': 0,
+			'comment_status': 'open',
+			'ping_status': 'open',
+			'sticky': False,
+			'post_thumbnail': [],
+			'post_format': 'standard',
+			'terms': [{'term_id': '1', 'name': 'Uncategorized', 'slug': 'uncategorized', 'term_group': '0', 'term_taxonomy_id': '1', 'taxonomy': 'category', 'description': '', 'parent': '0', 'count': 1, 'filter': 'raw'}],
+			'custom_fields': [{'id': str(i), 'key': 'views', 'value': str(i * 3)}],
+		})
+
+	return xmlrpc_client.dumps((posts, ), methodresponse = True).encode('utf-8')
+
+""" The current path: generic dicts and lists first, then one WordPressPost per dict """
+def parse_default(data):
+	p, u = xmlrpc_client.getparser()
+	p.feed(data)
+	p.close()
+
+	return [WordPressPost(raw) for raw in u.close()[0]]
+
+""" The typed path: WordPressPost instances straight from expat events """
+def parse_typed(data):
+	typed = parser.TypedParser(WordPressPost)
+	typed.feed(data)
+	typed.close()
+
+	return typed.close()[0]
+
+""" Returns the best wall time over a few runs and the peak memory of one run """
+def measure(fn, data, runs = 5):
+	best = None
+	for i in range(runs):
+		start = time.perf_counter()
+		fn(data)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best == None else min(best, elapsed)
+
+	tracemalloc.start()
+	fn(data)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	return {'seconds': best, 'peak_bytes': peak}
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+	data = make_response(count)
+
+	# both paths have to agree before their speed means anything
+	default, typed = parse_default(data), parse_typed(data)
+	assert [p.struct for p in default] == [p.struct for p in typed]
+
+	results = {
+		'benchmark': 'parse_posts',
+		'posts': count,
+		'response_bytes': len(data),
+		'default': measure(parse_default, data),
+		'typed': measure(parse_typed, data),
+	}
+
+	for name in ('default', 'typed'):
+		print('%-8s %8.1f ms  %8.1f MB peak' % (name, results[name]['seconds'] * 1000, results[name]['peak_bytes'] / 1048576.0))
+	print(json.dumps(results))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Runs Sublpress' main operations against a local FakeWordPress and reports
+latency percentiles, throughput, bytes on the wire and peak memory for each.
+
+Run from the directory that contains the Sublpress package:
+
+	python -m Sublpress.benchmarks.run [--posts 2000] [--latency 0.02] [--ops 50] [--output results.json]
+
+The last line printed, and the --output file, hold the results as JSON so
+two runs can be compared with benchmarks.compare.
+"""
+import sys, os, time, json, argparse, tempfile, tracemalloc, platform, subprocess
+
+# the editor modules have to be in place before anything from the package is imported
+from . import sublime_stub
+sublime_stub.install()
+
+from ..wordpress_xmlrpc.methods.posts import *
+from ..wordpress_xmlrpc.methods.taxonomies import *
+from .. import common, connection, client, store, upload, plugin, wordpress
+
+""" Returns the value below which a fraction of the sorted samples fall """
+def percentile(samples, fraction):
+	if not samples:
+		return 0.0
+
+	index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+	return samples[index]
+
+class Scenario(object):
+	""" One operation to measure, with an optional setup run before every call that isn't timed """
+	def __init__(self, name, op, setup = None):
+		self.name = name
+		self.op = op
+		self.setup = setup
+
+	""" Calls the operation ops times, then a few more with memory tracing on, and returns the measurements """
+	def run(self, wp, ops):
+		samples = []
+		transferred = {}
+
+		for i in range(ops):
+			arg = self.setup(i) if self.setup != None else i
+
+			# only what the operation itself does is counted
+			before = wp.transport.stats.snapshot()
+			start = time.perf_counter()
+			self.op(arg)
+			samples.append(time.perf_counter() - start)
+			after = wp.transport.stats.snapshot()
+
+			for key in after:
+				transferred[key] = transferred.get(key, 0) + after[key] - before[key]
+
+		# memory tracing slows everything down, so it gets its own runs
+		tracemalloc.start()
+		for i in range(min(ops, 3)):
+			self.op(self.setup(i) if self.setup != None else i)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+
+		samples.sort()
+		result = {
+			'ops': ops,
+			'p50_ms': percentile(samples, 0.5) * 1000,
+			'p95_ms': percentile(samples, 0.95) * 1000,
+			'p99_ms': percentile(samples, 0.99) * 1000,
+			'mean_ms': sum(samples) / len(samples) * 1000,
+			'ops_per_second': ops / sum(samples),
+			'peak_bytes': peak,
+		}
+
+		for key in transferred:
+			result[key] = transferred[key] // ops
+
+		return result
+
+""" Builds the scenarios against a connected client """
+def scenarios(wp, args):
+	posts = [str(p.id) for p in store.list_posts(wp, {'post_type': 'post', 'number': args.posts})]
+	window = sublime_stub.windows[0]
+
+	def list_page(i):
+		store.list_posts(wp, {'post_type': 'post', 'number': 50, 'offset': (i * 50) % max(len(posts), 1)})
+
+	def browse(i):
+		# the command shows its quick panel once the first page is in
+		shown = len(window.quick_panels)
+		window.answers.append(-1)
+		command = wordpress.WordpressBrowsePostsCommand(window)
+		command.run(post_type = 'post')
+		sublime_stub.run_pending(lambda: len(window.quick_panels) > shown)
+
+	def get_post(post_id):
+		store.full_post(wp, post_id)
+
+	def forget_post(i):
+		post_id = posts[i % len(posts)]
+		store.full_posts.clear()
+		return post_id
+
+	def open_post(i):
+		post = store.full_post(wp, posts[i % len(posts)])
+		post.title = 'Edited %d' % i
+		return post
+
+	def save_changes(post):
+		changes = store.snapshots.changes(store.site_key(wp), post)
+		wp.call(EditPost(post.id, changes))
+		store.snapshots.commit(store.site_key(wp), post.id, changes)
+
+	def save_full(post):
+		wp.call(EditPost(post.id, post))
+
+	terms = store.term_store(store.site_key(wp), 'category')
+
+	def load_terms(i):
+		terms.clear()
+		terms.fetch(wp)
+
+	def edit_term(i):
+		term = terms.tree()[i % len(terms.tree())][0]
+		wp.call(EditTerm(term.id, {'taxonomy': term.taxonomy, 'name': term.name + ' %d' % i}))
+
+	path = os.path.join(tempfile.mkdtemp(prefix = 'sublpress-upload-'), 'upload.bin')
+	with open(path, 'wb') as f:
+		f.write(os.urandom(args.upload_size))
+
+	def upload_file(i):
+		upload.StreamingUpload(wp, path, 'upload-%d.bin' % i).run()
+
+	return [
+		Scenario('list', list_page),
+		Scenario('browse_command', browse),
+		Scenario('get_post', get_post, forget_post),
+		Scenario('save_changes', save_changes, open_post),
+		Scenario('save_full', save_full, open_post),
+		Scenario('load_terms', load_terms),
+		Scenario('edit_term', edit_term),
+		Scenario('upload', upload_file),
+	]
+
+def main():
+	options = argparse.ArgumentParser(description = 'Benchmark Sublpress against a local stand-in WordPress site.')
+	options.add_argument('--posts', type = int, default = 2000)
+	options.add_argument('--terms', type = int, default = 200)
+	options.add_argument('--content-size', type = int, default = 4000)
+	options.add_argument('--latency', type = float, default = 0.0, help = 'seconds the server waits before every response')
+	options.add_argument('--ops', type = int, default = 30, help = 'calls per scenario')
+	options.add_argument('--upload-size', type = int, default = 1024 * 1024)
+	options.add_argument('--only', nargs = '*', help = 'names of the scenarios to run')
+	options.add_argument('--output', help = 'file to write the JSON results to')
+	args = options.parse_args()
+
+	# the server gets a process of its own so its work and memory stay out of the measurements
+	server = subprocess.Popen([sys.executable, '-m', __package__ + '.server',
+		'--posts', str(args.posts), '--terms', str(args.terms), '--content-size', str(args.content_size), '--latency', str(args.latency)],
+		stdin = subprocess.PIPE, stdout = subprocess.PIPE, universal_newlines = True)
+	url = server.stdout.readline().strip()
+
+	common.sp_settings = sublime_stub.settings
+	common.sp_wp = client.SublpressClient(url, 'admin', 'password', transport = connection.KeepAliveTransport())
+
+	results = {
+		'benchmark': 'suite',
+		'python': platform.python_version(),
+		'posts': args.posts,
+		'terms': args.terms,
+		'latency': args.latency,
+		'scenarios': {},
+	}
+
+	try:
+		for scenario in scenarios(common.sp_wp, args):
+			if args.only and scenario.name not in args.only:
+				continue
+
+			result = scenario.run(common.sp_wp, args.ops)
+			results['scenarios'][scenario.name] = result
+			print('%-16s p50 %8.2f ms  p95 %8.2f ms  %8.1f ops/s  %9d B sent  %9d B received  %8.1f MB peak' % (
+				scenario.name, result['p50_ms'], result['p95_ms'], result['ops_per_second'],
+				result['sent_wire'], result['received_wire'], result['peak_bytes'] / 1048576.0))
+	finally:
+		server.stdin.close()
+		server.wait()
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent = 1, sort_keys = True)
+
+	print(json.dumps(results, sort_keys = True))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for a WordPress XML-RPC endpoint, serving a synthetic site.
+
+Implements the methods Sublpress uses with WordPress' argument order and
+response shapes, over HTTP/1.1 keep-alive with gzip, plus an optional delay
+per request to emulate a remote host:
+
+	site = FakeWordPress(posts = 2000, latency = 0.05).start()
+	... site.url ...
+	site.stop()
+
+or in a process of its own, so it doesn't weigh on what is measured:
+
+	python -m Sublpress.benchmarks.server [--posts 2000] [--latency 0.05]
+
+which prints the URL it listens on once it is ready.
+"""
+import sys, threading, time, random, argparse
+import xmlrpc.client as xmlrpc_client
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from socketserver import ThreadingMixIn
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+	'et dolore magna aliqua wordpress sublime plugin theme cache search editor draft publish').split()
+
+class Handler(SimpleXMLRPCRequestHandler):
+	""" Keeps connections open and waits the configured latency before answering """
+	protocol_version = 'HTTP/1.1'
+	rpc_paths = ('/xmlrpc.php', '/')
+	encode_threshold = 1400
+
+	def do_POST(self):
+		latency = self.server.site.latency
+		if latency:
+			time.sleep(latency)
+
+		self.server.site.requests += 1
+		return SimpleXMLRPCRequestHandler.do_POST(self)
+
+	def log_message(self, *args):
+		pass
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+	daemon_threads = True
+
+class FakeWordPress(object):
+	""" Synthetic WordPress site with posts, terms, options and a media library """
+	def __init__(self, posts = 1000, terms = 100, content_size = 4000, latency = 0.0, seed = 1):
+		self.latency = latency
+		self.requests = 0
+		self.lock = threading.Lock()
+		self.random = random.Random(seed)
+		self.date = xmlrpc_client.DateTime('20130325T10:18:55')
+		self.terms = {}
+		self.posts = {}
+		self.media = {}
+		self.next_id = 1
+
+		for i in range(terms):
+			self.add_term('category' if i % 2 == 0 else 'post_tag', self.words(2).title(), str(i // 10 * 10 + 1) if i % 10 and i % 2 == 0 else '0')
+
+		for i in range(posts):
+			self.add_post('page' if i % 10 == 0 else 'post', self.words(5).title(), self.words(content_size // 6))
+
+		self.server = None
+		self.thread = None
+
+	""" Returns count random words """
+	def words(self, count):
+		return ' '.join(self.random.choice(WORDS) for i in range(count))
+
+	def new_id(self):
+		with self.lock:
+			self.next_id += 1
+			return str(self.next_id)
+
+	def add_term(self, taxonomy, name, parent = '0'):
+		term_id = self.new_id()
+		self.terms[term_id] = {
+			'term_id': term_id, 'name': name, 'slug': name.lower().replace(' ', '-') + '-' + term_id, 'term_group': '0',
+			'term_taxonomy_id': term_id, 'taxonomy': taxonomy, 'description': '', 'parent': parent, 'count': 0, 'filter': 'raw',
+		}
+		return term_id
+
+	def add_post(self, post_type, title, content):
+		post_id = self.new_id()
+		terms = [t for t in self.terms.values() if t['taxonomy'] == 'category'][:1]
+		self.posts[post_id] = {
+			'post_id': post_id, 'post_title': title, 'post_date': self.date, 'post_date_gmt': self.date,
+			'post_modified': self.date, 'post_modified_gmt': self.date, 'post_status': 'publish', 'post_type': post_type,
+			'post_name': title.lower().replace(' ', '-'), 'post_author': '1', 'post_password': '', 'post_excerpt': '',
+			'post_content': content, 'post_parent': '0', 'post_mime_type': '', 'link': 'http://example.com/?p=' + post_id,
+			'guid': 'http://example.com/?p=' + post_id, 'menu_order': 0, 'comment_status': 'open', 'ping_status': 'open',
+			'sticky': False, 'post_thumbnail': [], 'post_format': 'standard', 'terms': terms, 'custom_fields': [],
+		}
+		return post_id
+
+	""" Returns a post limited to the requested fields, the way wp.getPost(s) does """
+	def project(self, post, fields):
+		if not fields:
+			return post
+
+		return dict((k, v) for k, v in post.items() if k in fields or k == 'post_id')
+
+	def get_posts(self, blog_id, username, password, filter = {}, fields = None):
+		posts = [p for p in self.posts.values() if p['post_type'] == filter.get('post_type', 'post')]
+
+		if filter.get('post_status') not in (None, 'any'):
+			posts = [p for p in posts if p['post_status'] == filter['post_status']]
+
+		if filter.get('s'):
+			words = filter['s'].lower().split()
+			posts = [p for p in posts if all(w in (p['post_title'] + ' ' + p['post_content']).lower() for w in words)]
+
+		key = 'post_modified_gmt' if filter.get('orderby') == 'modified' else 'post_date_gmt'
+		posts.sort(key = lambda p: (p[key].value, int(p['post_id'])), reverse = filter.get('order', 'DESC') == 'DESC')
+
+		offset = int(filter.get('offset', 0))
+		number = int(filter.get('number', 10))
+
+		return [self.project(p, fields) for p in posts[offset:offset + number]]
+
+	def get_post(self, blog_id, username, password, post_id, fields = None):
+		if str(post_id) not in self.posts:
+			raise xmlrpc_client.Fault(404, 'Invalid post ID.')
+
+		return self.project(self.posts[str(post_id)], fields)
+
+	def new_post(self, blog_id, username, password, content):
+		post_id = self.add_post(content.get('post_type', 'post'), content.get('post_title', ''), content.get('post_content', ''))
+		self.posts[post_id].update(content)
+		return post_id
+
+	def edit_post(self, blog_id, username, password, post_id, content):
+		if str(post_id) not in self.posts:
+			raise xmlrpc_client.Fault(404, 'Invalid post ID.')
+
+		post = self.posts[str(post_id)]
+		for k, v in content.items():
+			if k == 'terms':
+				post['terms'] = [self.terms[i] for ids in v.values() for i in ids if i in self.terms]
+			else:
+				post[k] = v
+		post['post_modified_gmt'] = xmlrpc_client.DateTime(time.strftime('%Y%m%dT%H:%M:%S', time.gmtime()))
+
+		return True
+
+	def delete_post(self, blog_id, username, password, post_id):
+		return self.posts.pop(str(post_id), None) != None
+
+	def get_taxonomies(self, blog_id, username, password):
+		return [
+			{'name': 'category', 'label': 'Categories', 'hierarchical': True, 'public': True, 'show_ui': True, '_builtin': True, 'labels': {}, 'cap': {}, 'object_type': ['post']},
+			{'name': 'post_tag', 'label': 'Tags', 'hierarchical': False, 'public': True, 'show_ui': True, '_builtin': True, 'labels': {}, 'cap': {}, 'object_type': ['post']},
+		]
+
+	def get_terms(self, blog_id, username, password, taxonomy, filter = {}):
+		return [t for t in self.terms.values() if t['taxonomy'] == taxonomy]
+
+	def new_term(self, blog_id, username, password, content):
+		return self.add_term(content['taxonomy'], content['name'], content.get('parent', '0'))
+
+	def edit_term(self, blog_id, username, password, term_id, content):
+		if str(term_id) not in self.terms:
+			raise xmlrpc_client.Fault(404, 'Invalid term ID.')
+
+		self.terms[str(term_id)].update(content)
+		return True
+
+	def get_options(self, blog_id, username, password, options = []):
+		values = {'software_version': '3.5.1', 'blog_title': 'Benchmark Site', 'blog_url': 'http://example.com', 'time_zone': '0'}
+		return dict((k, {'desc': k, 'value': v, 'readonly': True}) for k, v in values.items() if not options or k in options)
+
+	def upload_file(self, blog_id, username, password, data):
+		media_id = self.new_id()
+		self.media[media_id] = {
+			'attachment_id': media_id, 'date_created_gmt': self.date, 'parent': data.get('post_id', 0), 'link': 'http://example.com/' + data['name'],
+			'title': data['name'], 'caption': '', 'description': '', 'metadata': {'filesize': len(data['bits'].data)}, 'thumbnail': '',
+		}
+		return {'id': media_id, 'file': data['name'], 'url': 'http://example.com/' + data['name'], 'type': data['type']}
+
+	def get_media_library(self, blog_id, username, password, filter = {}):
+		items = sorted(self.media.values(), key = lambda m: int(m['attachment_id']))
+		offset = int(filter.get('offset', 0))
+		return items[offset:offset + int(filter.get('number', 10))]
+
+	def supported_methods(self):
+		return sorted(self.server.funcs.keys())
+
+	""" Starts serving on a free local port in a background thread """
+	def start(self):
+		self.server = Server(('127.0.0.1', 0), Handler, logRequests = False, allow_none = True)
+		self.server.site = self
+		self.server.register_multicall_functions()
+
+		for name, fn in [
+			('wp.getPosts', self.get_posts), ('wp.getPost', self.get_post), ('wp.newPost', self.new_post),
+			('wp.editPost', self.edit_post), ('wp.deletePost', self.delete_post), ('wp.getTaxonomies', self.get_taxonomies),
+			('wp.getTerms', self.get_terms), ('wp.newTerm', self.new_term), ('wp.editTerm', self.edit_term),
+			('wp.getOptions', self.get_options), ('wp.uploadFile', self.upload_file), ('wp.getMediaLibrary', self.get_media_library),
+			('mt.supportedMethods', self.supported_methods),
+		]:
+			self.server.register_function(fn, name)
+
+		self.thread = threading.Thread(target = self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	@property
+	def host(self):
+		return '127.0.0.1:%d' % self.server.server_address[1]
+
+	@property
+	def url(self):
+		return 'http://' + self.host + '/xmlrpc.php'
+
+def main():
+	options = argparse.ArgumentParser(description = 'Serve a synthetic WordPress site over XML-RPC.')
+	options.add_argument('--posts', type = int, default = 1000)
+	options.add_argument('--terms', type = int, default = 100)
+	options.add_argument('--content-size', type = int, default = 4000)
+	options.add_argument('--latency', type = float, default = 0.0)
+	args = options.parse_args()
+
+	site = FakeWordPress(args.posts, args.terms, args.content_size, args.latency).start()
+	print(site.url)
+	sys.stdout.flush()
+
+	# serve until whoever started us closes our stdin
+	sys.stdin.read()
+	site.stop()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Headless stand-ins for the sublime and sublime_plugin modules, so Sublpress'
+commands can be driven outside the editor.
+
+install() has to run before anything from the package is imported. Callbacks
+passed to set_timeout are queued and run by run_pending() on the calling thread,
+the way the editor runs them on its UI thread. Quick and input panels answer
+with whatever was scripted through Window.answers.
+
+The package's command module is only shipped compiled for the editor's Python,
+so install() puts a stand-in for it in place as well.
+"""
+import os, sys, types, time, tempfile, threading, collections, importlib
+
+class Settings(dict):
+	def get(self, key, default = None):
+		return dict.get(self, key, default)
+
+	def has(self, key):
+		return key in self
+
+	def set(self, key, value):
+		self[key] = value
+
+class Region(object):
+	def __init__(self, a, b):
+		self.a = a
+		self.b = b
+
+class View(object):
+	def __init__(self, window = None, content = ''):
+		self.window_ = window
+		self.content = content
+		self.name = ''
+		self.status = {}
+		self.scratch = False
+
+	def window(self):
+		return self.window_
+
+	def set_name(self, name):
+		self.name = name
+
+	def set_syntax_file(self, syntax):
+		pass
+
+	def set_scratch(self, scratch):
+		self.scratch = scratch
+
+	def set_status(self, key, value):
+		self.status[key] = value
+
+	def get_status(self, key):
+		return self.status.get(key, '')
+
+	def erase_status(self, key):
+		self.status.pop(key, None)
+
+	def insert(self, edit, point, text):
+		self.content = self.content[:point] + text + self.content[point:]
+		return len(text)
+
+	def size(self):
+		return len(self.content)
+
+	def substr(self, region):
+		return self.content[region.a:region.b]
+
+	def run_command(self, name, args = None):
+		if name == 'append':
+			self.content += (args or {}).get('characters', '')
+
+class Window(object):
+	def __init__(self):
+		self.views = []
+		self.panels = {}
+		self.commands = []
+		self.quick_panels = []
+		self.answers = collections.deque()
+
+	def active_view(self):
+		return self.views[-1] if self.views else None
+
+	def new_file(self):
+		view = View(self)
+		self.views.append(view)
+		return view
+
+	def open_file(self, path):
+		return self.new_file()
+
+	def get_output_panel(self, name):
+		return self.panels.setdefault(name, View(self))
+
+	def run_command(self, name, args = None):
+		self.commands.append((name, args))
+
+	""" Records the panel and picks the next scripted answer, cancelling if there is none """
+	def show_quick_panel(self, items, on_done, *args, **kwargs):
+		self.quick_panels.append(items)
+		index = self.answers.popleft() if self.answers else -1
+
+		if callable(index):
+			index = index(items)
+
+		set_timeout(lambda: on_done(index), 0)
+
+	def show_input_panel(self, caption, initial, on_done, on_change, on_cancel):
+		text = self.answers.popleft() if self.answers else initial
+		set_timeout(lambda: on_done(text), 0)
+
+# the package the stand-ins are installed for
+package = __name__.rpartition('.')[0].rpartition('.')[0]
+
+class WordpressCommand(object):
+	""" Stand-in for command.WordpressCommand, running API threads and quick panels through the headless editor """
+	prefix = u'\u2713   '
+
+	def __init__(self, *args, **kwargs):
+		self.threads = []
+		self.callback = None
+
+	def is_enabled(self):
+		return importlib.import_module(package + '.common').sp_wp != None
+
+	def add_thread(self, thread):
+		self.threads.append(thread)
+
+	""" Starts the queued threads and hands each result to callback once it is in, like the editor does """
+	def init_threads(self, callback):
+		threads, self.threads = self.threads, []
+		self.callback = callback
+
+		for thread in threads:
+			if not thread.is_alive():
+				thread.start()
+
+		self.handle_threads(threads)
+
+	def handle_threads(self, threads):
+		running = []
+
+		for thread in threads:
+			if thread.is_alive():
+				running.append(thread)
+			elif thread.result != False and thread.result != None:
+				self.callback(thread.result)
+
+		if running:
+			set_timeout(lambda: self.handle_threads(running), 10)
+
+	def show_quick_panel(self, options, done):
+		set_timeout(lambda: windows[0].show_quick_panel(options, done), 0)
+
+class WordpressTextCommand(WordpressCommand):
+	""" Stand-in for command.WordpressTextCommand """
+	pass
+
+# everything the headless editor has been asked to show
+messages = {'status': [], 'error': []}
+settings = Settings()
+windows = [Window()]
+pending = collections.deque()
+pending_lock = threading.Lock()
+cache_dir = tempfile.mkdtemp(prefix = 'sublpress-bench-')
+
+def set_timeout(fn, delay = 0):
+	with pending_lock:
+		pending.append((time.time() + delay / 1000.0, fn))
+
+""" Runs queued callbacks until until() is true or timeout seconds have passed, returns until() """
+def run_pending(until = lambda: False, timeout = 30):
+	deadline = time.time() + timeout
+
+	while time.time() < deadline:
+		if until():
+			return True
+
+		fn = None
+		with pending_lock:
+			now = time.time()
+			for i, (when, callback) in enumerate(pending):
+				if when <= now:
+					fn = callback
+					del pending[i]
+					break
+
+		if fn != None:
+			fn()
+		else:
+			time.sleep(0.001)
+
+	return until()
+
+""" Installs the stand-ins in sys.modules """
+def install():
+	sublime = types.ModuleType('sublime')
+	sublime.Region = Region
+	sublime.set_timeout = set_timeout
+	sublime.status_message = messages['status'].append
+	sublime.error_message = messages['error'].append
+	sublime.load_settings = lambda name: settings
+	sublime.save_settings = lambda name: None
+	sublime.version = lambda: '3126'
+	sublime.platform = lambda: sys.platform
+	sublime.packages_path = lambda: cache_dir
+	sublime.cache_path = lambda: cache_dir
+	sublime.active_window = lambda: windows[0]
+	sublime.windows = lambda: list(windows)
+	sublime.log_commands = lambda flag: None
+
+	sublime_plugin = types.ModuleType('sublime_plugin')
+
+	class WindowCommand(object):
+		def __init__(self, window):
+			self.window = window
+
+	class TextCommand(object):
+		def __init__(self, view):
+			self.view = view
+
+	class ApplicationCommand(object):
+		pass
+
+	class EventListener(object):
+		pass
+
+	sublime_plugin.WindowCommand = WindowCommand
+	sublime_plugin.TextCommand = TextCommand
+	sublime_plugin.ApplicationCommand = ApplicationCommand
+	sublime_plugin.EventListener = EventListener
+
+	sys.modules['sublime'] = sublime
+	sys.modules['sublime_plugin'] = sublime_plugin
+
+	# only the compiled command module ships, which this Python may not be able to load
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	if package and not os.path.exists(os.path.join(root, 'command.py')):
+		command = types.ModuleType(package + '.command')
+		command.WordpressCommand = WordpressCommand
+		command.WordpressTextCommand = WordpressTextCommand
+
+		sys.modules[command.__name__] = command
+		setattr(sys.modules[package], 'command', command)
+
+	return sublime
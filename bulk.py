@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+import os, sys, json, time, threading
+if sys.version_info[0] == 3:
+	import xmlrpc.client as xmlrpc_client
+	from .wordpress_xmlrpc import *
+	from .wordpress_xmlrpc.methods.posts import *
+	from . import common, executor, journal, store
+else:
+	import xmlrpclib as xmlrpc_client
+	from wordpress_xmlrpc import *
+	from wordpress_xmlrpc.methods.posts import *
+	import common, executor, journal, store
+
+# fields asked for when walking a selection, terms only when the selection depends on them
+SELECT_FIELDS = ['post_id', 'post_title']
+
+# seconds to stop sending after the site signals trouble, doubled while it keeps doing so
+BACKOFF_DELAY = 2
+BACKOFF_MAX_DELAY = 120
+
+# times a post is tried while the site is struggling before the job gives up and waits to be resumed
+MAX_ATTEMPTS = 5
+
+# write the checkpoint after this many posts, or this many seconds, whichever comes first
+CHECKPOINT_EVERY = 25
+CHECKPOINT_INTERVAL = 2
+
+""" Returns True if an error means the site is overloaded or unreachable, rather than that it refused the edit """
+def is_overload_error(error):
+	if isinstance(error, xmlrpc_client.ProtocolError) and error.errcode == 429:
+		return True
+
+	return journal.is_offline_error(error)
+
+""" Returns the number of seconds a site asked us to wait through a Retry-After header, or None """
+def retry_after(error):
+	headers = getattr(error, 'headers', None)
+	if headers == None:
+		return None
+
+	# header names come back in whatever case the server sent them
+	for name, value in headers.items():
+		if name.lower() == 'retry-after':
+			try:
+				return max(0, int(value))
+			except (TypeError, ValueError):
+				return None
+
+	return None
+
+""" Returns {post_id, title} for every post matching a GetPosts filter that predicate accepts, called from a worker thread """
+def select_posts(client, filter, predicate = None, fields = SELECT_FIELDS, page_size = 500):
+	selected = []
+	offset = 0
+
+	while True:
+		page = dict(filter)
+		page['number'] = page_size
+		page['offset'] = offset
+
+		posts = client.call(GetPosts(page, fields))
+		for post in posts:
+			if predicate == None or predicate(post):
+				selected.append({'id': str(post.id), 'title': post.title})
+
+		if len(posts) < page_size:
+			return selected
+
+		offset += page_size
+
+""" Returns a predicate that accepts posts carrying the given term """
+def has_term(term_id):
+	return lambda post: str(term_id) in [str(t.id) for t in (post.terms or [])]
+
+""" Returns a short description of a set of changes, naming terms by the names stored along with them """
+def describe(changes):
+	parts = []
+
+	for k, v in sorted(changes.get('fields', {}).items()):
+		parts.append(k + ' = ' + str(v))
+
+	for verb, key in (('add', 'add_terms'), ('remove', 'remove_terms')):
+		for taxonomy, ids in sorted(changes.get(key, {}).items()):
+			names = [changes.get('names', {}).get(i, i) for i in ids]
+			parts.append(verb + ' ' + taxonomy + ' ' + ', '.join(names))
+
+	return '; '.join(parts) or 'nothing'
+
+""" Applies a set of changes to one post, returns False if the post already had them, called from a worker thread """
+def edit_post(client, post_id, changes):
+	content = dict(changes.get('fields', {}))
+	add = changes.get('add_terms', {})
+	remove = changes.get('remove_terms', {})
+
+	# adding or removing a term means sending every other term of its taxonomy too, so fetch what the post has now
+	if add or remove:
+		post = client.call(GetPost(post_id, ['post_id', 'terms']))
+
+		current = {}
+		for term in post.terms or []:
+			current.setdefault(term.taxonomy, []).append(str(term.id))
+
+		terms = {}
+		for taxonomy in set(add) | set(remove):
+			ids = [i for i in current.get(taxonomy, []) if i not in remove.get(taxonomy, [])]
+			ids += [i for i in add.get(taxonomy, []) if i not in ids]
+
+			if sorted(ids) != sorted(current.get(taxonomy, [])):
+				terms[taxonomy] = ids
+
+		if terms:
+			content['terms'] = terms
+
+	if not content:
+		return False
+
+	client.call(EditPost(post_id, content))
+	return True
+
+class AdaptiveLimit(object):
+	"""
+	Number of edits allowed in flight at once, grown additively and cut multiplicatively.
+
+	Every success adds 1/limit, so the limit grows by about one per round of edits. When the site
+	struggles the limit is halved, at most once per round, since the edits that were in flight
+	alongside the one that failed are likely to fail as well.
+	"""
+	def __init__(self, initial = 2, minimum = 1, maximum = 8):
+		self.minimum = minimum
+		self.maximum = maximum
+		self.limit = float(max(minimum, min(initial, maximum)))
+		self.peak = self.limit
+		self.since_decrease = None
+		self.decreases = 0
+
+	""" Returns how many edits may be in flight """
+	def allowed(self):
+		return int(self.limit)
+
+	""" Called when an edit went through """
+	def succeeded(self):
+		self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+		self.peak = max(self.peak, self.limit)
+
+		if self.since_decrease != None:
+			self.since_decrease += 1
+
+	""" Called when the site signalled it is overloaded """
+	def overloaded(self):
+		if self.since_decrease != None and self.since_decrease < self.allowed():
+			return
+
+		self.limit = max(self.minimum, self.limit / 2)
+		self.since_decrease = 0
+		self.decreases += 1
+
+class BulkEdit(object):
+	"""
+	The same changes applied to many posts of one site, as one EditPost per post sent in the background.
+
+	Progress is checkpointed to disk as posts are done, so an interrupted job can be resumed later
+	without editing any post twice. The number of edits in flight adapts to how the site copes, and
+	sending pauses for a while whenever the site reports being overloaded.
+	"""
+	def __init__(self, site, posts, changes, description = '', job_id = None):
+		self.site = site
+		self.posts = posts
+		self.changes = changes
+		self.description = description
+		self.job_id = job_id or time.strftime('%Y%m%d-%H%M%S') + '-%03d' % (time.time() * 1000 % 1000)
+		self.created = time.time()
+		self.results = {}
+		self.lock = threading.RLock()
+		self.limit = None
+		self.client = None
+		self.pool = None
+		self.queue = []
+		self.running = {}
+		self.attempts = {}
+		self.paused = False
+		self.timer = None
+		self.backoff = BACKOFF_DELAY
+		self.slowdowns = 0
+		self.cancelled = False
+		self.interrupted = None
+		self.started = None
+		self.finished = None
+		self.since_checkpoint = 0
+		self.checkpointed = 0
+		self.on_progress = None
+		self.on_done = None
+		self.path = os.path.join(common.cache_path(site, 'bulk'), self.job_id + '.json')
+
+	""" Reads a job back from its checkpoint """
+	@classmethod
+	def load(cls, path):
+		with open(path, 'r') as f:
+			data = json.load(f)
+
+		job = cls(data['site'], data['posts'], data['changes'], data.get('description', ''), data['job_id'])
+		job.created = data.get('created', job.created)
+		job.results = data.get('results', {})
+		job.path = path
+
+		return job
+
+	""" Writes the job and what has been done so far to disk """
+	def checkpoint(self):
+		with self.lock:
+			data = {
+				'site': self.site,
+				'job_id': self.job_id,
+				'created': self.created,
+				'description': self.description,
+				'changes': self.changes,
+				'posts': self.posts,
+				'results': dict(self.results),
+			}
+			self.since_checkpoint = 0
+			self.checkpointed = time.time()
+
+			tmp = self.path + '.tmp'
+			with open(tmp, 'w') as f:
+				json.dump(data, f)
+
+			# replace the old file in one go so a crash never leaves half a checkpoint behind
+			if os.path.exists(self.path):
+				os.remove(self.path)
+			os.rename(tmp, self.path)
+
+	""" Removes the checkpoint, once the job is no longer wanted """
+	def forget(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+	""" Returns the ids of the posts still to be edited, including the ones that failed if retry_failed """
+	def remaining(self, retry_failed = False):
+		with self.lock:
+			return [p['id'] for p in self.posts if p['id'] not in self.results or (retry_failed and self.results[p['id']]['status'] == 'failed')]
+
+	""" Returns how many posts ended up in each status """
+	def counts(self):
+		counts = {'updated': 0, 'unchanged': 0, 'failed': 0, 'remaining': 0}
+
+		with self.lock:
+			for post in self.posts:
+				result = self.results.get(post['id'])
+				counts[result['status'] if result != None else 'remaining'] += 1
+
+		return counts
+
+	""" Returns True while posts are being sent """
+	def is_running(self):
+		return self.started != None and self.finished == None
+
+	"""
+	Starts editing the remaining posts on pool, with the number in flight kept between 1 and concurrency.
+	on_progress(job) and on_done(job) are called from worker threads.
+	"""
+	def run(self, client, pool, concurrency = 8, retry_failed = False, on_progress = None, on_done = None):
+		with self.lock:
+			self.client = client
+			self.pool = pool
+			self.limit = AdaptiveLimit(2, 1, concurrency)
+			self.on_progress = on_progress
+			self.on_done = on_done
+			self.queue = self.remaining(retry_failed)
+			self.started = time.time()
+			self.finished = None
+			self.cancelled = False
+			self.interrupted = None
+			self.paused = False
+			self.attempts = {}
+
+			for post_id in self.queue:
+				self.results.pop(post_id, None)
+
+		self.checkpoint()
+		self.pump()
+
+	""" Stops sending, the posts not done yet stay in the checkpoint """
+	def cancel(self):
+		with self.lock:
+			self.cancelled = True
+			self.queue = []
+
+			if self.timer != None:
+				self.timer.cancel()
+				self.timer = None
+
+		self.check_done()
+
+	""" Starts as many edits as the current limit allows """
+	def pump(self):
+		with self.lock:
+			sending = not (self.paused or self.cancelled or self.interrupted != None)
+
+			while sending and self.queue and len(self.running) < self.limit.allowed():
+				post_id = self.queue.pop(0)
+				self.running[post_id] = time.time()
+
+				future = self.pool.submit(edit_post, (self.client, post_id, self.changes), executor.BACKGROUND)
+				future.add_done_callback(lambda f, post_id = post_id: self.edited(post_id, f))
+
+		self.check_done()
+
+	""" Called when an edit has gone through or failed """
+	def edited(self, post_id, future):
+		error = future.error
+
+		with self.lock:
+			self.running.pop(post_id, None)
+
+			if error == None:
+				self.limit.succeeded()
+				self.backoff = BACKOFF_DELAY
+				self.record(post_id, 'updated' if future.value else 'unchanged')
+			elif is_overload_error(error):
+				self.attempts[post_id] = self.attempts.get(post_id, 0) + 1
+
+				if self.attempts[post_id] >= MAX_ATTEMPTS:
+					# the site isn't coming back any time soon, keep the rest for a resume
+					self.interrupted = error
+					self.queue.insert(0, post_id)
+				else:
+					# try it again first, once the site had a moment to recover
+					self.queue.insert(0, post_id)
+					self.limit.overloaded()
+					self.pause(retry_after(error))
+			else:
+				self.record(post_id, 'failed', error)
+
+			if self.since_checkpoint >= CHECKPOINT_EVERY or time.time() - self.checkpointed >= CHECKPOINT_INTERVAL:
+				self.checkpoint()
+
+		if self.on_progress != None:
+			self.on_progress(self)
+
+		self.pump()
+
+	""" Stores the outcome for a post, with the lock held """
+	def record(self, post_id, status, error = None):
+		result = {'status': status}
+		if error != None:
+			result['error'] = type(error).__name__ + ': ' + str(error)
+
+		self.results[post_id] = result
+		self.since_checkpoint += 1
+
+		# a later GetPost must not be answered with the post as it was
+		if self.client != None:
+			store.full_posts.discard((store.site_key(self.client), post_id))
+
+	""" Stops sending for a while, with the lock held """
+	def pause(self, delay = None):
+		if self.paused:
+			return
+
+		self.paused = True
+		self.slowdowns += 1
+		self.timer = threading.Timer(delay if delay != None else self.backoff, self.resume)
+		self.timer.daemon = True
+		self.timer.start()
+
+		self.backoff = min(self.backoff * 2, BACKOFF_MAX_DELAY)
+
+	""" Starts sending again after a pause """
+	def resume(self):
+		with self.lock:
+			self.paused = False
+			self.timer = None
+
+		self.pump()
+
+	""" Finishes the job once nothing is left to send or in flight """
+	def check_done(self):
+		with self.lock:
+			if self.finished != None or self.running:
+				return
+
+			if self.queue and not self.cancelled and self.interrupted == None:
+				return
+
+			self.finished = time.time()
+
+		self.checkpoint()
+
+		if self.on_done != None:
+			self.on_done(self)
+
+	""" Returns a plain text summary of the job, with every post that failed """
+	def report(self):
+		counts = self.counts()
+		lines = [
+			'Bulk edit ' + self.job_id + (': ' + self.description if self.description else ''),
+			'Changes: ' + describe(self.changes),
+			'',
+			'%d posts: %d updated, %d already up to date, %d failed, %d not done' % (
+				len(self.posts), counts['updated'], counts['unchanged'], counts['failed'], counts['remaining']),
+		]
+
+		if self.started != None and self.finished != None:
+			took = max(self.finished - self.started, 0.001)
+			done = counts['updated'] + counts['unchanged'] + counts['failed']
+			lines.append('Took %.1f s, %.1f posts/s' % (took, done / took))
+
+		if self.limit != None:
+			lines.append('Concurrency ended at %d, peaked at %d, cut %d times, paused %d times by the site' % (
+				self.limit.allowed(), int(self.limit.peak), self.limit.decreases, self.slowdowns))
+
+		if self.cancelled:
+			lines.append('Cancelled, the posts not done yet can be edited by resuming the job.')
+		elif self.interrupted != None:
+			lines.append('Stopped because the site kept failing (' + str(self.interrupted) + '), resume the job to finish it.')
+
+		titles = dict((p['id'], p['title']) for p in self.posts)
+		failed = [(post_id, r) for post_id, r in sorted(self.results.items()) if r['status'] == 'failed']
+		if failed:
+			lines.append('')
+			lines.append('Failed:')
+			for post_id, result in failed:
+				lines.append('  ' + post_id + ' ' + titles.get(post_id, '') + ': ' + result.get('error', ''))
+
+		return '\n'.join(lines) + '\n'
+
+""" Returns the jobs of a site that still have posts left to edit, newest first """
+def unfinished(site):
+	jobs = []
+	directory = common.cache_path(site, 'bulk')
+
+	for name in sorted(os.listdir(directory), reverse = True):
+		if not name.endswith('.json'):
+			continue
+
+		try:
+			job = BulkEdit.load(os.path.join(directory, name))
+		except (ValueError, KeyError):
+			continue
+
+		if job.remaining(retry_failed = True):
+			jobs.append(job)
+
+	return jobs
+
+# bulk edits get their own threads so they can't starve the commands waiting on the shared pool
+pool = executor.WorkerPool(8)
+
+# jobs running right now, by job id
+running = {}
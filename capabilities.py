@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os, sys, json, hashlib, time
+if sys.version_info[0] == 3:
+	from . import common
+else:
+	import common
+
+# the blog options kept alongside the supported methods
+BLOG_OPTIONS = ['software_version', 'blog_title', 'blog_url', 'time_zone']
+
+""" Returns a fingerprint of a server's WordPress version and the methods it supports """
+def fingerprint_of(version, methods):
+	digest = hashlib.sha1('\n'.join(sorted(methods)).encode('utf-8')).hexdigest()
+
+	return str(version or 'unknown') + ':' + digest[:12]
+
+class Capabilities(object):
+	""" What a site's XML-RPC endpoint supports and a few facts about the blog, cached on disk between sessions """
+	def __init__(self, site):
+		self.site = site
+		self.fingerprint = None
+		self.methods = None
+		self.blog = {}
+		self.checked = 0
+		self.path = os.path.join(common.cache_path(site), 'capabilities.json')
+		self.load()
+
+	""" Reads the cached capabilities back from disk """
+	def load(self):
+		if not os.path.exists(self.path):
+			return
+
+		try:
+			with open(self.path, 'r') as f:
+				data = json.load(f)
+		except ValueError:
+			return
+
+		self.fingerprint = data.get('fingerprint')
+		self.methods = data.get('methods')
+		self.blog = data.get('blog', {})
+		self.checked = data.get('checked', 0)
+
+	""" Writes the capabilities to disk """
+	def save(self):
+		tmp = self.path + '.tmp'
+
+		with open(tmp, 'w') as f:
+			json.dump({'fingerprint': self.fingerprint, 'methods': self.methods, 'blog': self.blog, 'checked': self.checked}, f)
+
+		# replace the old file in one go so a crash never leaves half a cache behind
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		os.rename(tmp, self.path)
+
+	""" Stores what the server just reported, returns True if it differs from what was cached """
+	def update(self, methods, blog):
+		fingerprint = fingerprint_of(blog.get('software_version'), methods)
+		changed = fingerprint != self.fingerprint
+
+		self.fingerprint = fingerprint
+		self.methods = list(methods)
+		self.blog = blog
+		self.checked = time.time()
+		self.save()
+
+		return changed
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+import sys, time
+if sys.version_info[0] == 3:
+	from .wordpress_xmlrpc.base import *
+	from .wordpress_xmlrpc.exceptions import *
+	from .wordpress_xmlrpc.methods.options import GetOptions
+	from . import connection, models, capabilities, metrics, session, reporting
+	import xmlrpc.client as xmlrpc_client
+else:
+	from wordpress_xmlrpc.base import *
+	from wordpress_xmlrpc.exceptions import *
+	from wordpress_xmlrpc.methods.options import GetOptions
+	import connection, models, capabilities, metrics, session, reporting
+	import xmlrpclib as xmlrpc_client
+
+class BatchResult(list):
+	""" List of results returned by a multicall, in the same order as the methods that were sent """
+	pass
+
+class Prebuilt(object):
+	""" Stands in for an XmlrpcMethod whose response is parsed straight into its results_class """
+	def __init__(self, method):
+		self.method = method
+		self.method_name = method.method_name
+
+	def get_args(self, client):
+		return self.method.get_args(client)
+
+	def process_result(self, raw_result):
+		return raw_result
+
+class Timed(object):
+	""" Stands in for an XmlrpcMethod, recording how long turning its response into objects takes """
+	def __init__(self, method):
+		self.method = method
+		self.method_name = method.method_name
+
+	def get_args(self, client):
+		return self.method.get_args(client)
+
+	def process_result(self, raw_result):
+		start = time.time()
+		try:
+			return self.method.process_result(raw_result)
+		finally:
+			metrics.calls.phase('convert', time.time() - start)
+
+""" Returns True if a method only wraps its response in results_class, so it can be parsed into it directly """
+def builds_results(method):
+	if method.results_class == None:
+		return False
+
+	for cls in type(method).__mro__:
+		if 'process_result' in cls.__dict__:
+			return cls is XmlrpcMethod
+
+	return False
+
+class SublpressClient(Client):
+	""" WordPress XML-RPC client with the extra features Sublpress needs on top of wordpress_xmlrpc """
+	def __init__(self, url, username, password, blog_id = 0, transport = None, typed_parsing = True, capabilities = None):
+		self.typed_parsing = typed_parsing and isinstance(transport, connection.KeepAliveTransport)
+		self.url = url
+		self.username = username
+		self.password = password
+		self.blog_id = blog_id
+		self.capabilities = capabilities
+		self.revalidated = False
+		self.session = session.SessionCache()
+
+		# wordpress_xmlrpc's Client always creates its own transport, so the server proxy is set up here instead
+		try:
+			self.transport = transport or OurTransport()
+			self.server = xmlrpc_client.ServerProxy(url, transport = self.transport, allow_none = True, verbose = False)
+
+			# a cached list of methods saves a round trip, revalidate() checks it later
+			if capabilities != None and capabilities.methods != None:
+				self.supported_methods = capabilities.methods
+			else:
+				self.supported_methods = self.server.mt.supportedMethods()
+				self.revalidated = True
+		except xmlrpc_client.ProtocolError:
+			e = sys.exc_info()[1]
+			reporting.error('Server connection error.')
+			raise ServerConnectionError(repr(e))
+
+	""" Asks the server what it supports and refreshes the cached capabilities, returns True if they changed """
+	def revalidate(self):
+		self.revalidated = True
+		self.supported_methods = self.server.mt.supportedMethods()
+
+		if self.capabilities == None:
+			return False
+
+		blog = {}
+		if 'wp.getOptions' in self.supported_methods:
+			for option in super(SublpressClient, self).call(GetOptions(capabilities.BLOG_OPTIONS)):
+				blog[option.name] = option.value
+
+		return self.capabilities.update(self.supported_methods, blog)
+
+	""" Returns the cached facts about the blog, e.g. its title and WordPress version """
+	@property
+	def blog(self):
+		if self.capabilities == None:
+			return {}
+
+		return self.capabilities.blog
+
+	""" Calls an XmlrpcMethod, parsing its response straight into model objects when possible, or into their compact stand-ins """
+	def call(self, method, compact = False):
+		started = metrics.calls.begin(method.method_name)
+
+		try:
+			result = self.call_method(method, compact)
+		except Exception as e:
+			if started:
+				metrics.calls.end(e)
+			raise
+		finally:
+			# even a failed write may have changed something on the site
+			self.session.written(method)
+
+		if started:
+			metrics.calls.end()
+
+		return result
+
+	""" Calls an XmlrpcMethod, reusing the result of a recent identical lookup if there is one """
+	def cached_call(self, method):
+		return self.session.lookup(method, self.call)
+
+	""" Loads the given lookups into the session cache in a single round trip, skipping any the site doesn't support """
+	def prefetch(self, methods):
+		methods = [m for m in methods if self.supports(m.method_name)]
+
+		# a lone lookup is sent on its own so it still goes through the typed parser
+		if len(methods) == 1:
+			return self.session.warm(methods, lambda methods: [self.call(methods[0])])
+
+		return self.session.warm(methods, self.multicall)
+
+	""" Does the work of call(), which records how long it took """
+	def call_method(self, method, compact):
+		# the cached methods may be out of date, so check with the server once before giving up on one
+		if method.method_name not in self.supported_methods and not self.revalidated:
+			self.revalidate()
+
+		if not builds_results(method):
+			return super(SublpressClient, self).call(Timed(method))
+
+		# without the typed parser, compact objects are built from the generic response
+		if not self.typed_parsing:
+			if not compact:
+				return super(SublpressClient, self).call(Timed(method))
+
+			raw_result = super(SublpressClient, self).call(Prebuilt(method))
+			cls = models.compact(method.results_class)
+
+			start = time.time()
+			try:
+				if type(raw_result) is list:
+					return [cls.from_xmlrpc(raw) for raw in raw_result]
+				return cls.from_xmlrpc(raw_result)
+			finally:
+				metrics.calls.phase('convert', time.time() - start)
+
+		connection.hints.results_class = method.results_class
+		connection.hints.compact = compact
+		try:
+			return super(SublpressClient, self).call(Prebuilt(method))
+		finally:
+			connection.hints.results_class = None
+
+	""" Returns True if the server advertises support for the given XML-RPC method """
+	def supports(self, method_name):
+		if method_name not in (self.supported_methods or []) and not self.revalidated:
+			self.revalidate()
+
+		return method_name in (self.supported_methods or [])
+
+	""" Calls several XmlrpcMethods in a single system.multicall round trip """
+	def multicall(self, methods):
+		started = metrics.calls.begin('system.multicall')
+
+		try:
+			results = self.multicall_methods(methods)
+		except Exception as e:
+			if started:
+				metrics.calls.end(e)
+			raise
+		finally:
+			for method in methods:
+				self.session.written(method)
+
+		if started:
+			metrics.calls.end()
+
+		return results
+
+	""" Does the work of multicall(), which records how long it took """
+	def multicall_methods(self, methods):
+		results = BatchResult()
+
+		# fall back to one call per method if the server can't batch
+		if not self.supports('system.multicall'):
+			for method in methods:
+				try:
+					results.append(self.call(method))
+				except (xmlrpc_client.Fault, UnsupportedXmlrpcMethodError) as e:
+					results.append(e)
+			return results
+
+		calls = []
+		for method in methods:
+			calls.append({'methodName': method.method_name, 'params': list(method.get_args(self))})
+
+		raw_results = self.server.system.multicall(calls)
+
+		# each entry is either a one item list with the result, or a fault struct
+		for method, raw in zip(methods, raw_results):
+			if type(raw) is dict:
+				results.append(xmlrpc_client.Fault(raw.get('faultCode'), raw.get('faultString')))
+			else:
+				results.append(Timed(method).process_result(raw[0]))
+
+		return results
+
+	""" Returns a context manager that collects methods and sends them as one multicall when it exits """
+	def batch(self):
+		return Batch(self)
+
+class Batch(object):
+	""" Collects XmlrpcMethods to be sent together through SublpressClient.multicall """
+	def __init__(self, client):
+		self.client = client
+		self.methods = []
+		self.results = None
+
+	""" Queues a method and returns its position in the results """
+	def add(self, method):
+		self.methods.append(method)
+		return len(self.methods) - 1
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type == None and self.methods:
+			self.results = self.client.multicall(self.methods)
+
+		return False
@@ -1,6 +1,22 @@
 # -*- coding: utf-8 -*-
 import sublime, sublime_plugin
+import os
 
 sp_wp = None
+sp_site = None
 sp_settings = None
 sp_started = False
+
+""" Returns the directory Sublpress keeps its local caches in, creating it if needed """
+def cache_path(*parts):
+	# Sublime Text 2 has no dedicated cache directory
+	if hasattr(sublime, 'cache_path'):
+		base = os.path.join(sublime.cache_path(), 'Sublpress')
+	else:
+		base = os.path.join(sublime.packages_path(), 'User', 'Sublpress.cache')
+
+	path = os.path.join(base, *parts)
+	if not os.path.exists(path):
+		os.makedirs(path)
+
+	return path
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+import sys, re, errno, socket, threading, time, zlib
+if sys.version_info[0] == 3:
+	import http.client as httplib
+	import xmlrpc.client as xmlrpc_client
+	from . import parser, metrics
+else:
+	import httplib
+	import xmlrpclib as xmlrpc_client
+	from wordpress_xmlrpc.base import sublUnmarshaller
+	import parser, metrics
+
+class ConnectionPool(object):
+	""" Thread-safe pool of reusable HTTP/1.1 keep-alive connections, kept per host """
+	def __init__(self, max_size = 4, idle_timeout = 30, timeout = 60):
+		self.max_size = max_size
+		self.idle_timeout = idle_timeout
+		self.timeout = timeout
+		self.lock = threading.Lock()
+		self.idle = {}
+
+	""" Returns a (connection, reused) tuple for the given host, opening a new connection if no idle one is usable """
+	def get(self, scheme, host):
+		key = (scheme, host)
+		now = time.time()
+
+		with self.lock:
+			conns = self.idle.get(key, [])
+
+			# take the most recently used connection that hasn't been idle for too long
+			while conns:
+				conn, last_used = conns.pop()
+				if now - last_used < self.idle_timeout:
+					return conn, True
+				conn.close()
+
+		return self.create(scheme, host), False
+
+	""" Opens a new connection to the given host """
+	def create(self, scheme, host):
+		if scheme == 'https':
+			return httplib.HTTPSConnection(host, timeout = self.timeout)
+
+		return httplib.HTTPConnection(host, timeout = self.timeout)
+
+	""" Hands a connection back to the pool once its response has been fully read """
+	def put(self, scheme, host, conn):
+		key = (scheme, host)
+		now = time.time()
+
+		with self.lock:
+			conns = self.idle.setdefault(key, [])
+
+			# evict anything that has gone stale while sitting in the pool
+			for stale in [c for c in conns if now - c[1] >= self.idle_timeout]:
+				conns.remove(stale)
+				stale[0].close()
+
+			if len(conns) < self.max_size:
+				conns.append((conn, now))
+				return
+
+		conn.close()
+
+	""" Closes all idle connections, or only the ones for a specific host """
+	def clear(self, host = None):
+		with self.lock:
+			for key in list(self.idle.keys()):
+				if host != None and key[1] != host:
+					continue
+
+				for conn, last_used in self.idle.pop(key):
+					conn.close()
+
+# how much of a response is read and decoded at a time
+READ_SIZE = 64 * 1024
+
+# request bodies smaller than this aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+class TransferStats(object):
+	""" Thread-safe counters of the bytes a transport sent and received, as sent over the wire and as decoded """
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.sent_wire = 0
+		self.sent_raw = 0
+		self.received_wire = 0
+		self.received_raw = 0
+
+	def add_sent(self, wire, raw):
+		with self.lock:
+			self.sent_wire += wire
+			self.sent_raw += raw
+
+	def add_received(self, wire, raw):
+		with self.lock:
+			self.received_wire += wire
+			self.received_raw += raw
+
+	""" Returns a snapshot of the counters """
+	def snapshot(self):
+		with self.lock:
+			return {
+				'sent_wire': self.sent_wire,
+				'sent_raw': self.sent_raw,
+				'received_wire': self.received_wire,
+				'received_raw': self.received_raw,
+			}
+
+	""" Returns a one line description of the counters and how much compression saved """
+	def summary(self):
+		stats = self.snapshot()
+		wire = stats['sent_wire'] + stats['received_wire']
+		raw = stats['sent_raw'] + stats['received_raw']
+		saved = 0 if raw == 0 else 100 - wire * 100 // raw
+
+		return 'Sent %(sent_wire)d bytes (%(sent_raw)d decoded), received %(received_wire)d bytes (%(received_raw)d decoded)' % stats + ', ' + str(saved) + '% saved'
+
+""" Returns a decompressor for a Content-Encoding, or None if the response isn't compressed """
+def decoder_for(encoding):
+	encoding = (encoding or '').strip().lower()
+
+	if encoding in ('gzip', 'x-gzip'):
+		return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+	if encoding == 'deflate':
+		return DeflateDecoder()
+
+	return None
+
+class DeflateDecoder(object):
+	""" Decodes "deflate" responses, which some servers send raw and others wrapped in a zlib header """
+	def __init__(self):
+		self.decoder = None
+		self.head = b''
+
+	def decompress(self, data):
+		if self.decoder == None:
+			self.head += data
+
+			# need the first two bytes to tell the formats apart
+			if len(self.head) < 2:
+				return b''
+
+			data, self.head = self.head, b''
+			wbits = zlib.MAX_WBITS
+			if (ord(data[0:1]) & 0x0f) != 8 or (ord(data[0:1]) * 256 + ord(data[1:2])) % 31 != 0:
+				wbits = -zlib.MAX_WBITS
+			self.decoder = zlib.decompressobj(wbits)
+
+		return self.decoder.decompress(data)
+
+	def flush(self):
+		if self.decoder == None:
+			return b''
+
+		return self.decoder.flush()
+
+""" Returns data gzipped in one go """
+def gzip_bytes(data):
+	compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	return compressor.compress(data) + compressor.flush()
+
+METHOD_NAME_RE = re.compile(b'<methodName>([^<]+)</methodName>')
+
+""" Returns the name of the method an XML-RPC request calls """
+def method_name_of(request_body):
+	match = METHOD_NAME_RE.search(request_body[:512])
+	if match == None:
+		return 'unknown'
+
+	return match.group(1).decode('utf-8')
+
+# socket errors meaning the server dropped the connection, e.g. an idle keep-alive one it timed out
+CLOSED_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+class ConnectionClosed(Exception):
+	""" Raised when the server closed a connection before any of the response came back """
+	def __init__(self, error):
+		Exception.__init__(self, str(error))
+		self.error = error
+
+""" Returns True if an error means the connection was closed under us, rather than the server failing or being slow to answer """
+def is_closed_error(error):
+	if isinstance(error, httplib.BadStatusLine):
+		return True
+
+	if isinstance(error, socket.timeout):
+		return False
+
+	return isinstance(error, socket.error) and getattr(error, 'errno', None) in CLOSED_ERRNOS
+
+# shared by every client so worker threads reuse each other's sockets
+pool = ConnectionPool()
+
+# per thread, the model class the response currently awaited should be parsed into
+hints = threading.local()
+
+class KeepAliveTransport(xmlrpc_client.Transport):
+	""" XML-RPC transport that sends requests over pooled keep-alive connections """
+	def __init__(self, scheme = 'http', pool = pool, use_datetime = 0, accept_compressed = True, compress_requests = False):
+		xmlrpc_client.Transport.__init__(self, use_datetime)
+		self.scheme = scheme
+		self.pool = pool
+		self.accept_compressed = accept_compressed
+		self.compress_requests = compress_requests
+		self.stats = TransferStats()
+
+	""" Called by ServerProxy for every XML-RPC call """
+	def request(self, host, handler, request_body, verbose = 0):
+		if not isinstance(request_body, bytes):
+			request_body = request_body.encode('utf-8')
+		method_name = method_name_of(request_body)
+
+		if self.compress_requests and len(request_body) >= COMPRESS_MIN_SIZE:
+			raw_length = len(request_body)
+			request_body = gzip_bytes(request_body)
+			return self.stream_request(host, handler, lambda: [request_body], len(request_body), [('Content-Encoding', 'gzip')], raw_length, method_name)
+
+		return self.stream_request(host, handler, lambda: [request_body], len(request_body), method_name = method_name)
+
+	"""
+	Sends a request whose body is produced chunk by chunk by calling body(), so it never has to be held in memory.
+	Streamed bodies are sent as they are, since their compressed length can't be known up front.
+	"""
+	def stream_request(self, host, handler, body, length, headers = None, raw_length = None, method_name = 'unknown'):
+		chost, extra_headers, x509 = self.get_host_info(host)
+		extra_headers = list(extra_headers or []) + list(headers or [])
+		self.stats.add_sent(length, raw_length or length)
+
+		# calls made through the client are already being recorded
+		started = metrics.calls.begin(method_name)
+		metrics.calls.count('request_bytes', length)
+
+		try:
+			result = self.send_request(chost, handler, body, length, extra_headers)
+		except Exception as e:
+			if started:
+				metrics.calls.end(e)
+			raise
+
+		if started:
+			metrics.calls.end()
+
+		return result
+
+	""" Sends a request over a pooled connection """
+	def send_request(self, host, handler, body, length, extra_headers):
+		conn, reused = self.pool.get(self.scheme, host)
+
+		try:
+			return self.single_request(conn, host, handler, body(), length, extra_headers)
+		except ConnectionClosed as e:
+			conn.close()
+			if not reused:
+				raise e.error
+		except (socket.error, httplib.HTTPException):
+			# the server may have acted on the request already, so sending it again could duplicate a write
+			conn.close()
+			raise
+
+		# a pooled socket the server closed while idle never got to the request, so it is safe to send once more on a fresh one
+		conn = self.pool.create(self.scheme, host)
+
+		try:
+			return self.single_request(conn, host, handler, body(), length, extra_headers)
+		except ConnectionClosed as e:
+			conn.close()
+			raise e.error
+		except (socket.error, httplib.HTTPException):
+			conn.close()
+			raise
+
+	""" Sends a request over the given connection and parses the response """
+	def single_request(self, conn, host, handler, chunks, length, extra_headers = None):
+		headers = [
+			('Content-Type', 'text/xml'),
+			('User-Agent', self.user_agent),
+			('Connection', 'keep-alive'),
+			('Content-Length', str(length)),
+		]
+
+		if self.accept_compressed:
+			headers.append(('Accept-Encoding', 'gzip, deflate'))
+
+		# connect separately so the time it takes can be told apart
+		if conn.sock == None:
+			start = time.time()
+			conn.connect()
+			metrics.calls.phase('connect', time.time() - start)
+
+		start = time.time()
+
+		try:
+			# httplib would otherwise add its own Accept-Encoding: identity
+			conn.putrequest('POST', handler, skip_accept_encoding = self.accept_compressed)
+			for k, v in headers + list(extra_headers or []):
+				conn.putheader(k, v)
+			conn.endheaders()
+
+			for chunk in chunks:
+				conn.send(chunk)
+
+			sent = time.time()
+			metrics.calls.phase('send', sent - start)
+
+			response = conn.getresponse()
+		except (socket.error, httplib.HTTPException) as e:
+			# no response came back, so whether the request can be sent again depends on how the connection went
+			if is_closed_error(e):
+				raise ConnectionClosed(e)
+			raise
+
+		metrics.calls.phase('ttfb', time.time() - sent)
+
+		if response.status != 200:
+			response.read()
+			conn.close()
+			raise xmlrpc_client.ProtocolError(host + handler, response.status, response.reason, dict(response.getheaders()))
+
+		try:
+			result = self.parse_response(response)
+		except:
+			# whatever is left of the response would be read as the next one
+			conn.close()
+			raise
+
+		# only recycle the connection if the server agreed to keep it open
+		if response.will_close:
+			conn.close()
+		else:
+			self.pool.put(self.scheme, host, conn)
+
+		return result
+
+	""" Reads a response bit by bit, decompressing it on the fly and feeding it to the parser as it goes """
+	def parse_response(self, response):
+		p, u = self.getparser()
+		decoder = decoder_for(response.getheader('Content-Encoding'))
+
+		transfer = parse = 0
+
+		while True:
+			start = time.time()
+			data = response.read(READ_SIZE)
+			read = time.time()
+			transfer += read - start
+
+			if not data:
+				break
+
+			wire = len(data)
+			if decoder != None:
+				data = decoder.decompress(data)
+
+			self.stats.add_received(wire, len(data))
+			metrics.calls.count('response_bytes', wire)
+			metrics.calls.count('decoded_bytes', len(data))
+			if data:
+				p.feed(data)
+			parse += time.time() - read
+
+		start = time.time()
+
+		if decoder != None:
+			data = decoder.flush()
+			self.stats.add_received(0, len(data))
+			metrics.calls.count('decoded_bytes', len(data))
+			if data:
+				p.feed(data)
+
+		p.close()
+		result = u.close()
+
+		metrics.calls.phase('transfer', transfer)
+		metrics.calls.phase('parse', parse + time.time() - start)
+
+		return result
+
+	""" Returns the parser and unmarshaller used for responses """
+	def getparser(self, use_datetime = 0):
+		# build model objects straight from the response when the caller asked for it
+		results_class = getattr(hints, 'results_class', None)
+		if results_class != None:
+			typed = parser.TypedParser(results_class, getattr(hints, 'compact', False))
+			return typed, typed
+
+		# match the unmarshaller wordpress_xmlrpc uses on Python 2
+		if sys.version_info[0] == 3:
+			return xmlrpc_client.Transport.getparser(self)
+
+		target = sublUnmarshaller(use_datetime = use_datetime)
+		return xmlrpc_client.ExpatParser(target), target
+
+	""" Called by ServerProxy when it is closed """
+	def close(self):
+		pass
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import sys, threading, itertools
+if sys.version_info[0] == 3:
+	import queue
+else:
+	import Queue as queue
+
+# priority lanes, lower numbers are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+class CancelledError(Exception):
+	""" Raised when asking for the result of a cancelled future """
+	pass
+
+class Future(object):
+	""" Result of a job submitted to a WorkerPool """
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.event = threading.Event()
+		self.callbacks = []
+		self.value = None
+		self.error = None
+		self.cancelled = False
+		self.started = False
+
+	""" Returns True once the job has finished, failed or been cancelled """
+	def done(self):
+		return self.event.is_set()
+
+	""" Cancels the job if it hasn't started yet, returns True on success """
+	def cancel(self):
+		with self.lock:
+			if self.done() or self.cancelled:
+				return self.cancelled
+
+			# a running job can't be stopped, it finishes and reports as usual
+			if self.started:
+				return False
+
+			self.cancelled = True
+
+		self.finish()
+		return True
+
+	""" Marks the job as started, returns False if it was cancelled in the meantime """
+	def start(self):
+		with self.lock:
+			if self.cancelled:
+				return False
+
+			self.started = True
+			return True
+
+	""" Waits for the job and returns its result, raising whatever it raised """
+	def result(self, timeout = None):
+		self.event.wait(timeout)
+
+		if self.cancelled:
+			raise CancelledError()
+
+		if self.error != None:
+			raise self.error
+
+		return self.value
+
+	""" Calls fn with this future once it is done, right away if it already is """
+	def add_done_callback(self, fn):
+		with self.lock:
+			if not self.done():
+				self.callbacks.append(fn)
+				return
+
+		fn(self)
+
+	def set_result(self, value):
+		self.value = value
+		self.finish()
+
+	def set_error(self, error):
+		self.error = error
+		self.finish()
+
+	""" Wakes up anyone waiting and runs the done callbacks """
+	def finish(self):
+		with self.lock:
+			self.event.set()
+			callbacks, self.callbacks = self.callbacks, []
+
+		for fn in callbacks:
+			fn(self)
+
+class WorkerPool(object):
+	""" Bounded set of worker threads serving jobs by priority lane, then in submission order """
+	def __init__(self, max_workers = 4):
+		self.max_workers = max_workers
+		self.queue = queue.PriorityQueue()
+		self.counter = itertools.count()
+		self.lock = threading.Lock()
+		self.workers = 0
+		self.idle = 0
+		self.active = 0
+		self.completed = 0
+		self.depth = {INTERACTIVE: 0, BACKGROUND: 0}
+
+	""" Queues fn(*args) and returns a Future for its result """
+	def submit(self, fn, args = (), priority = INTERACTIVE):
+		future = Future()
+
+		with self.lock:
+			self.depth[priority] = self.depth.get(priority, 0) + 1
+			self.queue.put((priority, next(self.counter), future, fn, args))
+
+			# only start another thread if nobody is free to pick the job up
+			spawn = self.idle == 0 and self.workers < self.max_workers
+			if spawn:
+				self.workers += 1
+
+		if spawn:
+			thread = threading.Thread(target = self.work)
+			thread.daemon = True
+			thread.start()
+
+		return future
+
+	""" Returns a snapshot of the queue depth per lane and the number of running and finished jobs """
+	def stats(self):
+		with self.lock:
+			return {
+				'interactive': self.depth.get(INTERACTIVE, 0),
+				'background': self.depth.get(BACKGROUND, 0),
+				'active': self.active,
+				'completed': self.completed,
+				'workers': self.workers,
+			}
+
+	""" Main loop of every worker thread """
+	def work(self):
+		while True:
+			with self.lock:
+				self.idle += 1
+
+			priority, count, future, fn, args = self.queue.get()
+
+			with self.lock:
+				self.idle -= 1
+				self.depth[priority] -= 1
+
+				if not future.start():
+					continue
+
+				self.active += 1
+
+			try:
+				future.set_result(fn(*args))
+			except Exception as e:
+				future.set_error(e)
+			finally:
+				with self.lock:
+					self.active -= 1
+					self.completed += 1
+
+# shared by every command so bulk operations can't spawn unbounded threads
+pool = WorkerPool()
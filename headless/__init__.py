@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Sublpress' client for scripts and batch jobs that run outside the editor, on Python 3.6 or later.
+
+	import asyncio, logging
+	from Sublpress import reporting
+	from Sublpress.headless import AsyncClient
+	from Sublpress.wordpress_xmlrpc.methods.posts import GetPosts
+
+	reporting.error_handler = logging.error
+
+	async def main():
+		async with AsyncClient('http://example.com/xmlrpc.php', 'username', 'password') as wp:
+			print(len(await wp.call(GetPosts({'number': 500}))))
+
+	asyncio.run(main())
+
+The editor never loads this package, and importing it doesn't need the editor.
+"""
+from . import bridge
+
+# the bundled wordpress_xmlrpc needs its editor modules before anything imports it
+bridge.install()
+
+from .client import AsyncClient, ConnectionClosed
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Lets the bundled wordpress_xmlrpc run outside the editor.
+
+The library imports sublime and sublime_plugin when it is loaded and tells
+the user about errors through sublime.error_message. When there is no editor,
+install() puts small modules under those names whose messages go through
+Sublpress' reporting module instead, so scripts decide where they end up.
+"""
+import sys, types
+
+from .. import reporting
+
+""" Makes sublime and sublime_plugin importable if they aren't, returns True if it had to """
+def install():
+	try:
+		import sublime, sublime_plugin
+		return False
+	except ImportError:
+		pass
+
+	sublime = types.ModuleType('sublime')
+	sublime.error_message = lambda message: reporting.error(message)
+	sublime.status_message = lambda message: reporting.status(message)
+	sublime.message_dialog = lambda message: reporting.status(message)
+	sublime.set_timeout = lambda fn, delay = 0: fn()
+
+	sublime_plugin = types.ModuleType('sublime_plugin')
+	for name in ('ApplicationCommand', 'WindowCommand', 'TextCommand', 'EventListener'):
+		setattr(sublime_plugin, name, type(name, (object, ), {}))
+
+	sys.modules.setdefault('sublime', sublime)
+	sys.modules.setdefault('sublime_plugin', sublime_plugin)
+
+	return True
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+import ssl, asyncio
+import xmlrpc.client as xmlrpc_client
+from urllib.parse import urlparse
+
+from ..wordpress_xmlrpc import *
+from ..wordpress_xmlrpc.exceptions import *
+from .. import connection, parser, reporting
+from ..client import BatchResult, builds_results
+
+# bytes read from the socket at a time
+READ_SIZE = connection.READ_SIZE
+
+class ConnectionClosed(Exception):
+	""" Raised when the server closed a connection before it sent a whole response """
+	pass
+
+class StaleConnection(ConnectionClosed):
+	""" Raised when a connection was closed before any of the response came back, so the request can safely be sent again """
+	pass
+
+class Response(object):
+	""" Status line and headers of an HTTP response """
+	def __init__(self, version, status, reason, headers):
+		self.version = version
+		self.status = status
+		self.reason = reason
+		self.headers = headers
+
+	""" Returns True if the server won't take another request on this connection """
+	def will_close(self):
+		connection = self.headers.get('connection', '').lower()
+		if self.version == 'HTTP/1.0':
+			return connection != 'keep-alive'
+
+		return connection == 'close' or ('content-length' not in self.headers and 'chunked' not in self.headers.get('transfer-encoding', ''))
+
+class AsyncClient(object):
+	"""
+	WordPress XML-RPC client for asyncio, for scripts and batch jobs that run outside the editor.
+
+	Takes the same XmlrpcMethod objects as SublpressClient and hands back the same models,
+	parsed straight from the response when the method allows it. Requests go over a pool of
+	keep-alive connections, at most concurrency of them at once, so a job can have hundreds of
+	calls pending without a thread for each. Errors the user should hear about go to on_error,
+	reporting.error by default:
+
+		async with AsyncClient(url, username, password, concurrency = 32) as wp:
+			posts = await wp.call(GetPosts({'number': 100}))
+			results = await wp.call_many([GetPost(p.id) for p in posts])
+	"""
+	def __init__(self, url, username, password, blog_id = 0, concurrency = 16, compression = True, timeout = 60, on_error = None):
+		self.url = url
+		self.username = username
+		self.password = password
+		self.blog_id = blog_id
+		self.concurrency = concurrency
+		self.compression = compression
+		self.timeout = timeout
+		self.on_error = on_error or reporting.error
+		self.supported_methods = None
+		self.stats = connection.TransferStats()
+		self.idle = []
+		self.slots = None
+
+		parts = urlparse(url)
+		self.scheme = parts.scheme or 'http'
+		self.hostname = parts.hostname
+		self.port = parts.port or (443 if self.scheme == 'https' else 80)
+		self.handler = parts.path or '/'
+		self.host_header = parts.netloc.rpartition('@')[2]
+
+	async def __aenter__(self):
+		await self.connect()
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		await self.close()
+		return False
+
+	""" Asks the site which methods it supports, so unsupported ones fail before being sent """
+	async def connect(self):
+		try:
+			self.supported_methods = await self.request('mt.supportedMethods', ())
+		except xmlrpc_client.ProtocolError as e:
+			self.on_error('Server connection error.')
+			raise ServerConnectionError(repr(e))
+
+		return self
+
+	""" Closes every idle connection """
+	async def close(self):
+		idle, self.idle = self.idle, []
+
+		for reader, writer in idle:
+			writer.close()
+
+	""" Calls an XmlrpcMethod, parsing its response straight into model objects when possible, or into their compact stand-ins """
+	async def call(self, method, compact = False):
+		if self.supported_methods != None and method.method_name not in self.supported_methods:
+			self.on_error('Unsupported XMLRPC method: ' + method.method_name)
+			raise UnsupportedXmlrpcMethodError(method.method_name)
+
+		typed = builds_results(method)
+		args = tuple(method.get_args(self))
+
+		try:
+			result = await self.request(method.method_name, args, method.results_class if typed else None, compact)
+		except xmlrpc_client.Fault as e:
+			if e.faultCode == 403:
+				self.on_error('Invalid credentials.')
+				raise InvalidCredentialsError(e.faultString)
+			if e.faultCode == 405:
+				self.on_error('XMLRPC disabled on this host.')
+				raise XmlrpcDisabledError(e.faultString)
+			raise
+
+		if typed:
+			return result
+
+		return method.process_result(result)
+
+	""" Calls several methods at once within the concurrency limit, failed calls are returned as their exceptions """
+	async def call_many(self, methods, compact = False):
+		return await asyncio.gather(*[self.call(method, compact) for method in methods], return_exceptions = True)
+
+	""" Calls several XmlrpcMethods in a single system.multicall round trip """
+	async def multicall(self, methods):
+		calls = [{'methodName': m.method_name, 'params': list(m.get_args(self))} for m in methods]
+		raw_results = await self.request('system.multicall', (calls, ))
+
+		# each entry is either a one item list with the result, or a fault struct
+		results = BatchResult()
+		for method, raw in zip(methods, raw_results):
+			if type(raw) is dict:
+				results.append(xmlrpc_client.Fault(raw.get('faultCode'), raw.get('faultString')))
+			else:
+				results.append(method.process_result(raw[0]))
+
+		return results
+
+	""" Sends one XML-RPC request and returns its parsed result, waiting for a free slot first """
+	async def request(self, method_name, params, results_class = None, compact = False):
+		body = xmlrpc_client.dumps(params, method_name, allow_none = True).encode('utf-8')
+
+		# created here rather than in __init__, so it belongs to the loop that is running
+		if self.slots == None:
+			self.slots = asyncio.Semaphore(self.concurrency)
+
+		async with self.slots:
+			return await asyncio.wait_for(self.send(body, results_class, compact), self.timeout)
+
+	""" Sends a request over a pooled connection """
+	async def send(self, body, results_class, compact):
+		reader, writer, reused = await self.acquire()
+
+		try:
+			return await self.send_on(reader, writer, body, results_class, compact)
+		except StaleConnection:
+			if not reused:
+				raise
+
+		# the server closed the pooled connection while it was idle, and never saw the request, so send it once more on a fresh one
+		reader, writer = await self.open()
+		return await self.send_on(reader, writer, body, results_class, compact)
+
+	""" Sends a request over a given connection, putting it back in the pool if it can be reused """
+	async def send_on(self, reader, writer, body, results_class, compact):
+		try:
+			result, keep = await self.exchange(reader, writer, body, results_class, compact)
+		except:
+			# whatever is left of the response would be read as the next one
+			writer.close()
+			raise
+
+		if keep:
+			self.idle.append((reader, writer))
+		else:
+			writer.close()
+
+		return result
+
+	""" Returns an idle connection if there is one, otherwise a new one, and whether it was reused """
+	async def acquire(self):
+		while self.idle:
+			reader, writer = self.idle.pop()
+			if not reader.at_eof() and not writer.transport.is_closing():
+				return reader, writer, True
+			writer.close()
+
+		reader, writer = await self.open()
+		return reader, writer, False
+
+	""" Opens a new connection to the site """
+	async def open(self):
+		context = ssl.create_default_context() if self.scheme == 'https' else None
+		return await asyncio.open_connection(self.hostname, self.port, ssl = context)
+
+	""" Writes a request and reads its response, returns the result and whether the connection can be reused """
+	async def exchange(self, reader, writer, body, results_class, compact):
+		headers = [
+			'POST ' + self.handler + ' HTTP/1.1',
+			'Host: ' + self.host_header,
+			'User-Agent: Sublpress',
+			'Content-Type: text/xml',
+			'Content-Length: ' + str(len(body)),
+			'Connection: keep-alive',
+		]
+
+		if self.compression:
+			headers.append('Accept-Encoding: gzip, deflate')
+
+		try:
+			writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+			await writer.drain()
+		except OSError as e:
+			raise StaleConnection(str(e))
+
+		self.stats.add_sent(len(body), len(body))
+
+		response = await self.read_head(reader)
+
+		if response.status != 200:
+			async for data in self.read_body(reader, response):
+				pass
+			raise xmlrpc_client.ProtocolError(self.host_header + self.handler, response.status, response.reason, response.headers)
+
+		result = await self.parse_body(reader, response, results_class, compact)
+
+		return result, not response.will_close()
+
+	""" Reads the status line and headers of a response, raising StaleConnection if not a byte of it came back """
+	async def read_head(self, reader):
+		try:
+			line = await reader.readline()
+		except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as e:
+			raise StaleConnection(str(e))
+
+		if not line:
+			raise StaleConnection('the server closed the connection')
+
+		version, status, reason = (line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+
+		headers = {}
+		while True:
+			line = await reader.readline()
+			if not line:
+				raise ConnectionClosed('the server closed the connection')
+			if line in (b'\r\n', b'\n'):
+				break
+
+			name, _, value = line.decode('latin-1').partition(':')
+			headers[name.strip().lower()] = value.strip()
+
+		return Response(version, int(status), reason, headers)
+
+	""" Yields the body of a response as it arrives, whether it has a length, is chunked or runs until the connection closes """
+	async def read_body(self, reader, response):
+		if 'chunked' in response.headers.get('transfer-encoding', '').lower():
+			while True:
+				size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+				if size == 0:
+					# skip the trailers
+					while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+						pass
+					return
+
+				yield await reader.readexactly(size)
+				await reader.readline()
+
+		if 'content-length' in response.headers:
+			remaining = int(response.headers['content-length'])
+			while remaining > 0:
+				data = await reader.read(min(remaining, READ_SIZE))
+				if not data:
+					raise ConnectionClosed('the server closed the connection')
+				remaining -= len(data)
+				yield data
+			return
+
+		while True:
+			data = await reader.read(READ_SIZE)
+			if not data:
+				return
+			yield data
+
+	""" Feeds a response to the parser as it arrives, decompressing it on the way """
+	async def parse_body(self, reader, response, results_class, compact):
+		if results_class != None:
+			p = u = parser.TypedParser(results_class, compact)
+		else:
+			p, u = xmlrpc_client.getparser()
+
+		decoder = connection.decoder_for(response.headers.get('content-encoding'))
+
+		async for data in self.read_body(reader, response):
+			wire = len(data)
+			if decoder != None:
+				data = decoder.decompress(data)
+
+			self.stats.add_received(wire, len(data))
+			if data:
+				p.feed(data)
+
+		if decoder != None:
+			data = decoder.flush()
+			self.stats.add_received(0, len(data))
+			if data:
+				p.feed(data)
+
+		p.close()
+		result = u.close()
+
+		# a response holds a single value
+		return result[0]
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+import os, sys, json, socket, threading
+if sys.version_info[0] == 3:
+	import http.client as httplib
+	import xmlrpc.client as xmlrpc_client
+	from .wordpress_xmlrpc import *
+	from .wordpress_xmlrpc.exceptions import *
+	from .wordpress_xmlrpc.methods.posts import *
+	from .wordpress_xmlrpc.methods.taxonomies import *
+	from . import common, executor, store
+else:
+	import httplib
+	import xmlrpclib as xmlrpc_client
+	from wordpress_xmlrpc import *
+	from wordpress_xmlrpc.exceptions import *
+	from wordpress_xmlrpc.methods.posts import *
+	from wordpress_xmlrpc.methods.taxonomies import *
+	import common, executor, store
+
+# the writes that can be queued, by name
+METHODS = {
+	'EditPost': EditPost,
+	'NewPost': NewPost,
+	'DeletePost': DeletePost,
+	'EditTerm': EditTerm,
+}
+
+# rewrite the journal once it holds this many more lines than pending entries
+COMPACT_SLACK = 100
+
+# seconds to wait before retrying while the site is unreachable, doubled up to the maximum
+RETRY_DELAY = 5
+RETRY_MAX_DELAY = 300
+
+class Offline(Exception):
+	""" Raised by runners when a write couldn't reach the site and should be retried later """
+	pass
+
+""" Returns True if an error means the site couldn't be reached, rather than that it refused the write """
+def is_offline_error(error):
+	if isinstance(error, (Offline, httplib.HTTPException, ServerConnectionError)):
+		return True
+
+	# on Python 3 socket.error is OSError, which a missing file raises as well
+	if isinstance(error, socket.error) and getattr(error, 'filename', None) == None:
+		return True
+
+	# the server or a proxy in front of it is having trouble
+	if isinstance(error, xmlrpc_client.ProtocolError):
+		return error.errcode >= 500 or error.errcode == 0
+
+	return False
+
+""" Returns the arguments of an XmlrpcMethod the way they are sent, minus the credentials """
+def method_params(method):
+	params = []
+
+	for name in method.method_args + method.optional_args:
+		if hasattr(method, name):
+			value = getattr(method, name)
+			params.append(value.struct if hasattr(value, 'struct') else value)
+
+	return params
+
+""" Returns the key writes that replace or fold into each other share, None if a write stands on its own """
+def entry_key(name, params):
+	if name in ('EditPost', 'DeletePost'):
+		return 'post:' + str(params[0])
+
+	if name == 'EditTerm':
+		return 'term:' + str(params[0])
+
+	if name == 'UploadFile':
+		return 'upload:' + params[0]
+
+	return None
+
+""" Runs a queued XmlrpcMethod """
+def call_entry(client, entry):
+	method = METHODS[entry['method']](*load_params(entry))
+	return client.call(method)
+
+# how each kind of write is sent, other modules can add their own
+runners = {}
+
+""" Marshals params so that dates and binary data survive the trip through JSON """
+def dump_params(params):
+	return xmlrpc_client.dumps(tuple(params), allow_none = True)
+
+def load_params(entry):
+	return list(xmlrpc_client.loads(entry['params'])[0])
+
+class Journal(object):
+	"""
+	Disk-backed queue of the writes waiting to be sent to one site, replayed in the background.
+
+	Every change is appended to the journal file before anything is sent, so queued writes
+	survive a crash or a restart. Writes to the same post or term are folded together while
+	they wait, and at most concurrency writes are sent at once, never two for the same key.
+
+	Writes the site refuses stay in the journal as failed until they are retried or dropped.
+	"""
+	def __init__(self, site, concurrency = 2, client = None, on_change = None, on_error = None):
+		self.site = site
+		self.concurrency = concurrency
+		self.client = client
+		self.on_change = on_change
+		self.on_error = on_error
+		self.lock = threading.RLock()
+		self.seq = 0
+		self.lines = 0
+		# keyed by sequence number, which is also the order they go out in
+		self.pending = {}
+		self.running = {}
+		self.failed = {}
+		# callers waiting for the result of a write, by sequence number
+		self.waiters = {}
+		self.offline = False
+		self.retry_delay = RETRY_DELAY
+		self.timer = None
+		self.path = os.path.join(common.cache_path(site), 'journal.jsonl')
+		self.load()
+
+	""" Reads the pending writes back from disk """
+	def load(self):
+		if not os.path.exists(self.path):
+			return
+
+		entries = {}
+		failed = {}
+		with open(self.path, 'r') as f:
+			for line in f:
+				self.lines += 1
+				try:
+					record = json.loads(line)
+				except ValueError:
+					# the last line may have been cut short by a crash
+					continue
+
+				if record['op'] == 'put':
+					entries[record['entry']['seq']] = record['entry']
+					failed.pop(record['entry']['seq'], None)
+				elif record['op'] == 'failed' and record['seq'] in entries:
+					failed[record['seq']] = dict(entries.pop(record['seq']), error = record['error'])
+				elif record['op'] == 'done':
+					entries.pop(record['seq'], None)
+					failed.pop(record['seq'], None)
+
+		for seq in sorted(entries):
+			self.pending[seq] = entries[seq]
+			self.seq = max(self.seq, seq)
+
+		for seq in failed:
+			self.failed[seq] = failed[seq]
+			self.seq = max(self.seq, seq)
+
+		self.compact()
+
+	""" Appends a record to the journal file and makes sure it is on disk """
+	def append(self, record):
+		with open(self.path, 'a') as f:
+			f.write(json.dumps(record) + '\n')
+			f.flush()
+			os.fsync(f.fileno())
+
+		self.lines += 1
+
+	""" Rewrites the journal with only the pending and failed writes once it has grown too long """
+	def compact(self, force = False):
+		if not force and self.lines <= len(self.pending) + len(self.running) + 2 * len(self.failed) + COMPACT_SLACK:
+			return
+
+		entries = sorted(list(self.pending.values()) + list(self.running.values()) + list(self.failed.values()), key = lambda e: e['seq'])
+		tmp = self.path + '.tmp'
+		lines = 0
+
+		with open(tmp, 'w') as f:
+			for entry in entries:
+				if 'error' in entry:
+					f.write(json.dumps({'op': 'put', 'entry': without_error(entry)}) + '\n')
+					f.write(json.dumps({'op': 'failed', 'seq': entry['seq'], 'error': entry['error']}) + '\n')
+					lines += 2
+				else:
+					f.write(json.dumps({'op': 'put', 'entry': entry}) + '\n')
+					lines += 1
+			f.flush()
+			os.fsync(f.fileno())
+
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		os.rename(tmp, self.path)
+
+		self.lines = lines
+
+	""" Queues an XmlrpcMethod, returns the sequence number of the entry it ended up in """
+	def put(self, method, waiter = None):
+		return self.put_entry(type(method).__name__, method_params(method), waiter)
+
+	"""
+	Queues an XmlrpcMethod and waits up to timeout seconds for it to be sent, for writes whose
+	result is needed straight away. Returns the result, raises the error if the site refused the
+	write, it is then kept as failed like any other, or Offline if the write is still queued by
+	then, in which case it goes out later on its own.
+	"""
+	def call(self, method, timeout = None):
+		waiter = {'done': threading.Event()}
+		seq = self.put(method, waiter)
+
+		waiter['done'].wait(timeout)
+
+		with self.lock:
+			self.waiters.pop(seq, None)
+
+		if not waiter['done'].is_set():
+			raise Offline('The site could not be reached, the ' + type(method).__name__ + ' stays queued and is sent once it can be')
+
+		if waiter['error'] != None:
+			raise waiter['error']
+
+		return waiter['value']
+
+	""" Queues a write by name, folding it into a pending write for the same key if there is one """
+	def put_entry(self, name, params, waiter = None):
+		key = entry_key(name, params)
+
+		with self.lock:
+			# only writes that haven't started yet can be folded into
+			old = None
+			if key != None:
+				for entry in self.pending.values():
+					if entry['key'] == key:
+						old = entry
+						break
+
+			if old != None:
+				entry = self.coalesce(old, name, params)
+				self.pending[old['seq']] = entry
+				self.append({'op': 'put', 'entry': entry})
+			else:
+				self.seq += 1
+				entry = {'seq': self.seq, 'key': key, 'method': name, 'params': dump_params(params)}
+				self.pending[entry['seq']] = entry
+				self.append({'op': 'put', 'entry': entry})
+
+			# registered before anything is sent, so the write can't finish unnoticed
+			if waiter != None:
+				self.waiters[entry['seq']] = waiter
+
+		self.changed()
+		self.pump()
+
+		return entry['seq']
+
+	""" Returns the entry that replaces a pending one when another write for the same key comes in """
+	def coalesce(self, old, name, params):
+		entry = dict(old)
+
+		# later edits win field by field
+		if old['method'] == name and name in ('EditPost', 'EditTerm'):
+			old_params = load_params(old)
+			fields = dict(old_params[1])
+			fields.update(params[1])
+			entry['params'] = dump_params([params[0], fields])
+			return entry
+
+		# a post that is being deleted doesn't need editing
+		if old['method'] == 'DeletePost' and name == 'EditPost':
+			return entry
+
+		entry['method'] = name
+		entry['params'] = dump_params(params)
+		return entry
+
+	""" Returns the number of writes that haven't been sent yet """
+	def size(self):
+		with self.lock:
+			return len(self.pending) + len(self.running)
+
+	""" Returns a short description of the queue for the status bar, empty if there is nothing to show """
+	def status(self):
+		with self.lock:
+			count = len(self.pending) + len(self.running)
+
+			if count == 0 and not self.failed:
+				return ''
+
+			parts = []
+
+			if count:
+				parts.append(str(count) + ' pending write' + ('s' if count != 1 else '') + (' (site unreachable, retrying)' if self.offline else ''))
+
+			if self.failed:
+				parts.append(str(len(self.failed)) + ' failed write' + ('s' if len(self.failed) != 1 else ''))
+
+			return 'WordPress: ' + ', '.join(parts)
+
+	""" Returns the writes the site refused, oldest first, each with the error it gave """
+	def failures(self):
+		with self.lock:
+			return [self.failed[seq] for seq in sorted(self.failed)]
+
+	""" Starts as many pending writes as the concurrency allows """
+	def pump(self):
+		with self.lock:
+			if self.offline:
+				return
+
+			client = self.client and self.client()
+			if client == None:
+				return
+
+			busy = set(entry['key'] for entry in self.running.values())
+
+			for seq, entry in sorted(self.pending.items()):
+				if len(self.running) >= self.concurrency:
+					break
+
+				# writes for the same key go out one after the other
+				if entry['key'] != None and entry['key'] in busy:
+					continue
+
+				del self.pending[seq]
+				self.running[seq] = entry
+				busy.add(entry['key'])
+
+				future = executor.pool.submit(self.send, (client, entry), executor.BACKGROUND)
+				future.add_done_callback(lambda f, entry = entry: self.sent(entry, f))
+
+	""" Sends one write, called from a worker thread """
+	def send(self, client, entry):
+		runner = runners.get(entry['method'], call_entry)
+
+		try:
+			return runner(client, entry)
+		finally:
+			# like the session cache, whatever is kept of the post predates the write, even a failed one
+			if entry['method'] in METHODS:
+				store.post_written(self.site, METHODS[entry['method']](*load_params(entry)))
+
+	""" Called when a write has been sent or has failed """
+	def sent(self, entry, future):
+		error = future.error
+
+		with self.lock:
+			del self.running[entry['seq']]
+
+			if error != None and is_offline_error(error):
+				# put it back in line and wait for the site to come back
+				self.pending[entry['seq']] = entry
+				self.go_offline()
+			elif error != None:
+				# keep it on disk until the user retries or drops it
+				self.failed[entry['seq']] = dict(entry, error = str(error))
+				self.append({'op': 'failed', 'seq': entry['seq'], 'error': str(error)})
+				self.retry_delay = RETRY_DELAY
+			else:
+				self.append({'op': 'done', 'seq': entry['seq']})
+				self.retry_delay = RETRY_DELAY
+
+				if not self.pending and not self.running:
+					self.compact(force = True)
+
+			waiter = self.waiters.pop(entry['seq'], None) if error == None or not is_offline_error(error) else None
+
+		if waiter != None:
+			waiter['value'] = future.value
+			waiter['error'] = error
+			waiter['done'].set()
+
+		if error != None and not is_offline_error(error) and self.on_error != None:
+			self.on_error(entry, error)
+
+		self.changed()
+		self.pump()
+
+	""" Stops sending and schedules a retry, with the lock held """
+	def go_offline(self):
+		if self.offline:
+			return
+
+		self.offline = True
+		self.timer = threading.Timer(self.retry_delay, self.retry)
+		self.timer.daemon = True
+		self.timer.start()
+
+		self.retry_delay = min(self.retry_delay * 2, RETRY_MAX_DELAY)
+
+	""" Tries sending again, right away when called directly, e.g. after reconnecting """
+	def retry(self):
+		with self.lock:
+			if self.timer != None:
+				self.timer.cancel()
+				self.timer = None
+
+			self.offline = False
+
+		self.changed()
+		self.pump()
+
+	""" Puts failed writes back in line, every one of them unless seqs says which """
+	def retry_failed(self, seqs = None):
+		with self.lock:
+			for seq in sorted(self.failed if seqs == None else seqs):
+				if seq not in self.failed:
+					continue
+
+				entry = without_error(self.failed.pop(seq))
+				self.pending[seq] = entry
+				self.append({'op': 'put', 'entry': entry})
+
+		self.changed()
+		self.pump()
+
+	""" Forgets failed writes for good, every one of them unless seqs says which """
+	def drop_failed(self, seqs = None):
+		with self.lock:
+			for seq in sorted(self.failed if seqs == None else seqs):
+				if self.failed.pop(seq, None) != None:
+					self.append({'op': 'done', 'seq': seq})
+
+			if not self.pending and not self.running:
+				self.compact(force = True)
+
+		self.changed()
+
+	def changed(self):
+		if self.on_change != None:
+			self.on_change(self)
+
+""" Returns a failed entry the way it was queued """
+def without_error(entry):
+	entry = dict(entry)
+	entry.pop('error', None)
+	return entry
+
+""" Returns a short description of a queued write for list views """
+def describe(entry):
+	return entry['method'] + (' ' + entry['key'] if entry['key'] != None else '')
+
+journals = {}
+journals_lock = threading.Lock()
+
+""" Returns the shared journal for a site """
+def journal(site, **kwargs):
+	with journals_lock:
+		if site not in journals:
+			journals[site] = Journal(site, **kwargs)
+
+		return journals[site]
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+import os, sys, json, hashlib, threading
+if sys.version_info[0] == 3:
+	from urllib.request import urlopen
+	from .wordpress_xmlrpc import *
+	from .wordpress_xmlrpc.methods.media import *
+	from . import common, executor, store
+else:
+	from urllib2 import urlopen
+	from wordpress_xmlrpc import *
+	from wordpress_xmlrpc.methods.media import *
+	import common, executor, store
+
+# items fetched per GetMediaLibrary call
+PAGE_SIZE = 100
+
+# megabytes of metadata and thumbnails kept per site unless media_cache_size says otherwise
+CACHE_SIZE = 64
+
+# thumbnails larger than this aren't worth keeping
+MAX_THUMBNAIL_SIZE = 512 * 1024
+
+class DiskCache(object):
+	""" Files in a directory up to a total size, forgetting the least recently used ones first """
+	def __init__(self, directory, max_bytes):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+		self.index_path = os.path.join(directory, 'index.json')
+		self.entries = store.LinkedMap()
+		self.size = 0
+		self.dirty = False
+		self.load()
+
+	""" Reads the index back from disk, oldest entries first """
+	def load(self):
+		if not os.path.exists(self.index_path):
+			return
+
+		try:
+			with open(self.index_path, 'r') as f:
+				entries = json.load(f)
+		except ValueError:
+			return
+
+		for key, size in entries:
+			self.entries[key] = size
+			self.size += size
+
+	""" Writes the index to disk if it changed """
+	def save(self):
+		with self.lock:
+			if not self.dirty:
+				return
+
+			entries = list(self.entries.items())
+			self.dirty = False
+
+		tmp = self.index_path + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(entries, f)
+
+		if os.path.exists(self.index_path):
+			os.remove(self.index_path)
+		os.rename(tmp, self.index_path)
+
+	""" Returns the file a key is kept in """
+	def file_for(self, key):
+		return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+	""" Returns the path of a cached entry, None if it isn't cached """
+	def path(self, key):
+		path = self.file_for(key)
+
+		with self.lock:
+			if key not in self.entries:
+				return None
+
+			# move the entry to the most recently used end
+			self.entries[key] = self.entries.pop(key)
+			self.dirty = True
+
+		if not os.path.exists(path):
+			self.discard(key)
+			return None
+
+		return path
+
+	""" Returns the contents of a cached entry, None if it isn't cached """
+	def get(self, key):
+		path = self.path(key)
+		if path == None:
+			return None
+
+		try:
+			with open(path, 'rb') as f:
+				return f.read()
+		except (IOError, OSError):
+			self.discard(key)
+			return None
+
+	""" Caches data under a key, evicting the least recently used entries to make room """
+	def put(self, key, data):
+		path = self.file_for(key)
+
+		with open(path + '.tmp', 'wb') as f:
+			f.write(data)
+		if os.path.exists(path):
+			os.remove(path)
+		os.rename(path + '.tmp', path)
+
+		with self.lock:
+			self.size += len(data) - self.entries.pop(key, 0)
+			self.entries[key] = len(data)
+			self.dirty = True
+
+			evicted = []
+			while self.size > self.max_bytes and len(self.entries) > 1:
+				old, size = self.entries.popitem(last = False)
+				self.size -= size
+				evicted.append(old)
+
+		for old in evicted:
+			if os.path.exists(self.file_for(old)):
+				os.remove(self.file_for(old))
+
+	""" Forgets a cached entry """
+	def discard(self, key):
+		with self.lock:
+			if key not in self.entries:
+				return
+
+			self.size -= self.entries.pop(key)
+			self.dirty = True
+
+		if os.path.exists(self.file_for(key)):
+			os.remove(self.file_for(key))
+
+	""" Returns the keys of every cached entry starting with a prefix """
+	def keys(self, prefix):
+		with self.lock:
+			return [key for key in self.entries if key.startswith(prefix)]
+
+	def get_json(self, key):
+		data = self.get(key)
+		return json.loads(data.decode('utf-8')) if data != None else None
+
+	def put_json(self, key, value):
+		# dates are kept the way XML-RPC sends them
+		self.put(key, json.dumps(value, sort_keys = True, default = str).encode('utf-8'))
+
+	""" Returns the number of entries and bytes cached """
+	def stats(self):
+		with self.lock:
+			return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes}
+
+""" Returns the key a page of a filtered listing is cached under """
+def page_key(filter, index, page_size):
+	return 'page:' + json.dumps(filter, sort_keys = True) + ':' + str(page_size) + ':' + str(index)
+
+class MediaLibrary(object):
+	"""
+	Media library of one site, fetched a page at a time and kept in a disk cache along with
+	thumbnails, so browsing it again doesn't wait on the site however many items it has.
+
+	Pages are served from the cache when they are there. Refreshing the first page of a
+	listing drops the rest of it if the first page changed, since newer items shift every
+	offset after them.
+	"""
+	def __init__(self, site, cache):
+		self.site = site
+		self.cache = cache
+
+	""" Returns a page of the library as item structs, from the cache unless refresh is set, called from a worker thread """
+	def page(self, client, filter, index, page_size = PAGE_SIZE, refresh = False):
+		key = page_key(filter, index, page_size)
+
+		if not refresh:
+			ids = self.cache.get_json(key)
+			items = [self.cache.get_json('item:' + i) for i in ids or []]
+
+			# a page is only of use if none of its items have been evicted
+			if ids != None and None not in items:
+				return items
+
+		items = client.call(GetMediaLibrary(dict(filter, number = page_size, offset = index * page_size), results_class = None))
+		ids = [str(item['attachment_id']) for item in items]
+
+		if index == 0 and refresh and self.cache.get_json(key) != ids:
+			self.forget(filter)
+
+		for item in items:
+			self.cache.put_json('item:' + str(item['attachment_id']), item)
+		self.cache.put_json(key, ids)
+		self.cache.save()
+
+		return [json.loads(json.dumps(item, default = str)) for item in items]
+
+	""" Returns a single item, from the cache if it is there, called from a worker thread """
+	def item(self, client, attachment_id):
+		item = self.cache.get_json('item:' + str(attachment_id))
+		if item != None:
+			return item
+
+		item = client.call(GetMediaItem(attachment_id, results_class = None))
+		self.cache.put_json('item:' + str(attachment_id), item)
+		self.cache.save()
+
+		return json.loads(json.dumps(item, default = str))
+
+	""" Returns the local path of an item's thumbnail, downloading it into the cache first if needed, called from a worker thread """
+	def thumbnail(self, item):
+		url = item.get('thumbnail') or ''
+		if not url:
+			return None
+
+		key = 'thumb:' + str(item['attachment_id']) + ':' + url
+		path = self.cache.path(key)
+		if path != None:
+			return path
+
+		response = urlopen(url, timeout = 30)
+		try:
+			data = response.read(MAX_THUMBNAIL_SIZE + 1)
+		finally:
+			response.close()
+
+		if len(data) > MAX_THUMBNAIL_SIZE:
+			return None
+
+		self.cache.put(key, data)
+		self.cache.save()
+
+		return self.cache.path(key)
+
+	""" Downloads the thumbnails of a page of items that aren't cached yet, called from a worker thread """
+	def warm(self, items):
+		for item in items:
+			try:
+				self.thumbnail(item)
+			except Exception:
+				# a missing thumbnail only means no preview
+				pass
+
+	""" Forgets the cached pages of a listing, or of every listing, the items themselves stay """
+	def forget(self, filter = None):
+		prefix = 'page:' + json.dumps(filter, sort_keys = True) + ':' if filter != None else 'page:'
+		for key in self.cache.keys(prefix):
+			self.cache.discard(key)
+
+		self.cache.save()
+
+""" Returns a short description of an item for list views """
+def describe(item):
+	metadata = item.get('metadata') or {}
+	parts = ['ID ' + str(item['attachment_id'])]
+
+	if isinstance(metadata, dict) and metadata.get('width'):
+		parts.append('%sx%s' % (metadata['width'], metadata.get('height', '?')))
+
+	if isinstance(metadata, dict) and metadata.get('file'):
+		parts.append(os.path.basename(metadata['file']))
+	elif item.get('link'):
+		parts.append(os.path.basename(item['link']))
+
+	if str(item.get('parent', '0')) != '0':
+		parts.append('attached to ' + str(item['parent']))
+
+	return ', '.join(parts)
+
+libraries = {}
+libraries_lock = threading.Lock()
+
+""" Returns the media library of a site """
+def media_library(site):
+	with libraries_lock:
+		if site not in libraries:
+			size = common.sp_settings.get('media_cache_size', CACHE_SIZE) if common.sp_settings != None else CACHE_SIZE
+			libraries[site] = MediaLibrary(site, DiskCache(common.cache_path(site, 'media'), size * 1024 * 1024))
+
+		return libraries[site]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import sys, json, time, threading
+from collections import deque
+
+# the phases a call is broken down into, in the order they happen
+PHASES = ['connect', 'send', 'ttfb', 'transfer', 'parse', 'convert']
+
+""" Returns the value below which a fraction of the sorted values fall """
+def percentile(values, fraction):
+	if not values:
+		return 0.0
+
+	return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+class CallLog(object):
+	"""
+	Bounded, thread-safe record of the most recent XML-RPC calls.
+
+	A call is started by whoever first knows about it, the client or the transport,
+	and the others add their timings and byte counts to it through the current
+	thread, so hooks don't need to be passed anything.
+	"""
+	def __init__(self, size = 500):
+		self.lock = threading.Lock()
+		self.calls = deque(maxlen = size)
+		self.local = threading.local()
+
+	""" Changes how many calls are kept """
+	def resize(self, size):
+		with self.lock:
+			self.calls = deque(self.calls, maxlen = size)
+
+	""" Starts recording a call on this thread, returns False if one is already being recorded """
+	def begin(self, method_name):
+		if getattr(self.local, 'call', None) != None:
+			return False
+
+		self.local.call = {'method': method_name, 'started': time.time(), 'error': None}
+		self.local.start = time.time()
+		return True
+
+	""" Returns the call being recorded on this thread, or None """
+	def current(self):
+		return getattr(self.local, 'call', None)
+
+	""" Adds time spent in a phase to the current call """
+	def phase(self, name, seconds):
+		call = self.current()
+		if call != None:
+			call[name + '_ms'] = call.get(name + '_ms', 0) + seconds * 1000
+
+	""" Adds to a counter of the current call """
+	def count(self, name, amount):
+		call = self.current()
+		if call != None:
+			call[name] = call.get(name, 0) + amount
+
+	""" Finishes the call being recorded on this thread """
+	def end(self, error = None):
+		call = self.current()
+		if call == None:
+			return
+
+		call['total_ms'] = (time.time() - self.local.start) * 1000
+		if error != None:
+			call['error'] = type(error).__name__ + ': ' + str(error)
+
+		self.local.call = None
+
+		with self.lock:
+			self.calls.append(call)
+
+	""" Returns the recorded calls, oldest first """
+	def entries(self):
+		with self.lock:
+			return list(self.calls)
+
+	""" Returns per method counts, errors, total p50/p95 and the median of every phase """
+	def summary(self):
+		methods = {}
+
+		for call in self.entries():
+			methods.setdefault(call['method'], []).append(call)
+
+		summary = {}
+		for method, calls in methods.items():
+			totals = sorted(c['total_ms'] for c in calls)
+			row = {
+				'calls': len(calls),
+				'errors': len([c for c in calls if c['error'] != None]),
+				'p50_ms': percentile(totals, 0.5),
+				'p95_ms': percentile(totals, 0.95),
+				'request_bytes': sum(c.get('request_bytes', 0) for c in calls) // len(calls),
+				'response_bytes': sum(c.get('response_bytes', 0) for c in calls) // len(calls),
+			}
+
+			for phase in PHASES:
+				row[phase + '_p50_ms'] = percentile(sorted(c.get(phase + '_ms', 0) for c in calls), 0.5)
+
+			summary[method] = row
+
+		return summary
+
+	""" Writes the recorded calls to a file as JSON lines, returns how many were written """
+	def export(self, path):
+		calls = self.entries()
+
+		with open(path, 'w') as f:
+			for call in calls:
+				f.write(json.dumps(call, sort_keys = True) + '\n')
+
+		return len(calls)
+
+	""" Forgets every recorded call """
+	def clear(self):
+		with self.lock:
+			self.calls.clear()
+
+# shared by every client and transport
+calls = CallLog()
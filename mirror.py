@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+import os, sys, io, re, json, threading
+if sys.version_info[0] == 3:
+	from .wordpress_xmlrpc import *
+	from .wordpress_xmlrpc.methods.posts import *
+	from . import common, executor, store
+else:
+	from wordpress_xmlrpc import *
+	from wordpress_xmlrpc.methods.posts import *
+	import common, executor, store
+
+# the post fields a mirrored file and its sidecar are made from
+FIELDS = ['post_id', 'post_title', 'post_name', 'post_type', 'post_status', 'post_content', 'post_modified_gmt']
+
+# post types mirrored by a sync
+POST_TYPES = ['post', 'page']
+
+""" Returns the directory sites are mirrored in, None if mirroring is turned off """
+def root():
+	directory = common.sp_settings.get('scratch_directory', '') if common.sp_settings != None else ''
+	if not directory:
+		return None
+
+	return os.path.expanduser(directory)
+
+""" Turns a title into something safe to use in a file name """
+def slugify(text):
+	slug = re.sub(r'[^a-z0-9]+', '-', (text or '').lower()).strip('-')
+	return slug[:60] or 'untitled'
+
+""" Returns the path of the sidecar that goes with a mirrored file """
+def sidecar_path(path):
+	directory, name = os.path.split(path)
+	return os.path.join(directory, '.' + name + '.json')
+
+""" Returns the path the site's copy of a post is put at when it conflicts with the local one """
+def remote_path(path):
+	base, ext = os.path.splitext(path)
+	return base + '.remote' + ext
+
+""" Returns the sidecar of a mirrored file, None if the file isn't part of a mirror """
+def read_sidecar(path):
+	try:
+		with open(sidecar_path(path), 'r') as f:
+			return json.load(f)
+	except (IOError, OSError, ValueError):
+		return None
+
+def write_sidecar(path, meta):
+	write_file(sidecar_path(path), json.dumps(meta, sort_keys = True))
+
+""" Writes text to a file through a temporary one, so a crash never leaves half of it behind """
+def write_file(path, text):
+	tmp = path + '.tmp'
+
+	# newlines are kept as they are so the hashes match what was sent
+	with io.open(tmp, 'w', encoding = 'utf-8', newline = '') as f:
+		f.write(text)
+
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(tmp, path)
+
+def read_file(path):
+	with io.open(path, 'r', encoding = 'utf-8', newline = '') as f:
+		return f.read()
+
+class Conflict(Exception):
+	""" Raised when a post changed both on the site and in its mirrored file since they were last synced """
+	pass
+
+class Mirror(object):
+	"""
+	On-disk copy of the posts of one site, one file per post with a hidden sidecar next to it
+	that records the post's modification date and content hash as of the last sync.
+
+	A sync compares the site's modification dates with the sidecars to find posts changed on
+	the site, and the files' sizes, times and hashes with the sidecars to find posts changed
+	locally. Posts changed on both sides are left alone, with the site's version next to the
+	local file, until the conflict is resolved.
+	"""
+	def __init__(self, site, directory):
+		self.site = site
+		self.directory = directory
+		self.lock = threading.Lock()
+		self.paths = None
+
+	""" Returns the path a newly mirrored post is written to, existing ones keep theirs """
+	def path_for(self, post):
+		directory = os.path.join(self.directory, post.post_type)
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+		return os.path.join(directory, str(post.id) + '-' + slugify(post.slug or post.title) + '.html')
+
+	""" Returns the local file of a post by id, None if it isn't mirrored yet """
+	def find(self, post_id):
+		with self.lock:
+			paths = self.paths
+
+		if paths == None:
+			paths = self.scan()
+
+		return paths.get(str(post_id))
+
+	""" Walks the mirror and returns the file of every post by id, forgetting sidecars whose file has been deleted """
+	def scan(self):
+		paths = {}
+
+		for directory, dirs, files in os.walk(self.directory):
+			for name in files:
+				if not (name.startswith('.') and name.endswith('.json')):
+					continue
+
+				path = os.path.join(directory, name[1:-5])
+				meta = read_sidecar(path)
+				if meta == None:
+					continue
+
+				# deleting the local file only drops it from the mirror, the next sync brings it back
+				if not os.path.exists(path):
+					os.remove(os.path.join(directory, name))
+					continue
+
+				paths[str(meta['id'])] = path
+
+		with self.lock:
+			self.paths = paths
+
+		return dict(paths)
+
+	""" Returns True if a mirrored file has been edited since its last sync """
+	def changed(self, path, meta):
+		stat = os.stat(path)
+
+		# only hash the file when its size or time says it may have changed
+		if stat.st_size == meta.get('size') and stat.st_mtime == meta.get('mtime'):
+			return False
+
+		return store.content_hash(read_file(path)) != meta.get('hash')
+
+	""" Records a file as in sync with the site """
+	def synced(self, path, post_id, post_type, title, post_status, modified, content):
+		stat = os.stat(path)
+
+		meta = {
+			'id': str(post_id),
+			'site': self.site,
+			'post_type': post_type,
+			'title': title,
+			'post_status': post_status,
+			'date_modified': modified,
+			'hash': store.content_hash(content),
+			'size': stat.st_size,
+			'mtime': stat.st_mtime,
+		}
+		write_sidecar(path, meta)
+
+		with self.lock:
+			if self.paths != None:
+				self.paths[str(post_id)] = path
+
+		if os.path.exists(remote_path(path)):
+			os.remove(remote_path(path))
+
+		return meta
+
+	"""
+	Brings the site's version of a post into the mirror, called from a worker thread. If the
+	local file was edited meanwhile and differs from the site, it is left alone and Conflict is
+	raised with the site's version saved next to it.
+	"""
+	def pull(self, client, post_id):
+		post = client.call(GetPost(post_id, FIELDS))
+		modified = store.stamp(post.date_modified)
+		content = post.content or ''
+
+		path = self.find(post_id)
+		meta = read_sidecar(path) if path != None else None
+
+		if path == None:
+			path = self.path_for(post)
+		elif meta != None and self.changed(path, meta) and store.content_hash(read_file(path)) != store.content_hash(content):
+			write_file(remote_path(path), content)
+			meta['conflict'] = modified
+			write_sidecar(path, meta)
+			raise Conflict(path)
+
+		write_file(path, content)
+		self.synced(path, post.id, post.post_type, post.title, post.post_status, modified, content)
+
+		return path
+
+	"""
+	Sends a mirrored file to the site, called from a worker thread. Unless force is set, the
+	post is first checked for changes on the site since the last sync, which are pulled instead.
+	Returns False if the file had nothing to send.
+	"""
+	def push(self, client, path, force = False):
+		meta = read_sidecar(path)
+		if meta == None:
+			raise Exception(path + ' is not part of a mirror')
+
+		content = read_file(path)
+		if not force and store.content_hash(content) == meta.get('hash'):
+			return False
+
+		if not force:
+			remote = client.call(GetPost(meta['id'], ['post_id', 'post_modified_gmt']))
+			if store.stamp(remote.date_modified) != meta.get('date_modified'):
+				# pulling keeps the local file if it differs, and raises Conflict
+				self.pull(client, meta['id'])
+				return False
+
+		client.call(EditPost(meta['id'], {'post_content': content}))
+
+		# anything still cached of the post predates this edit
+		store.full_posts.discard((self.site, meta['id']))
+		store.snapshots.discard(self.site, meta['id'])
+
+		remote = client.call(GetPost(meta['id'], ['post_id', 'post_modified_gmt']))
+		self.synced(path, meta['id'], meta['post_type'], meta['title'], meta['post_status'], store.stamp(remote.date_modified), content)
+
+		return True
+
+	""" Settles a conflict by sending the local file, or by taking the site's version """
+	def resolve(self, client, path, keep_local):
+		if keep_local:
+			return self.push(client, path, force = True)
+
+		meta = read_sidecar(path)
+		os.remove(path)
+		os.remove(sidecar_path(path))
+		with self.lock:
+			self.paths = None
+
+		return self.pull(client, meta['id'])
+
+	""" Returns the files whose post changed on both sides, and the post of each """
+	def conflicts(self):
+		found = []
+
+		for post_id, path in sorted(self.scan().items()):
+			meta = read_sidecar(path)
+			if meta != None and meta.get('conflict'):
+				found.append((path, meta))
+
+		return found
+
+	"""
+	Syncs the mirror with the site in both directions, called from a worker thread. Transfers run
+	on pool, and progress(done, total) is called as they finish. Returns a report of what happened.
+	"""
+	def sync(self, client, pool, post_types = POST_TYPES, progress = None):
+		report = {'downloaded': [], 'uploaded': [], 'conflicts': [], 'failed': [], 'removed': [], 'kept': []}
+
+		# the post stores only list what changed since they last synced
+		remote = {}
+		for post_type in post_types:
+			for post in store.post_store(self.site, post_type).sync(client):
+				remote[post['id']] = post
+
+		local = self.scan()
+		jobs = []
+
+		for post_id, post in remote.items():
+			path = local.get(post_id)
+			if path == None:
+				jobs.append((post['title'], self.pull, (client, post_id)))
+				continue
+
+			meta = read_sidecar(path)
+			if meta.get('conflict'):
+				report['conflicts'].append(path)
+			elif post['date_modified'] != meta.get('date_modified'):
+				jobs.append((post['title'], self.pull, (client, post_id)))
+			elif self.changed(path, meta):
+				jobs.append((post['title'], self.push, (client, path, True)))
+
+		# posts deleted on the site go too, unless they were edited here
+		for post_id, path in local.items():
+			meta = read_sidecar(path)
+			if post_id in remote or meta.get('post_type') not in post_types:
+				continue
+
+			if self.changed(path, meta):
+				report['kept'].append(path)
+			else:
+				os.remove(path)
+				os.remove(sidecar_path(path))
+				report['removed'].append(path)
+
+		done = [0]
+		finished = threading.Event()
+		lock = threading.Lock()
+
+		def transferred(title, fn, future):
+			with lock:
+				if isinstance(future.error, Conflict):
+					report['conflicts'].append(str(future.error))
+				elif future.error != None:
+					report['failed'].append(title + ': ' + str(future.error))
+				elif fn == self.push:
+					report['uploaded'].append(title)
+				else:
+					report['downloaded'].append(title)
+
+				done[0] += 1
+				if done[0] == len(jobs):
+					finished.set()
+
+			if progress != None:
+				progress(done[0], len(jobs))
+
+		for title, fn, args in jobs:
+			future = pool.submit(fn, args, executor.BACKGROUND)
+			future.add_done_callback(lambda f, title = title, fn = fn: transferred(title, fn, f))
+
+		if jobs:
+			finished.wait()
+
+		with self.lock:
+			self.paths = None
+
+		return report
+
+""" Returns a plain text summary of a sync report """
+def describe(report):
+	lines = ['%d downloaded, %d uploaded, %d removed, %d conflicts, %d failed' % (len(report['downloaded']), len(report['uploaded']), len(report['removed']), len(report['conflicts']), len(report['failed']))]
+
+	for key, label in [('conflicts', 'Changed on both sides, see Resolve Mirror Conflicts'), ('kept', 'Deleted on the site but edited here, kept'), ('failed', 'Failed')]:
+		if report[key]:
+			lines.append('')
+			lines.append(label + ':')
+			lines.extend('  ' + entry for entry in sorted(report[key]))
+
+	return '\n'.join(lines) + '\n'
+
+mirrors = {}
+mirrors_lock = threading.Lock()
+
+""" Returns the mirror of a site, None if mirroring is turned off """
+def site_mirror(site):
+	directory = root()
+	if directory == None:
+		return None
+
+	with mirrors_lock:
+		key = (site, directory)
+		if key not in mirrors:
+			mirrors[key] = Mirror(site, os.path.join(directory, site.replace(':', '-')))
+
+		return mirrors[key]
+
+""" Returns the mirror a file belongs to and its sidecar, (None, None) if it isn't a mirrored file """
+def file_mirror(path):
+	meta = read_sidecar(path) if path else None
+	if meta == None or 'site' not in meta:
+		return None, None
+
+	return site_mirror(meta['site']), meta
+
+# transfers of every mirror run here
+pool = executor.WorkerPool(4)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import sys, datetime
+if sys.version_info[0] == 3:
+	import xmlrpc.client as xmlrpc_client
+	from .wordpress_xmlrpc.fieldmaps import *
+else:
+	import xmlrpclib as xmlrpc_client
+	from wordpress_xmlrpc.fieldmaps import *
+
+# how each field is converted when a compact object is built
+PLAIN = 0
+DATE = 1
+TERMS = 2
+
+""" Returns the field maps of a WordPressBase subclass, built once and cached on the class """
+def field_maps(results_class):
+	maps = results_class.__dict__.get('_sublpress_maps')
+
+	if maps == None:
+		maps = {}
+		for key, value in results_class.definition.items():
+			if isinstance(value, FieldMap):
+				maps[key] = value
+			else:
+				maps[key] = FieldMap(value)
+
+		results_class._sublpress_maps = maps
+
+	return maps
+
+class LazyDate(object):
+	""" Descriptor that keeps a date as sent by the server and only turns it into a datetime when it is read """
+	def __init__(self, slot):
+		self.slot = slot
+
+	def __get__(self, obj, cls):
+		if obj is None:
+			return self
+
+		value = getattr(obj, self.slot)
+
+		if not isinstance(value, datetime.datetime):
+			if not isinstance(value, xmlrpc_client.DateTime):
+				value = xmlrpc_client.DateTime(value)
+
+			value = datetime.datetime(*tuple(value.timetuple())[:6])
+			setattr(obj, self.slot, value)
+
+		return value
+
+	def __set__(self, obj, value):
+		setattr(obj, self.slot, value)
+
+	def __delete__(self, obj):
+		delattr(obj, self.slot)
+
+class CompactBase(object):
+	""" Base class of the slotted stand-ins generated for WordPressBase subclasses by compact() """
+	__slots__ = ()
+
+	""" Builds an instance from a response struct using the class' precompiled field table """
+	@classmethod
+	def from_xmlrpc(cls, data):
+		obj = cls.__new__(cls)
+
+		for slot, name, default, kind, nested in cls._table:
+			if kind == TERMS:
+				value = [nested.from_xmlrpc(v) for v in data.get(name) or []]
+			else:
+				value = data.get(name, default)
+
+			if value is not None:
+				setattr(obj, slot, value)
+
+		return obj
+
+	""" XML-RPC-friendly representation of the current object state, like WordPressBase.struct """
+	@property
+	def struct(self):
+		data = {}
+
+		for key, fmap in self._maps.items():
+			if hasattr(self, key):
+				data.update(fmap.get_outputs(getattr(self, key)))
+
+		return data
+
+	""" Returns a regular instance of the model class with the same values, e.g. to edit it """
+	def expand(self):
+		obj = self.model.__new__(self.model)
+		obj._def = self._maps
+
+		for key in self._maps:
+			if hasattr(self, key):
+				value = getattr(self, key)
+				if type(value) is list:
+					value = [v.expand() if isinstance(v, CompactBase) else v for v in value]
+				setattr(obj, key, value)
+
+		return obj
+
+	def __str__(self):
+		return str(self.expand())
+
+	def __repr__(self):
+		return '<' + type(self).__name__ + ' ' + repr(getattr(self, 'id', None)) + '>'
+
+compact_classes = {}
+
+""" Returns the slotted stand-in for a WordPressBase subclass, generated once from its definition """
+def compact(results_class):
+	cls = compact_classes.get(results_class)
+	if cls != None:
+		return cls
+
+	maps = field_maps(results_class)
+	slots = []
+	table = []
+	namespace = {}
+
+	for key, fmap in sorted(maps.items()):
+		if isinstance(fmap, DateTimeFieldMap):
+			# the raw value lives in a private slot until the date is read
+			slot = '_' + key
+			namespace[key] = LazyDate(slot)
+			table.append((slot, fmap.name, fmap.default, DATE, None))
+		elif isinstance(fmap, TermsListFieldMap):
+			slot = key
+			table.append((slot, fmap.name, fmap.default, TERMS, compact(fmap.object_class)))
+		else:
+			slot = key
+			table.append((slot, fmap.name, fmap.default, PLAIN, None))
+
+		slots.append(slot)
+
+	namespace['__slots__'] = tuple(slots)
+	namespace['_table'] = tuple(table)
+	namespace['_maps'] = maps
+	namespace['model'] = results_class
+
+	cls = type('Compact' + results_class.__name__, (CompactBase, ), namespace)
+	compact_classes[results_class] = cls
+
+	return cls
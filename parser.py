@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import sys
+from xml.parsers import expat
+if sys.version_info[0] == 3:
+	import xmlrpc.client as xmlrpc_client
+	from . import models
+else:
+	import xmlrpclib as xmlrpc_client
+	import models
+
+""" Creates a results_class instance from a response struct without going through WordPressBase.__init__ """
+def build(results_class, maps, data):
+	obj = results_class.__new__(results_class)
+	obj._def = maps
+
+	for key, fmap in maps.items():
+		value = fmap.convert_to_python(data)
+		if value is not None:
+			setattr(obj, key, value)
+
+	return obj
+
+def to_int(data):
+	return int(data)
+
+def to_bool(data):
+	return data == '1'
+
+def to_double(data):
+	return float(data)
+
+def to_string(data):
+	return data
+
+def to_datetime(data):
+	value = xmlrpc_client.DateTime()
+	value.decode(data)
+	return value
+
+def to_binary(data):
+	value = xmlrpc_client.Binary()
+	value.decode(data.encode('ascii'))
+	return value
+
+def to_nil(data):
+	return None
+
+CONVERTERS = {
+	'int': to_int,
+	'i4': to_int,
+	'i8': to_int,
+	'boolean': to_bool,
+	'double': to_double,
+	'string': to_string,
+	'dateTime.iso8601': to_datetime,
+	'base64': to_binary,
+	'nil': to_nil,
+}
+
+class TypedParser(object):
+	"""
+	Parses an XML-RPC response straight from expat events into results_class instances.
+
+	Only the structs that make up the result itself are turned into objects, and their
+	members the model has no field for are skipped without being built. With compact
+	set, the objects are the slotted stand-ins from models.compact(). Acts as both
+	the parser and the unmarshaller expected by xmlrpc Transport.getparser().
+	"""
+	def __init__(self, results_class, compact = False):
+		self.results_class = results_class
+		self.maps = models.field_maps(results_class)
+		self.compact = compact and models.compact(results_class)
+		self.wanted = set(fmap.name for fmap in self.maps.values())
+
+		self.params = []
+		self.stack = []
+		self.keys = []
+		self.data = []
+		self.value_open = False
+		self.skip_level = 0
+		self.fault = False
+
+		self.parser = expat.ParserCreate(None, None)
+		self.parser.StartElementHandler = self.start
+		self.parser.EndElementHandler = self.end
+		self.parser.CharacterDataHandler = self.char_data
+		self.parser.buffer_text = True
+
+	def feed(self, data):
+		self.parser.Parse(data, False)
+
+	""" Closes the expat parser when used as the parser, and returns the result tuple when used as the unmarshaller """
+	def close(self):
+		if self.parser != None:
+			self.parser.Parse(b'', True)
+			self.parser = None
+			return
+
+		if self.fault:
+			raise xmlrpc_client.Fault(**self.params[0])
+
+		return tuple(self.params)
+
+	""" Returns True if a struct at this depth is one of the objects the response is made of """
+	def is_object(self, depth):
+		if self.results_class == None or self.fault:
+			return False
+
+		return depth == 0 or (depth == 1 and type(self.stack[0]) is list)
+
+	def start(self, tag, attrs):
+		if self.skip_level:
+			self.skip_level += 1
+			return
+
+		if tag == 'struct':
+			self.stack.append({})
+			self.keys.append(None)
+		elif tag == 'array':
+			self.stack.append([])
+		elif tag == 'fault':
+			self.fault = True
+
+		self.data = []
+		self.value_open = tag == 'value'
+
+	def char_data(self, data):
+		if not self.skip_level:
+			self.data.append(data)
+
+	def end(self, tag):
+		# still inside a member we don't want
+		if self.skip_level:
+			self.skip_level -= 1
+			return
+
+		converter = CONVERTERS.get(tag)
+		if converter != None:
+			self.value_open = False
+			self.add(converter(''.join(self.data)))
+		elif tag == 'value':
+			# a value without a type is a string
+			if self.value_open:
+				self.value_open = False
+				self.add(''.join(self.data))
+		elif tag == 'name':
+			name = ''.join(self.data)
+			self.keys[-1] = name
+
+			# skip the value of members the model has no field for
+			if name not in self.wanted and self.is_object(len(self.stack) - 1):
+				self.skip_level = 1
+		elif tag == 'struct':
+			self.keys.pop()
+			data = self.stack.pop()
+
+			if self.is_object(len(self.stack)):
+				if self.compact:
+					data = self.compact.from_xmlrpc(data)
+				else:
+					data = build(self.results_class, self.maps, data)
+
+			self.add(data)
+		elif tag == 'array':
+			self.add(self.stack.pop())
+
+	""" Adds a finished value to the container being built """
+	def add(self, value):
+		if not self.stack:
+			self.params.append(value)
+		elif type(self.stack[-1]) is list:
+			self.stack[-1].append(value)
+		else:
+			self.stack[-1][self.keys[-1]] = value
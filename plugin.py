@@ -6,13 +6,15 @@ if sys.version_info[0] == 3:
 	from .wordpress_xmlrpc.methods.posts import *
 	from .wordpress_xmlrpc.methods.taxonomies import *
 	from .wordpress_xmlrpc.methods.users import *
-	from . import common
+	from .wordpress_xmlrpc.methods.options import *
+	from . import common, store, executor, journal, sites, search, metrics, bulk, archive, mirror, reporting
 else:
 	from wordpress_xmlrpc import *
 	from wordpress_xmlrpc.methods.posts import *
 	from wordpress_xmlrpc.methods.taxonomies import *
 	from wordpress_xmlrpc.methods.users import *
-	import common
+	from wordpress_xmlrpc.methods.options import *
+	import common, store, executor, journal, sites, search, metrics, bulk, archive, mirror, reporting
 
 class CreateDefaultWordpressSettingsCommand(sublime_plugin.TextCommand):
 	def run(self, edit):
@@ -22,8 +24,19 @@ class CreateDefaultWordpressSettingsCommand(sublime_plugin.TextCommand):
 		n = sublime.active_window().open_file(sublime.packages_path() + "/User/Wordpress.sublime-settings")
 		n.insert(edit, 0, """
 {
-	"upload_on_save": true, // Unused
-	"scratch_directory": "~/.sublime/wordpress",  // Unused
+	"upload_on_save": true, // Send a mirrored post to its site whenever its file is saved
+	"scratch_directory": "~/.sublime/wordpress", // Where the posts of each site are mirrored, one file per post, empty to edit posts in unsaved views instead
+	"post_page_size": 50, // Number of posts fetched per page when browsing posts
+	"upload_concurrency": 3, // Number of files uploaded at once by a bulk upload
+	"fast_parser": true, // Parse responses straight into posts and terms instead of going through generic dicts first
+	"write_concurrency": 2, // Number of queued saves sent to the site at once
+	"site_concurrency": 8, // Number of sites an operation on every connected site talks to at once
+	"call_log_size": 500, // Number of recent XML-RPC calls kept for the performance panel
+	"prefetch_on_connect": true, // Load what the WordPress menus need in the background as soon as a site is picked
+	"bulk_concurrency": 8, // Most posts a bulk edit sends at once, it starts lower and adapts to how the site copes
+	"import_concurrency": 4, // Number of posts, terms and media items a site import creates at once
+	"mirror_concurrency": 4, // Number of posts a mirror sync downloads or uploads at once
+	"media_cache_size": 64, // Megabytes of media library listings and thumbnails kept on disk per site
 	"sites":
 	{
 		/*
@@ -33,6 +46,8 @@ class CreateDefaultWordpressSettingsCommand(sublime_plugin.TextCommand):
 			"salt": "unused",
 			"username": "username",
 			"password": "password",
+			"compression": true, // Ask the server for gzip compressed responses
+			"compress_requests": false, // Gzip large requests too, only if the server accepts them
 		}
 		*/
 	}
@@ -52,12 +67,25 @@ def plugin_loaded():
 
 	# initialize some default values
 	common.sp_wp = None
+	common.sp_site = None
 	common.sp_settings = sublime.load_settings('Wordpress.sublime-settings')
 	common.sp_started = True
 
+	# errors from the client and the sites it talks to go to the editor
+	reporting.error_handler = sublime.error_message
+	reporting.status_handler = sublime.status_message
+
+	sites.registry.on_connect = site_connected
+	sites.fan_out_pool.max_workers = common.sp_settings.get('site_concurrency', 8)
+	metrics.calls.resize(common.sp_settings.get('call_log_size', 500))
+	bulk.pool.max_workers = common.sp_settings.get('bulk_concurrency', 8)
+	archive.workers.max_workers = common.sp_settings.get('import_concurrency', 4)
+	mirror.pool.max_workers = common.sp_settings.get('mirror_concurrency', 4)
+
 	print("Sublpress loaded.")
 
-if not common.sp_started:
+# Sublime Text 3 calls plugin_loaded itself once its API is ready
+if not common.sp_started and int(sublime.version()) < 3000:
 	sublime.set_timeout(plugin_loaded, 300)
 
 class WordpressManageSites(sublime_plugin.WindowCommand):
@@ -68,31 +96,224 @@ class WordpressManageSites(sublime_plugin.WindowCommand):
 		if not os.path.exists(sublime.packages_path() + "/User/Wordpress.sublime-settings"):
 			sublime.active_window().run_command('create_default_wordpress_settings')
 
-class WordpressConnectCall(threading.Thread):
-	""" Used to connect Sublime's Wordpress Connect command to wordpress_xmlrpc via theads """
-	def __init__(self, url, username, password):
-		# initialize some stuff
-		self.url = url
-		self.username = username
-		self.password = password
-		self.result = None    
+""" Runs a wordpress_xmlrpc method on the shared worker pool, calling callback with the result on the UI thread """
+def api_call(method, callback = None, priority = executor.INTERACTIVE):
+	return submit(call_method, (method, ), callback, priority)
 
-		# make sure to initialize the thread
-		threading.Thread.__init__(self)
+""" Runs several wordpress_xmlrpc methods in one multicall on the shared worker pool """
+def batch_call(methods, callback = None, priority = executor.INTERACTIVE):
+	return submit(call_batch, (methods, ), callback, priority)
 
-	""" Called by the threading module after being started """
-	def run(self):
-		# make sure we have a valid wordpress client object
+""" Queues fn(*args) on the shared worker pool, or on pool, and hands its result to callback on the UI thread """
+def submit(fn, args = (), callback = None, priority = executor.INTERACTIVE, pool = None):
+	future = (pool or executor.pool).submit(fn, args, priority)
+
+	if callback != None:
+		future.add_done_callback(lambda f: sublime.set_timeout(lambda: dispatch(f, callback), 0))
+
+	return future
+
+""" Called on the UI thread when a submitted job has finished """
+def dispatch(future, callback):
+	# the panel that wanted this result has been dismissed
+	if future.cancelled:
+		return
+
+	if future.error != None:
+		sublime.error_message(str(future.error))
+		return
+
+	# the method couldn't run, so don't execute the callback
+	if future.value is False:
+		return
+
+	callback(future.value)
+
+""" Returns the shared term store for a taxonomy on the connected site """
+def term_store(taxonomy):
+	return store.term_store(store.site_key(common.sp_wp), taxonomy)
+
+""" Hands the term store for a taxonomy to callback on the UI thread, fetching the terms first if needed """
+def load_terms(taxonomy, callback, priority = executor.INTERACTIVE):
+	terms = term_store(taxonomy)
+
+	if terms.is_current():
+		sublime.set_timeout(lambda: callback(terms), 0)
+		return
+
+	submit(terms.fetch, (common.sp_wp, ), callback, priority)
+
+""" Queues the fields of a post that changed since it was opened or last saved, None if nothing did """
+def send_post(post):
+	# make sure we have a valid wordpress client object
+	if common.sp_wp == None:
+		raise Exception('Not connected')
+
+	site = store.site_key(common.sp_wp)
+	changes = store.snapshots.changes(site, post)
+
+	# nothing to send, so skip the request entirely
+	if not changes:
+		return None
+
+	result = queue_write(EditPost(post.id, changes))
+	store.snapshots.commit(site, post.id, changes)
+	search.index(site).add(post)
+
+	return result
+
+# rapid saves of the same post go out as one request
+post_saves = store.SaveCoalescer(send_post)
+
+""" Saves a post, calling callback on the UI thread once it is queued, with None if nothing had changed """
+def save_post(post, callback = None):
+	def saved(result, error):
+		if error != None:
+			sublime.set_timeout(lambda: sublime.error_message(str(error)), 0)
+		elif callback != None:
+			sublime.set_timeout(lambda: callback(result), 0)
+
+	post_saves.save(str(post.id), post, saved)
+
+""" Returns a live client for the given site, None if none is connected """
+def site_client(site):
+	if common.sp_wp != None and store.site_key(common.sp_wp) == site:
+		return common.sp_wp
+
+	for label, wp in sites.registry.items():
+		if store.site_key(wp) == site:
+			return wp
+
+	return None
+
+""" Returns the journal of writes waiting to be sent to a site, the current one by default """
+def write_journal(wp = None):
+	site = store.site_key(wp or common.sp_wp)
+	concurrency = common.sp_settings.get('write_concurrency', 2)
+
+	return journal.journal(site, concurrency = concurrency, client = lambda: site_client(site), on_change = journal_changed, on_error = journal_error)
+
+""" Queues a write to the connected site, it is sent in the background and kept on disk until it has been """
+def queue_write(method):
+	return write_journal().put(method)
+
+""" Called from any thread when the number of queued writes has changed """
+def journal_changed(queue):
+	status = queue.status()
+	sublime.set_timeout(lambda: show_journal_status(status), 0)
+
+""" Called from a worker thread when the site refused a queued write """
+def journal_error(entry, error):
+	message = 'Could not send a queued ' + entry['method'] + ': ' + str(error) + '\n\nIt is kept until you retry or drop it with WordPress: Failed Writes.'
+	sublime.set_timeout(lambda: sublime.error_message(message), 0)
+
+""" Shows the state of the write queue in the status bar of the active views """
+def show_journal_status(status):
+	for window in sublime.windows():
+		view = window.active_view()
+		if view == None:
+			continue
+
+		if status:
+			view.set_status('wordpress_journal', status)
+		else:
+			view.erase_status('wordpress_journal')
+
+class WordpressJournalStatus(sublime_plugin.EventListener):
+	""" Keeps the state of the write queue in the status bar as views are switched """
+	def on_activated(self, view):
 		if common.sp_wp == None:
-			common.sp_wp = Client(self.url, self.username, self.password)
-			self.result = common.sp_wp
+			view.erase_status('wordpress_journal')
 			return
 
-		# display an error message
-		sublime.error_message('Already connected.')
+		status = write_journal().status()
+		if status:
+			view.set_status('wordpress_journal', status)
+		else:
+			view.erase_status('wordpress_journal')
+
+def call_method(method):
+	# make sure we have a valid wordpress client object
+	if common.sp_wp == None:
+		sublime.error_message('Not connected')
+		return False
+
+	return send_method(method)
+
+# seconds a command waits for a queued write whose result it needs before leaving it to the journal
+WRITE_WAIT = 30
+
+""" Runs a method on the connected site, writes go through the journal so they aren't lost when the site can't be reached """
+def send_method(method):
+	name = type(method).__name__
+	if name not in journal.METHODS:
+		try:
+			return common.sp_wp.cached_call(method)
+		finally:
+			store.post_written(store.site_key(common.sp_wp), method)
+
+	# edits and deletes only report success, so there is nothing to wait for
+	if name != 'NewPost':
+		queue_write(method)
+		return True
+
+	# the new post's id is needed to open it
+	try:
+		return write_journal().call(method, WRITE_WAIT)
+	except journal.Offline as e:
+		sublime.error_message(str(e))
+	except Exception:
+		# journal_error has already told the user
+		pass
+
+	return False
+
+def call_batch(methods):
+	# make sure we have a valid wordpress client object
+	if common.sp_wp == None:
+		sublime.error_message('Not connected')
+		return False
+
+	return common.sp_wp.multicall(methods)
+
+""" Makes a configured site the one commands act on, connecting to it if needed, called from a worker thread """
+def use_site(label):
+	wp = sites.registry.get(label)
+
+	common.sp_wp = wp
+	common.sp_site = label
+
+	prefetch(wp)
+
+	return wp
+
+""" Lookups the menus shown after connecting start with, grouped by the request that fetches them """
+def prefetch_methods():
+	return [
+		[GetPosts({'number': 200, 'post_type': 'page'})],
+		[GetPosts({'number': 200, 'post_type': 'post'})],
+		[GetTaxonomies(), GetPostStatusList(), GetPostTypes(), GetOptions([])],
+	]
+
+""" Warms the session cache of a client in the background, so the menus open without waiting on the site """
+def prefetch(wp):
+	if not common.sp_settings.get('prefetch_on_connect', True):
+		return
+
+	for methods in prefetch_methods():
+		executor.pool.submit(wp.prefetch, (methods, ), executor.BACKGROUND)
+
+""" Called from a worker thread when the registry has connected to a site """
+def site_connected(label, wp):
+	# send whatever was queued while we weren't connected
+	write_journal(wp).retry()
+
+	# terms may have changed on the site since they were last fetched
+	store.forget_terms(store.site_key(wp))
 
-		# and make sure the result gets set again
-		self.result = common.sp_wp
+	# make sure cached capabilities still hold, or cache them for next time
+	if not wp.revalidated or (wp.capabilities != None and wp.capabilities.methods == None):
+		executor.pool.submit(wp.revalidate, priority = executor.BACKGROUND)
 
 class WordpressApiCall(threading.Thread):
 	""" Used to connect Sublime's Wordpress API commands to wordpress_xmlrpc via theads """
@@ -108,7 +329,7 @@ class WordpressApiCall(threading.Thread):
 	def run(self):
 		# make sure we have a valid wordpress client object
 		if common.sp_wp != None:
-			self.result = common.sp_wp.call(self.method)
+			self.result = send_method(self.method)
 			return
 
 		# display an error message
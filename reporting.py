@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import sys
+
+""" Writes a message to stderr, how errors are reported until something else takes over, e.g. outside the editor """
+def print_message(message):
+	sys.stderr.write('Sublpress: ' + message + '\n')
+
+# called with every error message meant for the user, the plugin points it at sublime.error_message
+error_handler = print_message
+
+# called with every passing status message, the plugin points it at sublime.status_message
+status_handler = print_message
+
+""" Tells the user about an error """
+def error(message):
+	error_handler(message)
+
+""" Tells the user about something in passing """
+def status(message):
+	status_handler(message)
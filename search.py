@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import os, sys, re, json, math, bisect, threading
+if sys.version_info[0] == 3:
+	from . import common
+else:
+	import common
+
+# how much a word counts depending on where it was found
+FIELD_WEIGHTS = {
+	'title': 4.0,
+	'slug': 3.0,
+	'excerpt': 2.0,
+	'content': 1.0,
+}
+
+# how much a word counts depending on how it matched the query
+EXACT = 1.0
+PREFIX = 0.6
+FUZZY = 0.4
+
+# seconds to wait before writing a changed index to disk
+SAVE_DELAY = 5
+
+TAG_RE = re.compile(r'<[^>]*>')
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+""" Returns the lowercase words of a piece of text, without HTML tags """
+def tokenize(text):
+	if not text:
+		return []
+
+	return [w for w in WORD_RE.findall(TAG_RE.sub(' ', text).lower()) if len(w) > 1]
+
+""" Returns the number of times each word appears in a piece of text """
+def count_words(text):
+	counts = {}
+	for word in tokenize(text):
+		counts[word] = counts.get(word, 0) + 1
+
+	return counts
+
+""" Returns the edit distance between two words, counting swapped letters as one typo, or limit + 1 as soon as it is known to exceed limit """
+def distance(a, b, limit):
+	if abs(len(a) - len(b)) > limit:
+		return limit + 1
+
+	before = None
+	previous = list(range(len(b) + 1))
+	for i in range(1, len(a) + 1):
+		current = [i]
+		for j in range(1, len(b) + 1):
+			cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+			if before != None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+				cost = min(cost, before[j - 2] + 1)
+			current.append(cost)
+
+		if min(current) > limit:
+			return limit + 1
+		before, previous = previous, current
+
+	return previous[-1]
+
+""" Returns how many typos a query word may contain """
+def typo_limit(word):
+	if len(word) >= 8:
+		return 2
+
+	if len(word) >= 4:
+		return 1
+
+	return 0
+
+class SearchIndex(object):
+	"""
+	Inverted index of the titles, slugs, excerpts and contents of a site's posts.
+
+	Posts are added as they are fetched or saved, fields a post comes without keep
+	what was indexed for them before, so list views can refresh titles without
+	dropping contents. Only the per-post word counts are stored on disk, the
+	postings are rebuilt from them on load.
+	"""
+	def __init__(self, site):
+		self.site = site
+		self.lock = threading.RLock()
+		self.docs = {}
+		self.postings = {}
+		self.words = []
+		self.words_dirty = False
+		self.dirty = False
+		self.timer = None
+		self.path = os.path.join(common.cache_path(site), 'search.json')
+		self.load()
+
+	""" Reads the index back from disk """
+	def load(self):
+		if not os.path.exists(self.path):
+			return
+
+		try:
+			with open(self.path, 'r') as f:
+				docs = json.load(f)
+		except ValueError:
+			return
+
+		with self.lock:
+			for post_id, doc in docs.items():
+				self.docs[post_id] = doc
+				self.post(post_id, doc)
+
+			self.words_dirty = True
+
+	""" Marks the index as changed and writes it to disk a few seconds later, so bursts of updates are saved once """
+	def touch(self):
+		self.dirty = True
+
+		if self.timer == None:
+			self.timer = threading.Timer(SAVE_DELAY, self.save)
+			self.timer.daemon = True
+			self.timer.start()
+
+	""" Writes the index to disk if it has changed """
+	def save(self):
+		with self.lock:
+			self.timer = None
+			if not self.dirty:
+				return
+
+			data = json.dumps(self.docs)
+			self.dirty = False
+
+		tmp = self.path + '.tmp'
+		with open(tmp, 'w') as f:
+			f.write(data)
+
+		# replace the old file in one go so a crash never leaves half an index behind
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		os.rename(tmp, self.path)
+
+	""" Adds the weighted word counts of a document to the postings, with the lock held """
+	def post(self, post_id, doc):
+		for field, counts in doc['fields'].items():
+			weight = FIELD_WEIGHTS[field]
+			for word, count in counts.items():
+				postings = self.postings.get(word)
+				if postings == None:
+					postings = self.postings[word] = {}
+					self.words_dirty = True
+				postings[post_id] = postings.get(post_id, 0) + weight * count
+
+	""" Takes the word counts of a document out of the postings, with the lock held """
+	def unpost(self, post_id, doc):
+		for field, counts in doc['fields'].items():
+			for word in counts:
+				postings = self.postings.get(word)
+				if postings == None:
+					continue
+
+				postings.pop(post_id, None)
+				if not postings:
+					del self.postings[word]
+					self.words_dirty = True
+
+	""" Indexes a post, or updates it if it was indexed before """
+	def add(self, post):
+		post_id = str(post.id)
+		fields = {}
+
+		for field in FIELD_WEIGHTS:
+			value = getattr(post, field, None)
+			if value != None:
+				fields[field] = count_words(value)
+
+		with self.lock:
+			old = self.docs.get(post_id)
+			if old != None:
+				self.unpost(post_id, old)
+
+				# keep what the post came without
+				for field, counts in old['fields'].items():
+					fields.setdefault(field, counts)
+
+			doc = {
+				'title': getattr(post, 'title', None) or (old and old['title']) or '',
+				'post_type': getattr(post, 'post_type', None) or (old and old['post_type']) or '',
+				'post_status': getattr(post, 'post_status', None) or (old and old['post_status']) or '',
+				'fields': fields,
+			}
+
+			self.docs[post_id] = doc
+			self.post(post_id, doc)
+			self.touch()
+
+	""" Drops a post from the index """
+	def remove(self, post_id):
+		post_id = str(post_id)
+
+		with self.lock:
+			doc = self.docs.pop(post_id, None)
+			if doc != None:
+				self.unpost(post_id, doc)
+				self.touch()
+
+	""" Returns the indexed words that match a query word, with how well they match """
+	def expand(self, word):
+		with self.lock:
+			if self.words_dirty:
+				self.words = sorted(self.postings)
+				self.words_dirty = False
+			words = self.words
+
+		matches = {}
+		if word in self.postings:
+			matches[word] = EXACT
+
+		# words starting with the query word sit next to each other in the sorted list
+		i = bisect.bisect_left(words, word)
+		while i < len(words) and words[i].startswith(word):
+			matches.setdefault(words[i], PREFIX)
+			i += 1
+
+		limit = typo_limit(word)
+		if limit:
+			for other in words:
+				if other in matches or other[0] != word[0]:
+					continue
+
+				if distance(word, other, limit) <= limit:
+					matches[other] = FUZZY
+
+		return matches
+
+	"""
+	Returns (post_id, title, score) tuples for the posts matching every word of a query, best first.
+	Words match exactly, as a prefix, or with a typo or two, and rarer words weigh more.
+	"""
+	def search(self, query, limit = 20, post_type = None):
+		words = tokenize(query)
+		if not words:
+			return []
+
+		scores = None
+
+		with self.lock:
+			total = max(len(self.docs), 1)
+
+			for word in words:
+				found = {}
+
+				for match, quality in self.expand(word).items():
+					postings = self.postings.get(match, {})
+					idf = math.log(1 + total / float(len(postings) or 1))
+
+					for post_id, weight in postings.items():
+						score = quality * idf * (1 + math.log(weight))
+						if score > found.get(post_id, 0):
+							found[post_id] = score
+
+				# every word has to match something
+				if scores == None:
+					scores = found
+				else:
+					scores = dict((post_id, scores[post_id] + score) for post_id, score in found.items() if post_id in scores)
+
+				if not scores:
+					return []
+
+			results = []
+			for post_id, score in scores.items():
+				doc = self.docs[post_id]
+				if post_type == None or doc['post_type'] == post_type:
+					results.append((post_id, doc['title'], score))
+
+		results.sort(key = lambda r: -r[2])
+
+		return results[:limit]
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+""" Returns the shared search index for a site """
+def index(site):
+	with indexes_lock:
+		if site not in indexes:
+			indexes[site] = SearchIndex(site)
+
+		return indexes[site]
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import copy, json, time, threading
+
+# how many seconds the result of each read-only lookup is reused for
+TTLS = {
+	'GetPosts': 120,
+	'GetTaxonomies': 600,
+	'GetTerms': 300,
+	'GetPostStatusList': 3600,
+	'GetPostTypes': 3600,
+	'GetOptions': 600,
+	'GetMediaLibrary': 300,
+}
+
+# the cached lookups each of our own writes makes stale
+STALE_AFTER = {
+	'NewPost': ['GetPosts'],
+	'EditPost': ['GetPosts'],
+	'DeletePost': ['GetPosts'],
+	'NewTerm': ['GetTerms', 'GetPosts'],
+	'EditTerm': ['GetTerms', 'GetPosts'],
+	'DeleteTerm': ['GetTerms', 'GetPosts'],
+	'SetOptions': ['GetOptions'],
+	'UploadFile': ['GetMediaLibrary'],
+}
+
+""" Returns the key a lookup's result is cached under, None if it isn't cached """
+def key_of(method):
+	name = type(method).__name__
+	if name not in TTLS:
+		return None
+
+	params = []
+	for arg in method.method_args + method.optional_args:
+		if hasattr(method, arg):
+			value = getattr(method, arg)
+			params.append(value.struct if hasattr(value, 'struct') else value)
+
+	return name + ':' + json.dumps(params, sort_keys = True, default = str)
+
+class SessionCache(object):
+	""" Results of read-only lookups on one site, reused until they expire or one of our writes makes them stale """
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.entries = {}
+		self.loading = {}
+		self.generations = {}
+		self.hits = 0
+		self.misses = 0
+
+	""" Returns the result of a lookup, from the cache if it is fresh, otherwise through load(method) """
+	def lookup(self, method, load):
+		key = key_of(method)
+		if key == None:
+			return load(method)
+
+		name = type(method).__name__
+
+		while True:
+			with self.lock:
+				entry = self.entries.get(key)
+				if entry != None and entry[0] > time.time():
+					self.hits += 1
+					return self.copy(entry[1])
+
+				# nobody is loading it yet, so it's our job
+				waiting = self.loading.get(key)
+				if waiting == None:
+					self.misses += 1
+					self.loading[key] = threading.Event()
+					generation = self.generations.get(name, 0)
+					break
+
+			# share the request that is already running, look again once it's done
+			waiting.wait()
+
+		try:
+			value = load(method)
+			self.store(key, name, value, generation)
+			return self.copy(value)
+		finally:
+			self.release([key])
+
+	""" Loads every lookup that isn't cached or being loaded yet with a single load_many(methods) call """
+	def warm(self, methods, load_many):
+		claimed = []
+
+		with self.lock:
+			now = time.time()
+			for method in methods:
+				key = key_of(method)
+				if key == None or key in self.loading:
+					continue
+
+				entry = self.entries.get(key)
+				if entry != None and entry[0] > now:
+					continue
+
+				name = type(method).__name__
+				self.loading[key] = threading.Event()
+				claimed.append((method, key, name, self.generations.get(name, 0)))
+
+		if not claimed:
+			return 0
+
+		try:
+			values = load_many([c[0] for c in claimed])
+
+			stored = 0
+			for (method, key, name, generation), value in zip(claimed, values):
+				# a batch hands back failed lookups instead of raising
+				if isinstance(value, Exception):
+					continue
+
+				self.store(key, name, value, generation)
+				stored += 1
+
+			return stored
+		finally:
+			self.release([c[1] for c in claimed])
+
+	""" Caches a loaded result, unless a write made it stale while it was being loaded """
+	def store(self, key, name, value, generation):
+		with self.lock:
+			if self.generations.get(name, 0) == generation:
+				self.entries[key] = (time.time() + TTLS[name], value)
+
+	""" Lets anyone waiting on keys that were being loaded go ahead """
+	def release(self, keys):
+		with self.lock:
+			events = [self.loading.pop(key) for key in keys if key in self.loading]
+
+		for event in events:
+			event.set()
+
+	""" Hands out copies of the models as well as the lists, so callers can't change what is cached """
+	def copy(self, value):
+		return copy.deepcopy(value)
+
+	""" Drops whatever a write to the site may have changed, called once the write has been sent """
+	def written(self, method):
+		stale = STALE_AFTER.get(type(method).__name__)
+		if stale:
+			self.invalidate(stale)
+
+	""" Drops every cached result of the named lookups, and any result of theirs still being loaded """
+	def invalidate(self, names):
+		with self.lock:
+			for name in names:
+				self.generations[name] = self.generations.get(name, 0) + 1
+
+			for key in [k for k in self.entries if k.partition(':')[0] in names]:
+				del self.entries[key]
+
+	""" Drops every cached result """
+	def clear(self):
+		self.invalidate(list(TTLS.keys()))
+
+	""" Returns how many lookups were answered from the cache, how many were not, and how many results are held """
+	def stats(self):
+		with self.lock:
+			return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import sys, threading
+if sys.version_info[0] == 3:
+	from . import common, connection, client, executor, capabilities
+else:
+	import common, connection, client, executor, capabilities
+
+""" Returns the sites configured in Wordpress.sublime-settings, by label """
+def configured():
+	if common.sp_settings == None:
+		return {}
+
+	return common.sp_settings.get('sites', {}) or {}
+
+""" Creates a client for the settings of a site, called from a worker thread """
+def create_client(site):
+	url = 'http://' + site['host'] + '/xmlrpc.php'
+	typed_parsing = common.sp_settings.get('fast_parser', True)
+	transport = connection.KeepAliveTransport('http', accept_compressed = site.get('compression', True), compress_requests = site.get('compress_requests', False))
+
+	cached = capabilities.Capabilities(site['host'])
+
+	return client.SublpressClient(url, site['username'], site['password'], transport = transport, typed_parsing = typed_parsing, capabilities = cached)
+
+class SiteRegistry(object):
+	""" Live clients keyed by the site labels in Wordpress.sublime-settings, each connected the first time it is used """
+	def __init__(self, create = create_client, on_connect = None):
+		self.create = create
+		self.on_connect = on_connect
+		self.lock = threading.Lock()
+		self.clients = {}
+		self.connecting = {}
+
+	""" Returns the client for a site, connecting to it first if needed, called from a worker thread """
+	def get(self, label):
+		with self.lock:
+			if label in self.clients:
+				return self.clients[label]
+
+			# only one thread connects to a given site, the others wait for it
+			lock = self.connecting.setdefault(label, threading.Lock())
+
+		with lock:
+			with self.lock:
+				if label in self.clients:
+					return self.clients[label]
+
+			site = configured().get(label)
+			if site == None:
+				raise KeyError('No site configured as ' + label)
+
+			wp = self.create(site)
+
+			with self.lock:
+				self.clients[label] = wp
+				self.connecting.pop(label, None)
+
+		if self.on_connect != None:
+			self.on_connect(label, wp)
+
+		return wp
+
+	""" Returns True if the site has a live client """
+	def is_connected(self, label):
+		with self.lock:
+			return label in self.clients
+
+	""" Returns the labels of the connected sites """
+	def connected(self):
+		with self.lock:
+			return sorted(self.clients.keys())
+
+	""" Returns (label, client) pairs for the connected sites """
+	def items(self):
+		with self.lock:
+			return sorted(self.clients.items())
+
+	""" Returns the label of a client, None if it isn't in the registry """
+	def label_of(self, wp):
+		with self.lock:
+			for label, other in self.clients.items():
+				if other is wp:
+					return label
+
+		return None
+
+	""" Forgets the client for a site, or every client """
+	def drop(self, label = None):
+		with self.lock:
+			if label == None:
+				self.clients = {}
+			else:
+				self.clients.pop(label, None)
+
+	"""
+	Runs fn(label, client) for every given site at once on the fan-out pool, connecting to them as needed.
+	on_result(label, result, error) is called from a worker thread as each site finishes, and on_done()
+	once all of them have. Returns the futures, one per site.
+	"""
+	def fan_out(self, labels, fn, on_result = None, on_done = None):
+		labels = list(labels)
+		remaining = [len(labels)]
+		lock = threading.Lock()
+		futures = []
+
+		def run(label):
+			return fn(label, self.get(label))
+
+		def finished(label, future):
+			if on_result != None and not future.cancelled:
+				on_result(label, future.value, future.error)
+
+			with lock:
+				remaining[0] -= 1
+				last = remaining[0] == 0
+
+			if last and on_done != None:
+				on_done()
+
+		if not labels and on_done != None:
+			on_done()
+
+		for label in labels:
+			future = fan_out_pool.submit(run, (label, ), executor.BACKGROUND)
+			future.add_done_callback(lambda f, label = label: finished(label, f))
+			futures.append(future)
+
+		return futures
+
+# cross-site operations get their own threads so they can't starve the current site's jobs
+fan_out_pool = executor.WorkerPool(8)
+
+registry = SiteRegistry()
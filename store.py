@@ -0,0 +1,721 @@
+# -*- coding: utf-8 -*-
+import os, sys, copy, json, time, threading, hashlib
+if sys.version_info[0] == 3:
+	from .wordpress_xmlrpc import *
+	from .wordpress_xmlrpc.methods.posts import *
+	from .wordpress_xmlrpc.methods.taxonomies import *
+	from . import common, executor, search, session
+	from urllib.parse import urlparse
+else:
+	from wordpress_xmlrpc import *
+	from wordpress_xmlrpc.methods.posts import *
+	from wordpress_xmlrpc.methods.taxonomies import *
+	import common, executor, search, session
+	from urlparse import urlparse
+
+# the only post fields list views need, as named by wp.getPosts
+LIST_FIELDS = ['post_id', 'post_title', 'post_name', 'post_parent', 'post_status', 'post_type', 'post_modified_gmt']
+
+""" Returns the key local caches are stored under for a client """
+def site_key(client):
+	return urlparse(client.url).netloc
+
+""" Turns a post date into a string that sorts chronologically """
+def stamp(value):
+	if value == None:
+		return ''
+
+	if hasattr(value, 'strftime'):
+		return value.strftime('%Y%m%dT%H:%M:%S')
+
+	return str(value)
+
+class PostStore(object):
+	""" Local copy of the metadata of every post of one post type on a site, synced incrementally """
+	def __init__(self, site, post_type, page_size = 100):
+		self.site = site
+		self.post_type = post_type
+		self.page_size = page_size
+		self.lock = threading.Lock()
+		self.high_water = ''
+		self.posts = {}
+		self.path = os.path.join(common.cache_path(site), 'posts-' + post_type + '.json')
+		self.load()
+
+	""" Reads the store back from disk """
+	def load(self):
+		if not os.path.exists(self.path):
+			return
+
+		try:
+			with open(self.path, 'r') as f:
+				data = json.load(f)
+		except ValueError:
+			return
+
+		self.high_water = data.get('high_water', '')
+		self.posts = data.get('posts', {})
+
+	""" Writes the store to disk """
+	def save(self):
+		tmp = self.path + '.tmp'
+
+		with open(tmp, 'w') as f:
+			json.dump({'high_water': self.high_water, 'posts': self.posts}, f)
+
+		# replace the old file in one go so a crash never leaves half a store behind
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		os.rename(tmp, self.path)
+
+	""" Adds or replaces a post in the store """
+	def update(self, post):
+		modified = stamp(post.date_modified)
+
+		with self.lock:
+			self.posts[str(post.id)] = {
+				'id': str(post.id),
+				'title': post.title,
+				'parent_id': str(post.parent_id or ''),
+				'post_status': post.post_status,
+				'post_type': post.post_type,
+				'date_modified': modified,
+			}
+
+	""" Removes a post from the store """
+	def remove(self, post_id):
+		with self.lock:
+			self.posts.pop(str(post_id), None)
+
+	""" Returns the stored posts, most recently modified first """
+	def list(self):
+		with self.lock:
+			return sorted(self.posts.values(), key = lambda p: p['date_modified'], reverse = True)
+
+	""" Fetches posts modified since the last sync and drops posts that no longer exist """
+	def sync(self, client, sweep = True):
+		high_water = self.high_water
+		newest = high_water
+		offset = 0
+
+		# walk the posts newest first until we reach ones we already have
+		while True:
+			posts = list_posts(client, {
+				'post_type': self.post_type,
+				'post_status': 'any',
+				'orderby': 'modified',
+				'order': 'DESC',
+				'number': self.page_size,
+				'offset': offset,
+			})
+
+			words = search.index(self.site)
+			for post in posts:
+				self.update(post)
+				words.add(post)
+				newest = max(newest, stamp(post.date_modified))
+
+			if len(posts) < self.page_size or stamp(posts[-1].date_modified) < high_water:
+				break
+
+			offset += self.page_size
+
+		if sweep:
+			self.sweep(client)
+
+		# only move the mark once the whole walk made it, so a sync that fails half way starts over
+		with self.lock:
+			self.high_water = newest
+
+		self.save()
+
+		return self.list()
+
+	""" Drops posts deleted on the server by comparing against an id-only listing """
+	def sweep(self, client):
+		ids = set()
+		offset = 0
+		page_size = self.page_size * 10
+
+		while True:
+			posts = client.call(GetPosts({
+				'post_type': self.post_type,
+				'post_status': 'any',
+				'number': page_size,
+				'offset': offset,
+			}, ['post_id']), compact = True)
+
+			for post in posts:
+				ids.add(str(post.id))
+
+			if len(posts) < page_size:
+				break
+
+			offset += page_size
+
+		with self.lock:
+			for post_id in [i for i in self.posts if i not in ids]:
+				del self.posts[post_id]
+				search.index(self.site).remove(post_id)
+
+class LinkedMap(object):
+	""" Mapping that remembers the order keys were last set in, for Python 2.6 which has no OrderedDict """
+	def __init__(self):
+		self.nodes = {}
+
+		# circular list of [prev, next, key, value], the sentinel sits between newest and oldest
+		self.root = []
+		self.root[:] = [self.root, self.root, None, None]
+
+	def __len__(self):
+		return len(self.nodes)
+
+	def __contains__(self, key):
+		return key in self.nodes
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __getitem__(self, key):
+		return self.nodes[key][3]
+
+	""" Sets a value, making the key the newest """
+	def __setitem__(self, key, value):
+		self.pop(key, None)
+
+		last = self.root[0]
+		node = [last, self.root, key, value]
+		last[1] = node
+		self.root[0] = node
+		self.nodes[key] = node
+
+	def __delitem__(self, key):
+		node = self.nodes.pop(key)
+		node[0][1] = node[1]
+		node[1][0] = node[0]
+
+	def get(self, key, default = None):
+		node = self.nodes.get(key)
+		return node[3] if node != None else default
+
+	def pop(self, key, default = None):
+		if key not in self.nodes:
+			return default
+
+		value = self.nodes[key][3]
+		del self[key]
+		return value
+
+	""" Removes and returns the oldest key and its value, or the newest if last is set """
+	def popitem(self, last = True):
+		if not self.nodes:
+			raise KeyError('popitem(): mapping is empty')
+
+		node = self.root[0] if last else self.root[1]
+		del self[node[2]]
+		return node[2], node[3]
+
+	""" Returns the keys from oldest to newest """
+	def keys(self):
+		keys = []
+		node = self.root[1]
+		while node is not self.root:
+			keys.append(node[2])
+			node = node[1]
+
+		return keys
+
+	def values(self):
+		return [self.nodes[key][3] for key in self.keys()]
+
+	def items(self):
+		return [(key, self.nodes[key][3]) for key in self.keys()]
+
+	def clear(self):
+		self.nodes.clear()
+		self.root[:] = [self.root, self.root, None, None]
+
+class LRUCache(object):
+	""" Thread-safe mapping that forgets the least recently used entries once it is full, and entries older than ttl seconds if given """
+	def __init__(self, max_size = 32, ttl = None):
+		self.max_size = max_size
+		self.ttl = ttl
+		self.lock = threading.Lock()
+		self.items = LinkedMap()
+
+	""" Returns the cached value for a key, or None """
+	def get(self, key):
+		with self.lock:
+			if key not in self.items:
+				return None
+
+			# move the entry to the most recently used end
+			expires, value = self.items.pop(key)
+			if expires != None and expires <= time.time():
+				return None
+
+			self.items[key] = (expires, value)
+
+			return value
+
+	""" Caches a value, evicting the oldest entry if needed """
+	def put(self, key, value):
+		with self.lock:
+			self.items.pop(key, None)
+			self.items[key] = (time.time() + self.ttl if self.ttl != None else None, value)
+
+			while len(self.items) > self.max_size:
+				self.items.popitem(last = False)
+
+	""" Forgets a cached value """
+	def discard(self, key):
+		with self.lock:
+			self.items.pop(key, None)
+
+	""" Forgets every cached value """
+	def clear(self):
+		with self.lock:
+			self.items.clear()
+
+""" Returns a short fingerprint of a post's content """
+def content_hash(content):
+	if content == None:
+		return None
+
+	if not isinstance(content, bytes):
+		content = content.encode('utf-8')
+
+	return hashlib.sha1(content).hexdigest()
+
+class PostSnapshots(object):
+	""" Last state of each opened post known to be on the server, so saves only send what changed """
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.structs = {}
+
+	""" Records the state of a post as fetched from or saved to the server """
+	def take(self, site, post):
+		self.commit(site, post.id, post.struct, replace = True)
+
+	""" Returns the struct fields of post that differ from its snapshot, all of them if there is none """
+	def changes(self, site, post):
+		struct = post.struct
+
+		with self.lock:
+			old = self.structs.get((site, str(post.id)))
+
+		if old == None:
+			return struct
+
+		changes = {}
+		for k, v in struct.items():
+			# the content is only kept as a hash
+			if k == 'post_content':
+				if content_hash(v) != old.get('post_content'):
+					changes[k] = v
+			elif old.get(k) != v:
+				changes[k] = v
+
+		return changes
+
+	""" Folds fields that were sent to the server into the snapshot """
+	def commit(self, site, post_id, fields, replace = False):
+		# terms, custom fields and the like are lists and dicts the post may go on changing
+		fields = copy.deepcopy(dict(fields))
+		if 'post_content' in fields:
+			fields['post_content'] = content_hash(fields['post_content'])
+
+		with self.lock:
+			key = (site, str(post_id))
+			if replace or key not in self.structs:
+				self.structs[key] = fields
+			else:
+				self.structs[key].update(fields)
+
+	""" Forgets the snapshot of a post """
+	def discard(self, site, post_id):
+		with self.lock:
+			self.structs.pop((site, str(post_id)), None)
+
+snapshots = PostSnapshots()
+
+class SaveCoalescer(object):
+	""" Folds saves of the same post made in quick succession into a single request, latest state wins """
+	def __init__(self, send, delay = 0.5):
+		self.send = send
+		self.delay = delay
+		self.lock = threading.Lock()
+		self.pending = {}
+		self.scheduled = set()
+		self.in_flight = set()
+
+	""" Queues a save, callback is called with send's result once the post has been sent """
+	def save(self, key, post, callback = None):
+		with self.lock:
+			callbacks = self.pending.get(key, (None, []))[1]
+			if callback != None:
+				callbacks.append(callback)
+			self.pending[key] = (post, callbacks)
+
+			# a save already waiting or running will pick this one up
+			if key in self.scheduled or key in self.in_flight:
+				return
+
+			self.schedule(key)
+
+	""" Starts the timer for a key, called with the lock held """
+	def schedule(self, key):
+		self.scheduled.add(key)
+		timer = threading.Timer(self.delay, self.flush, (key, ))
+		timer.daemon = True
+		timer.start()
+
+	""" Sends the latest state of a post, called from the timer thread """
+	def flush(self, key):
+		with self.lock:
+			self.scheduled.discard(key)
+			post, callbacks = self.pending.pop(key, (None, []))
+			if post == None:
+				return
+			self.in_flight.add(key)
+
+		try:
+			result = self.send(post)
+			error = None
+		except Exception as e:
+			result = None
+			error = e
+
+		with self.lock:
+			self.in_flight.discard(key)
+
+			# the post was saved again while this request was running
+			if key in self.pending:
+				self.schedule(key)
+
+		for callback in callbacks:
+			callback(result, error)
+
+# recently opened posts, with their content, custom fields and terms
+# seconds a complete post is reused for, so edits made on the site itself turn up
+FULL_POST_TTL = 300
+
+full_posts = LRUCache(ttl = FULL_POST_TTL)
+
+""" Returns a complete post, loading it with GetPost only if it isn't cached yet """
+def full_post(client, post_id):
+	key = (site_key(client), str(post_id))
+	post = full_posts.get(key)
+
+	if post == None:
+		post = client.call(GetPost(post_id))
+		full_posts.put(key, post)
+		snapshots.take(key[0], post)
+		search.index(key[0]).add(post)
+
+	return post
+
+""" Forgets the cached copy and the snapshot of a post once a write to it has been sent """
+def post_written(site, method):
+	name = type(method).__name__
+
+	if name in ('EditPost', 'DeletePost'):
+		full_posts.discard((site, str(method.post_id)))
+		snapshots.discard(site, method.post_id)
+
+	# any of the cached posts may carry the term, they are few enough to fetch again
+	if name in ('EditTerm', 'DeleteTerm'):
+		full_posts.clear()
+
+""" Returns a lightweight listing of posts matching a GetPosts filter, as compact objects """
+def list_posts(client, filter = None):
+	return client.call(GetPosts(filter or {}, LIST_FIELDS), compact = True)
+
+class PostPager(object):
+	""" Walks a GetPosts listing page by page on the worker pool, handing pages over in order as they arrive """
+	def __init__(self, client, filter = None, page_size = 50, prefetch = 2, on_page = None, on_error = None):
+		self.client = client
+		self.filter = filter or {}
+		self.page_size = page_size
+		self.prefetch = prefetch
+		self.on_page = on_page
+		self.on_error = on_error
+		self.lock = threading.Lock()
+		self.posts = []
+		self.pages = {}
+		self.wanted = 1
+		self.next_page = 0
+		self.delivered = 0
+		self.last_page = None
+		# failed fetches by page index, fetched again by more()
+		self.errors = {}
+		self.error = None
+		self.cancelled = False
+		self.futures = []
+
+	""" Returns True once every page has been handed over """
+	def is_done(self):
+		return self.last_page != None and self.delivered > self.last_page
+
+	""" Starts fetching the first page, plus a few more in the background """
+	def start(self):
+		self.fetch_ahead()
+
+	""" Asks for one more page to be handed over, or for the pages that failed to be fetched again """
+	def more(self):
+		with self.lock:
+			failed = sorted(self.errors)
+			self.errors = {}
+
+			# retrying a page the user was already waiting on doesn't ask for another one
+			if not failed or failed[0] >= self.wanted:
+				self.wanted += 1
+
+		for index in failed:
+			self.submit(index)
+
+		# the page may already have been prefetched
+		self.deliver()
+		self.fetch_ahead()
+
+	""" Returns the error of the last fetch that failed and forgets it, None if none did """
+	def take_error(self):
+		with self.lock:
+			error, self.error = self.error, None
+			return error
+
+	""" Stops fetching and handing over pages """
+	def cancel(self):
+		self.cancelled = True
+
+		for future in self.futures:
+			future.cancel()
+
+	""" Queues every page inside the prefetch window that isn't being fetched yet """
+	def fetch_ahead(self):
+		with self.lock:
+			indexes = []
+			while self.next_page < self.wanted + self.prefetch:
+				if self.last_page != None and self.next_page > self.last_page:
+					break
+
+				indexes.append(self.next_page)
+				self.next_page += 1
+
+			# drop the futures that are finished
+			self.futures = [f for f in self.futures if not f.done()]
+
+		for index in indexes:
+			self.submit(index)
+
+	""" Queues the fetch of a page """
+	def submit(self, index):
+		# pages the user is waiting on go ahead of prefetching
+		if index < self.wanted:
+			priority = executor.INTERACTIVE
+		else:
+			priority = executor.BACKGROUND
+
+		self.futures.append(executor.pool.submit(self.fetch, (index, ), priority))
+
+	""" Fetches a single page, called from a worker thread """
+	def fetch(self, index):
+
+		filter = dict(self.filter)
+		filter['number'] = self.page_size
+		filter['offset'] = index * self.page_size
+
+		try:
+			posts = list_posts(self.client, filter)
+		except Exception as e:
+			# a failed page is neither empty nor the end of the listing, it is fetched again by more()
+			with self.lock:
+				self.errors[index] = e
+				self.error = e
+				waited_on = index < self.wanted and not self.cancelled
+
+			if waited_on and self.on_error != None:
+				self.on_error(e)
+			return
+
+		with self.lock:
+			self.pages[index] = posts
+
+			# a short page is the end of the listing
+			if len(posts) < self.page_size and (self.last_page == None or index < self.last_page):
+				self.last_page = index
+
+		self.deliver()
+
+	""" Hands over every page that has arrived, in order, up to the number of pages wanted """
+	def deliver(self):
+		delivered = []
+
+		with self.lock:
+			while self.delivered in self.pages and self.delivered < self.wanted and not self.cancelled:
+				posts = self.pages.pop(self.delivered)
+				self.posts.extend(posts)
+				delivered.append(posts)
+				self.delivered += 1
+
+		for posts in delivered:
+			if self.on_page != None:
+				self.on_page(posts)
+
+		if delivered:
+			self.fetch_ahead()
+
+stores = {}
+stores_lock = threading.Lock()
+
+""" Returns the shared post store for a site and post type """
+def post_store(site, post_type):
+	with stores_lock:
+		key = (site, post_type)
+		if key not in stores:
+			stores[key] = PostStore(site, post_type)
+
+		return stores[key]
+
+
+class TermStore(object):
+	""" Terms of one taxonomy on a site, indexed by id, slug and name and kept as a parent/child tree """
+	def __init__(self, site, taxonomy):
+		self.site = site
+		self.taxonomy = taxonomy
+		self.lock = threading.RLock()
+		self.loaded = False
+		self.expires = 0
+		self.clear()
+
+	""" Forgets every term """
+	def clear(self):
+		with self.lock:
+			self.by_id = {}
+			self.by_slug = {}
+			self.by_name = {}
+			self.children = {}
+			self.order = None
+			self.loaded = False
+
+	""" Replaces the stored terms with a freshly fetched list """
+	def load(self, terms):
+		with self.lock:
+			self.clear()
+			for term in terms:
+				self.add(term)
+			self.loaded = True
+
+			# terms edited outside of Sublpress turn up once the session cache would have let them
+			self.expires = time.time() + session.TTLS['GetTerms']
+
+	""" Returns True if the terms were fetched recently enough to be used without fetching them again """
+	def is_current(self):
+		with self.lock:
+			return self.loaded and time.time() < self.expires
+
+	""" Fetches every term of the taxonomy, called from a worker thread """
+	def fetch(self, client):
+		self.load(client.call(GetTerms(self.taxonomy)))
+		return self
+
+	""" Adds or replaces a term """
+	def add(self, term):
+		with self.lock:
+			term_id = str(term.id)
+			if term_id in self.by_id:
+				self.remove(term_id)
+
+			self.by_id[term_id] = term
+			self.by_slug[getattr(term, 'slug', None)] = term
+			self.by_name[term.name] = term
+			self.children.setdefault(self.parent_of(term), []).append(term_id)
+			self.order = None
+
+	""" Removes a term, its children move up to the root """
+	def remove(self, term_id):
+		with self.lock:
+			term = self.by_id.pop(str(term_id), None)
+			if term == None:
+				return
+
+			self.by_slug.pop(getattr(term, 'slug', None), None)
+			if self.by_name.get(term.name) is term:
+				del self.by_name[term.name]
+
+			siblings = self.children.get(self.parent_of(term), [])
+			if str(term_id) in siblings:
+				siblings.remove(str(term_id))
+
+			self.order = None
+
+	""" Changes the name of a stored term """
+	def rename(self, term_id, name):
+		with self.lock:
+			term = self.get(term_id)
+			if term == None:
+				return
+
+			self.remove(term_id)
+			term.name = name
+			self.add(term)
+
+	def get(self, term_id):
+		return self.by_id.get(str(term_id))
+
+	def get_by_slug(self, slug):
+		return self.by_slug.get(slug)
+
+	def get_by_name(self, name):
+		return self.by_name.get(name)
+
+	""" Returns the id of a term's parent, or '0' for terms at the root """
+	def parent_of(self, term):
+		return str(getattr(term, 'parent', None) or '0')
+
+	""" Returns (term, depth) pairs with every term listed after its parent, siblings sorted by name """
+	def tree(self):
+		with self.lock:
+			if self.order != None:
+				return self.order
+
+			order = []
+			seen = set()
+
+			def walk(parent, depth):
+				ids = sorted(self.children.get(parent, []), key = lambda i: self.by_id[i].name.lower())
+				for term_id in ids:
+					if term_id in seen:
+						continue
+					seen.add(term_id)
+					order.append((self.by_id[term_id], depth))
+					walk(term_id, depth + 1)
+
+			walk('0', 0)
+
+			# terms whose parent isn't part of the taxonomy are listed at the root
+			for parent in list(self.children.keys()):
+				if parent != '0' and parent not in self.by_id:
+					walk(parent, 0)
+
+			self.order = order
+			return order
+
+term_stores = {}
+
+""" Returns the term store shared by every term command for a site and taxonomy """
+def term_store(site, taxonomy):
+	with stores_lock:
+		key = (site, taxonomy)
+		if key not in term_stores:
+			term_stores[key] = TermStore(site, taxonomy)
+
+		return term_stores[key]
+
+""" Forgets the terms of every taxonomy of a site, they are fetched again when next needed """
+def forget_terms(site):
+	with stores_lock:
+		stores = [terms for key, terms in term_stores.items() if key[0] == site]
+
+	for terms in stores:
+		terms.clear()
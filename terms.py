@@ -12,7 +12,7 @@ else:
 	from wordpress_xmlrpc.methods.posts import *
 	from wordpress_xmlrpc.methods.taxonomies import *
 	from wordpress_xmlrpc.methods.users import *
-	import common, plugin, command
+	import common, plugin, command, client, store
 
 
 class WordpressManageTaxesCommand(sublime_plugin.WindowCommand):
@@ -30,16 +30,10 @@ class WordpressManageTaxesCommand(sublime_plugin.WindowCommand):
 		# initialize anything we need for this command
 		self.setup_command(*args, **kwargs)
 
-		# initiate any threads we have
-		self.wc.init_threads(self.thread_callback)
-
 	""" Called right before the rest of the command runs """
 	def setup_command(self, *args, **kwargs):
-		# create threaded API call because the http connections could take awhile
-		thread = plugin.WordpressApiCall(GetTaxonomies())
-
-		# add the thread to the list
-		self.wc.add_thread(thread)
+		# run the API call on the worker pool because the http connections could take awhile
+		plugin.api_call(GetTaxonomies(), self.thread_callback)
 
 	""" Called when a thread is finished executing """
 	def thread_callback(self, result, *args, **kwargs):
@@ -62,13 +56,9 @@ class WordpressManageTaxesCommand(sublime_plugin.WindowCommand):
 			#self.window.run_command('wordpress_new_term')
 			#return
 
-		# loop through all of the retreived taxonomies
-		for tax in self.taxes:
-
-			# check for a matching title for the selected quick panel option
-			if tax.name == self.options[index]:
-				# show the user actions for this taxonomy
-				self.window.run_command('wordpress_manage_terms', { 'taxonomy': tax.name })
+		# show the user actions for the selected taxonomy
+		tax = self.taxes[index]
+		self.window.run_command('wordpress_manage_terms', { 'taxonomy': tax.name })
 
 class WordpressManageTermsCommand(sublime_plugin.WindowCommand):
 	""" Sublime Command that shows the user a list of WordPress terms for a specific taxonomy"""
@@ -85,26 +75,22 @@ class WordpressManageTermsCommand(sublime_plugin.WindowCommand):
 		# initialize anything we need for this command
 		self.setup_command(*args, **kwargs)
 
-		# initiate any threads we have
-		self.wc.init_threads(self.thread_callback)
-
 	""" Called right before the rest of the command runs """
 	def setup_command(self, *args, **kwargs):
 		self.taxonomy = kwargs.get('taxonomy', None)
 
-		# create threaded API call because the http connections could take awhile
-		thread = plugin.WordpressApiCall(GetTerms(self.taxonomy))
-
-		# add the thread to the list
-		self.wc.add_thread(thread)
+		# the terms are shared by all term commands, so they are only fetched the first time
+		plugin.load_terms(self.taxonomy, self.thread_callback)
 
-	""" Called when a thread is finished executing """
+	""" Called when the term store for the taxonomy is ready """
 	def thread_callback(self, result, *args, **kwargs):
-		self.terms = result
+		self.terms = []
 		self.options = ['New Term']
 
-		for term in self.terms:
-			self.options.append(term.name)
+		# children are indented below their parents
+		for term, depth in result.tree():
+			self.terms.append(term)
+			self.options.append('    ' * depth + term.name)
 
 		self.wc.show_quick_panel(self.options, self.panel_callback)
 
@@ -119,10 +105,8 @@ class WordpressManageTermsCommand(sublime_plugin.WindowCommand):
 			self.window.run_command('wordpress_new_term')
 			return
 
-		# loop through all terms
-		for term in self.terms:
-			if term.name == self.options[index]:
-				self.window.run_command('wordpress_term_action', {'id': term.id, 'name': term.name, 'taxonomy': self.taxonomy})
+		term = self.terms[index - 1]
+		self.window.run_command('wordpress_term_action', {'id': term.id, 'name': term.name, 'taxonomy': self.taxonomy})
 
 class WordpressRenameTermCommand(sublime_plugin.WindowCommand):
 	""" Sublime Command that shows allows the user to rename a taxonomy term """
@@ -138,14 +122,9 @@ class WordpressRenameTermCommand(sublime_plugin.WindowCommand):
 		# assign the new name to this term
 		self.term.name = name
 
-		# create threaded API call because the http connections could take awhile
-		thread = plugin.WordpressApiCall(EditTerm(self.term.id, self.term))
-
-		# add the thread to the list
-		self.wc.add_thread(thread)
-
-		# initiate any threads we have
-		self.wc.init_threads(self.thread_callback)
+		# queue the change, it is sent in the background
+		plugin.queue_write(EditTerm(self.term.id, self.term))
+		self.thread_callback(None)
 
 	""" Called to determine if the command should be enabled """
 	def is_enabled(self):
@@ -174,6 +153,8 @@ class WordpressRenameTermCommand(sublime_plugin.WindowCommand):
 
 	""" Called when the thread is finished executing """
 	def thread_callback(self, result, *args, **kwargs):
+		plugin.term_store(self.term.taxonomy).rename(self.term.id, self.term.name)
+
 		# Display a successful status message
 		sublime.status_message('Successfully renamed ' + self.old_name + ' to ' + self.term.name + '.')
 
@@ -191,14 +172,8 @@ class WordpressNewTermCommand(sublime_plugin.WindowCommand):
 		#new_term.parent = parent_cat.id
 		self.term.name = name
 
-		# create threaded API call because the http connections could take awhile
-		thread = plugin.WordpressApiCall(NewTerm(self.term))
-
-		# add the thread to the list
-		self.wc.add_thread(thread)
-
-		# initiate any threads we have
-		self.wc.init_threads(self.thread_callback)
+		# run the API call on the worker pool because the http connections could take awhile
+		plugin.api_call(NewTerm(self.term), self.thread_callback)
 
 	""" Called to determine if the command should be enabled """
 	def is_enabled(self):
@@ -217,6 +192,11 @@ class WordpressNewTermCommand(sublime_plugin.WindowCommand):
 	def thread_callback(self, result, *args, **kwargs):
 		self.term.id = result
 
+		# only add it if the store holds the whole taxonomy already
+		terms = plugin.term_store(self.term.taxonomy)
+		if terms.loaded:
+			terms.add(self.term)
+
 		# Display a successful status message
 		sublime.status_message('Successfully created ' + self.term.name + ' with id of ' + self.term.id + '.')
 
@@ -235,20 +215,18 @@ class WordpressDeleteTermCommand(sublime_plugin.WindowCommand):
 		# initialize anything we need for this command
 		self.setup_command(*args, **kwargs)
 
-		# initiate any threads we have
-		self.wc.init_threads(self.thread_callback)
-
 	""" Called right before the rest of the command runs """
 	def setup_command(self, *args, **kwargs):
-		# create threaded API call because the http connections could take awhile
-		thread = plugin.WordpressApiCall(DeleteTerm(kwargs.get('taxonomy', None), kwargs.get('id')))
+		self.taxonomy = kwargs.get('taxonomy', None)
+		self.id = kwargs.get('id')
 
-		# add the thread to the list
-		self.wc.add_thread(thread)
+		# run the API call on the worker pool because the http connections could take awhile
+		plugin.api_call(DeleteTerm(self.taxonomy, self.id), self.thread_callback)
 		
 
 	""" Called when the thread is finished executing """
 	def thread_callback(self, result, *args, **kwargs):
+		plugin.term_store(self.taxonomy).remove(self.id)
 		sublime.status_message(' Successfully deleted term.')
 
 class WordpressTermActionCommand(sublime_plugin.WindowCommand):
@@ -309,25 +287,18 @@ class WordpressModifyPostTermsCommand(sublime_plugin.WindowCommand):
 		# initialize anything we need for this command
 		self.setup_command(*args, **kwargs)
 
-		# initiate any threads we have
-		self.wc.init_threads(self.thread_callback)
-
 	""" Called right before the rest of the command runs """
 	def setup_command(self, *args, **kwargs):
 		# grab the passed in post id
 		self.post_id = kwargs.get('id', None)
-		self.selected_terms = []
+		self.selected_terms = set()
+		self.post_terms = {}
 
-		# create threaded API calls because the http connections could take awhile
-		thread = plugin.WordpressApiCall(GetPost(self.post_id))
-		thread2 = plugin.WordpressApiCall(GetTaxonomies())
-		
 		# save a copy of the current view when ran
 		self.view = self.window.active_view()
-		
-		# add the thread to the list
-		self.wc.add_thread(thread)
-		self.wc.add_thread(thread2)
+
+		# fetch the post and the taxonomies in a single API call on the worker pool because the http connections could take awhile
+		plugin.batch_call([GetPost(self.post_id), GetTaxonomies()], self.thread_callback)
 
 	""" Called when the thread has returned a list of taxonomies and we need the user to choose one """
 	def choose_taxonomy(self, taxes):
@@ -350,32 +321,32 @@ class WordpressModifyPostTermsCommand(sublime_plugin.WindowCommand):
 			self.choose_taxonomy(self.taxes)
 			return
 
-		# loop through all of the retreived taxonomies
-		for tax in self.taxes:
-			# check for a matching title for the selected quick panel option
-			if tax.name == self.taxonomy_options[index]:
-				self.cur_tax = tax
-				thread = plugin.WordpressApiCall(GetTerms(tax.name))
-				self.wc.add_thread(thread)
-				self.wc.init_threads(self.thread_callback)
-
-	""" Called when the thread has returned a list of terms and we need the user to choose one """
+		self.cur_tax = self.taxes[index - 1]
+		plugin.load_terms(self.cur_tax.name, self.thread_callback)
+
+	""" Called when the term store for the chosen taxonomy is ready and we need the user to choose a term """
 	def choose_term(self, terms):
-		self.terms = terms
+		self.term_store = terms
+		self.terms = terms.tree()
 		self.term_options = [["Save Post", "with the terms marked below"], ]
 
-		for term in self.terms:
-			term_description = term.description
-			if not term.description:
-				term_description = "No Description"
-
-			if term.id in self.selected_terms:
-				self.term_options.append([self.wc.prefix.decode('utf8')  + term.name, "ID " + term.id + ": " + term_description])
-			else:
-				self.term_options.append([term.name, "ID " + term.id + ": " + term_description])
+		for term, depth in self.terms:
+			self.term_options.append(self.term_option(term, depth))
 
 		self.wc.show_quick_panel(self.term_options, self.choose_term_callback)
 
+	""" Returns the quick panel row for a term """
+	def term_option(self, term, depth):
+		term_description = term.description
+		if not term.description:
+			term_description = "No Description"
+
+		name = '    ' * depth + term.name
+		if term.id in self.selected_terms:
+			name = self.wc.prefix.decode('utf8') + name
+
+		return [name, "ID " + term.id + ": " + term_description]
+
 	""" Called when the user has chosen a term """
 	def choose_term_callback(self, index):
 		# the user cancelled 0he panel
@@ -387,31 +358,38 @@ class WordpressModifyPostTermsCommand(sublime_plugin.WindowCommand):
 			self.update_post()
 			return
 
-		# loop through all of the retreived terms
-		for term in self.terms:
+		term, depth = self.terms[index - 1]
 
-			# split up the second line by the colon
-			parts = self.term_options[index][1].partition(':')
+		if term.id not in self.selected_terms:
+			self.selected_terms.add(term.id)
+		else:
+			self.selected_terms.remove(term.id)
 
-			# check for a matching id for the selected quick panel option
-			if term.id == parts[0][3:]:
-				if term.id not in self.selected_terms:
-					self.selected_terms.append(term.id)
-				else:
-					self.selected_terms.remove(term.id)
-				self.choose_term(self.terms)
+		# only the toggled row changes
+		self.term_options[index] = self.term_option(term, depth)
+		self.wc.show_quick_panel(self.term_options, self.choose_term_callback)
 
 	""" Called when the thread is finished executing """
 	def thread_callback(self, result, *args, **kwargs):
-		if type(result) is WordPressPost:
+		if type(result) is client.BatchResult:
+			# a batch hands back faults instead of raising them, and nothing after one can go ahead without it
+			for item in result:
+				if isinstance(item, Exception):
+					sublime.error_message('Could not load the post and its taxonomies: ' + str(item))
+					return
+
+			for item in result:
+				self.thread_callback(item)
+		elif type(result) is WordPressPost:
 			self.post = result
 			
 			for term in self.post.terms:
-				self.selected_terms.append(term.id)
+				self.selected_terms.add(term.id)
+				self.post_terms[term.id] = term
+		elif type(result) is store.TermStore:
+			self.choose_term(result)
 		elif type(result) is list:
-			if type(result[0]) is WordPressTerm:
-				self.choose_term(result)
-			if type(result[0]) is WordPressTaxonomy:
+			if result and type(result[0]) is WordPressTaxonomy:
 				self.choose_taxonomy(result)
 		elif type(result) is bool and result == True:
 			sublime.status_message('Post updated with new terms and taxes')
@@ -419,9 +397,12 @@ class WordpressModifyPostTermsCommand(sublime_plugin.WindowCommand):
 	""" Called when the user wants to save the post with the new taxes and terms """
 	def update_post(self):
 
-		self.post.terms = [term for term in self.terms if term.id in self.selected_terms]
+		# terms of other taxonomies the post already had are kept
+		self.post.terms = []
+		for term_id in self.selected_terms:
+			term = self.term_store.get(term_id) or self.post_terms.get(term_id)
+			if term != None:
+				self.post.terms.append(term)
 		#pprint.pprint(self.post.terms)
 
-		thread = plugin.WordpressApiCall(EditPost(self.post.id, self.post))
-		self.wc.add_thread(thread)
-		self.wc.init_threads(self.thread_callback)
+		plugin.api_call(EditPost(self.post.id, self.post), self.thread_callback)
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+import sublime, sublime_plugin
+import os, sys, base64, mimetypes, glob, hashlib, json, threading, time
+if sys.version_info[0] == 3:
+	import xmlrpc.client as xmlrpc_client
+	from urllib.parse import urlparse
+	from .wordpress_xmlrpc.methods.media import *
+	from . import common, plugin, command, executor, store, journal, session, library
+else:
+	import xmlrpclib as xmlrpc_client
+	from urlparse import urlparse
+	from wordpress_xmlrpc.methods.media import *
+	import common, plugin, command, executor, store, journal, session, library
+
+# read the file in multiples of 3 bytes so every chunk base64 encodes without padding
+CHUNK_SIZE = 3 * 64 * 1024
+
+# stands in for the file contents while the rest of the request is marshalled
+MARKER = 'sublpress-upload-bits'
+
+class StreamingUpload(object):
+	""" Uploads a file with wp.uploadFile, base64 encoding it chunk by chunk straight into the socket """
+	def __init__(self, client, path, name = None, mime_type = None, overwrite = False, progress = None, post_id = None):
+		self.client = client
+		self.path = path
+		self.name = name or os.path.basename(path)
+		self.mime_type = mime_type or mimetypes.guess_type(self.name)[0] or 'application/octet-stream'
+		self.overwrite = overwrite
+		self.progress = progress
+		self.size = os.path.getsize(path)
+
+		# marshal everything but the file contents, then split the request around them
+		data = {'name': self.name, 'type': self.mime_type, 'overwrite': self.overwrite, 'bits': MARKER}
+		if post_id != None:
+			data['post_id'] = post_id
+		request = xmlrpc_client.dumps((client.blog_id, client.username, client.password, data), 'wp.uploadFile', allow_none = True)
+		prefix, suffix = request.split('<string>' + MARKER + '</string>')
+
+		# python 2 already hands back utf-8 bytes
+		self.prefix = prefix + '<base64>'
+		self.suffix = '</base64>' + suffix
+		if not isinstance(self.prefix, bytes):
+			self.prefix = self.prefix.encode('utf-8')
+			self.suffix = self.suffix.encode('utf-8')
+		self.length = len(self.prefix) + 4 * ((self.size + 2) // 3) + len(self.suffix)
+
+	""" Yields the request body one encoded chunk at a time """
+	def body(self):
+		yield self.prefix
+
+		sent = 0
+		with open(self.path, 'rb') as f:
+			while True:
+				chunk = f.read(CHUNK_SIZE)
+				if not chunk:
+					break
+
+				sent += len(chunk)
+				yield base64.b64encode(chunk)
+
+				if self.progress != None:
+					self.progress(sent, self.size)
+
+		yield self.suffix
+
+	""" Sends the file and returns the attachment struct WordPress responds with """
+	def run(self):
+		url = urlparse(self.client.url)
+		result = self.client.transport.stream_request(url.netloc, url.path or '/', self.body, self.length, method_name = 'wp.uploadFile')
+
+		# the upload goes around call(), so tell the caches listing the library ourselves
+		self.client.session.invalidate(session.STALE_AFTER['UploadFile'])
+		library.media_library(store.site_key(self.client)).forget()
+
+		return result[0]
+
+""" Returns the files a directory or glob pattern refers to """
+def find_files(pattern):
+	pattern = os.path.expanduser(pattern)
+
+	if os.path.isdir(pattern):
+		paths = []
+		for root, dirs, files in os.walk(pattern):
+			for name in files:
+				if not name.startswith('.'):
+					paths.append(os.path.join(root, name))
+	else:
+		paths = [p for p in glob.glob(pattern) if os.path.isfile(p)]
+
+	return sorted(paths)
+
+""" Returns the sha1 of a file without reading it into memory at once """
+def file_hash(path):
+	sha = hashlib.sha1()
+
+	with open(path, 'rb') as f:
+		while True:
+			chunk = f.read(CHUNK_SIZE)
+			if not chunk:
+				break
+			sha.update(chunk)
+
+	return sha.hexdigest()
+
+class BulkUpload(object):
+	""" Uploads many files with bounded concurrency, skipping what the library already has and resuming from a manifest """
+	def __init__(self, client, pattern, concurrency = 3, post_id = None, progress = None, done = None):
+		self.client = client
+		self.pattern = pattern
+		self.concurrency = concurrency
+		self.post_id = post_id
+		self.progress = progress
+		self.done = done
+		self.lock = threading.Lock()
+		self.queue = []
+		self.in_flight = 0
+		self.cancelled = False
+		self.report = {'uploaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'errors': [], 'duplicates': []}
+
+		# one manifest per source, so an interrupted run can pick up where it left off
+		key = hashlib.sha1(os.path.abspath(os.path.expanduser(pattern)).encode('utf-8')).hexdigest()[:12]
+		self.manifest_path = os.path.join(common.cache_path(store.site_key(client)), 'uploads-' + key + '.json')
+		self.manifest = {}
+		if os.path.exists(self.manifest_path):
+			with open(self.manifest_path, 'r') as f:
+				self.manifest = json.load(f)
+
+	""" Returns the sizes of everything already in the media library by file name, None where WordPress doesn't report one """
+	def library(self):
+		existing = {}
+		offset = 0
+
+		while True:
+			items = self.client.call(GetMediaLibrary({'number': 100, 'offset': offset}))
+			if not items:
+				break
+
+			for item in items:
+				name = os.path.basename(getattr(item, 'link', '') or '')
+				metadata = getattr(item, 'metadata', None)
+				if not isinstance(metadata, dict):
+					metadata = {}
+				size = metadata.get('filesize')
+				existing.setdefault(name, set()).add(int(size) if size else None)
+
+				# large images are renamed to -scaled, the upload itself went by its original name
+				original = metadata.get('original_image')
+				if original:
+					existing.setdefault(os.path.basename(original), set()).add(None)
+
+			if len(items) < 100:
+				break
+			offset += 100
+
+		return existing
+
+	""" Works out what needs uploading and starts the first uploads, called from a worker thread """
+	def start(self):
+		self.started = time.time()
+		existing = self.library()
+
+		for path in find_files(self.pattern):
+			name = os.path.basename(path)
+			size = os.path.getsize(path)
+			entry = self.manifest.get(path)
+
+			# skip files uploaded by an earlier run, unless they changed since
+			if entry != None and entry['size'] == size and entry['hash'] == file_hash(path):
+				self.report['skipped'] += 1
+				continue
+
+			# a file of the same name is only the same file if the sizes match
+			sizes = existing.get(name, set())
+			if size in sizes:
+				self.report['skipped'] += 1
+				continue
+
+			# WordPress didn't say how big its copy is, so upload anyway and let the report name it
+			if None in sizes:
+				self.report['duplicates'].append(path)
+
+			self.queue.append(path)
+
+		self.total = len(self.queue)
+		self.next()
+
+	""" Stops queueing new uploads, the ones already running still finish """
+	def cancel(self):
+		self.cancelled = True
+
+	""" Keeps up to concurrency uploads running on the worker pool """
+	def next(self):
+		with self.lock:
+			paths = []
+			while self.queue and self.in_flight < self.concurrency and not self.cancelled:
+				paths.append(self.queue.pop(0))
+				self.in_flight += 1
+
+			finished = self.in_flight == 0 and (not self.queue or self.cancelled)
+
+		for path in paths:
+			future = executor.pool.submit(self.upload, (path, ), executor.BACKGROUND)
+			future.add_done_callback(lambda f, path = path: self.uploaded(path, f))
+
+		if finished and self.done != None:
+			self.done(self.report)
+
+	""" Uploads a single file, called from a worker thread """
+	def upload(self, path):
+		digest = file_hash(path)
+		result = StreamingUpload(self.client, path, post_id = self.post_id).run()
+
+		return {'hash': digest, 'size': os.path.getsize(path), 'id': result['id'], 'url': result['url']}
+
+	""" Called when a single upload has finished """
+	def uploaded(self, path, future):
+		with self.lock:
+			self.in_flight -= 1
+
+			if future.error != None:
+				self.report['failed'] += 1
+				self.report['errors'].append(path + ': ' + str(future.error))
+			elif not future.cancelled:
+				self.report['uploaded'] += 1
+				self.report['bytes'] += future.value['size']
+				self.manifest[path] = future.value
+				self.save_manifest()
+
+			elapsed = max(time.time() - self.started, 0.001)
+			self.report['files_per_second'] = self.report['uploaded'] / elapsed
+			self.report['bytes_per_second'] = self.report['bytes'] / elapsed
+
+		if self.progress != None:
+			self.progress(self.report, self.total)
+
+		self.next()
+
+	""" Writes the manifest to disk, called with the lock held """
+	def save_manifest(self):
+		tmp = self.manifest_path + '.tmp'
+
+		with open(tmp, 'w') as f:
+			json.dump(self.manifest, f)
+
+		if os.path.exists(self.manifest_path):
+			os.remove(self.manifest_path)
+		os.rename(tmp, self.manifest_path)
+
+""" Uploads a file to the media library, called from a worker thread """
+def upload_file(path, name = None, overwrite = False, progress = None):
+	# make sure we have a valid wordpress client object
+	if common.sp_wp == None:
+		sublime.error_message('Not connected')
+		return False
+
+	try:
+		return StreamingUpload(common.sp_wp, path, name, overwrite = overwrite, progress = progress).run()
+	except Exception as e:
+		if not journal.is_offline_error(e):
+			raise
+
+	# keep the upload for when the site can be reached again
+	plugin.write_journal().put_entry('UploadFile', [path, name or os.path.basename(path), overwrite])
+	return None
+
+""" Sends an upload from the write journal, called from a worker thread """
+def replay_upload(client, entry):
+	path, name, overwrite = journal.load_params(entry)
+
+	if not os.path.isfile(path):
+		raise ValueError('File not found: ' + path)
+
+	return StreamingUpload(client, path, name, overwrite = overwrite).run()
+
+journal.runners['UploadFile'] = replay_upload
+
+class WordpressUploadFileCommand(sublime_plugin.WindowCommand):
+	""" Sublime Command that uploads a local file to the media library without loading it into memory """
+	def __init__(self, *args, **kwargs):
+		super(WordpressUploadFileCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called when the input panel has received input """
+	def doDone(self, path):
+		self.path = os.path.expanduser(path)
+
+		if not os.path.isfile(self.path):
+			sublime.error_message('File not found: ' + self.path)
+			return
+
+		# upload on the worker pool because the http connections could take awhile
+		plugin.submit(upload_file, (self.path, None, False, self.progress_callback), self.thread_callback)
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		# initialize anything we need for this command
+		self.setup_command(*args, **kwargs)
+
+	""" Called right before the rest of the command runs """
+	def setup_command(self, *args, **kwargs):
+		self.window.show_input_panel('Upload File', kwargs.get('path', ''), self.doDone, None, None)
+
+	""" Called from the worker thread as the file is sent """
+	def progress_callback(self, sent, total):
+		percent = int(sent * 100 / max(total, 1))
+		sublime.set_timeout(lambda: sublime.status_message('Uploading ' + os.path.basename(self.path) + ': ' + str(percent) + '%'), 0)
+
+	""" Called when the upload has finished """
+	def thread_callback(self, result, *args, **kwargs):
+		if result == None:
+			sublime.status_message('Site unreachable, ' + os.path.basename(self.path) + ' will be uploaded in the background.')
+			return
+
+		sublime.status_message('Uploaded ' + result['file'] + ' to ' + result['url'] + '.')
+
+class WordpressBulkUploadCommand(sublime_plugin.WindowCommand):
+	""" Sublime Command that uploads every file in a directory or matching a glob to the media library """
+	def __init__(self, *args, **kwargs):
+		super(WordpressBulkUploadCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+		self.bulk = None
+
+	""" Called when the input panel has received input """
+	def doDone(self, pattern):
+		# stop queueing uploads for an earlier run of this command
+		if self.bulk != None:
+			self.bulk.cancel()
+
+		concurrency = common.sp_settings.get('upload_concurrency', 3)
+		self.pattern = pattern
+		self.bulk = BulkUpload(common.sp_wp, pattern, concurrency, self.post_id, self.progress_callback, self.done_callback)
+
+		sublime.status_message('Comparing ' + pattern + ' against the media library...')
+		plugin.submit(self.bulk.start, priority = executor.BACKGROUND)
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		# initialize anything we need for this command
+		self.setup_command(*args, **kwargs)
+
+	""" Called right before the rest of the command runs """
+	def setup_command(self, *args, **kwargs):
+		# uploads are attached to this post if given
+		self.post_id = kwargs.get('post_id', None)
+		self.window.show_input_panel('Upload Directory or Glob', kwargs.get('path', ''), self.doDone, None, None)
+
+	""" Called from a worker thread every time an upload finishes """
+	def progress_callback(self, report, total):
+		message = 'Uploaded %d of %d files (%.1f files/s, %.0f KB/s)' % (report['uploaded'] + report['failed'], total, report['files_per_second'], report['bytes_per_second'] / 1024)
+		sublime.set_timeout(lambda: sublime.status_message(message), 0)
+
+	""" Called from a worker thread once every upload has finished """
+	def done_callback(self, report):
+		message = 'Bulk upload finished: %d uploaded, %d skipped, %d failed.' % (report['uploaded'], report['skipped'], report['failed'])
+		if report['duplicates']:
+			message += ' %d possible duplicates.' % len(report['duplicates'])
+		sublime.set_timeout(lambda: sublime.status_message(message), 0)
+
+		if report['errors'] or report['duplicates']:
+			text = 'Bulk upload of ' + self.pattern + '\n' + message + '\n'
+			if report['errors']:
+				text += '\nFailed:\n' + '\n'.join('  ' + error for error in report['errors']) + '\n'
+			if report['duplicates']:
+				text += '\nPossible duplicates, a file of the same name was already in the media library:\n' + '\n'.join('  ' + path for path in report['duplicates']) + '\n'
+			text += '\n'
+			sublime.set_timeout(lambda: self.show_errors(text), 0)
+
+	""" Lists the uploads that failed or may be duplicates in an output panel, failed ones are sent again by running the same upload """
+	def show_errors(self, text):
+		panel = self.window.get_output_panel('wordpress_uploads')
+		panel.run_command('append', {'characters': text})
+		self.window.run_command('show_panel', {'panel': 'output.wordpress_uploads'})
@@ -1,18 +1,20 @@
 # -*- coding: utf-8 -*-
 import sublime, sublime_plugin
-import os, sys, threading, zipfile, re, pprint, subprocess
+import os, sys, threading, zipfile, re, pprint, subprocess, time
 if sys.version_info[0] == 3:
 	from .wordpress_xmlrpc import *
 	from .wordpress_xmlrpc.methods.posts import *
 	from .wordpress_xmlrpc.methods.taxonomies import *
 	from .wordpress_xmlrpc.methods.users import *
+	from .wordpress_xmlrpc.methods.options import *
 	from . import *
 else:
 	from wordpress_xmlrpc import *
 	from wordpress_xmlrpc.methods.posts import *
 	from wordpress_xmlrpc.methods.taxonomies import *
 	from wordpress_xmlrpc.methods.users import *
-	import common, plugin, command
+	from wordpress_xmlrpc.methods.options import *
+	import common, plugin, command, store, sites, search, executor, metrics, bulk, archive, mirror, library, journal
 
 class WordpressInsertCommand(sublime_plugin.TextCommand):
 	""" Sublime Text Command to insert content into the active view """
@@ -103,10 +105,7 @@ class WordpressConnectCommand(sublime_plugin.WindowCommand):
 
 	""" Called to determine if the command should be enabled """
 	def is_enabled(self):
-		if common.sp_wp == None:
-			return True
-
-		return False
+		return True
 
 	""" Called when the command is ran """
 	def run(self, *args, **kwargs):
@@ -118,6 +117,11 @@ class WordpressConnectCommand(sublime_plugin.WindowCommand):
 		self.sites = []
 		self.options = []
 
+		# connect straight away when the site to use was passed in
+		if kwargs.get('site', None) != None:
+			plugin.submit(plugin.use_site, (kwargs['site'], ), self.thread_callback)
+			return
+
 		# check if we have valid sublpress settings, reload if not
 		if common.sp_settings == None:
 			common.sp_settings = sublime.load_settings('Wordpress.sublime-settings')
@@ -127,11 +131,18 @@ class WordpressConnectCommand(sublime_plugin.WindowCommand):
 			return
 
 		# loop through all the sites
-		for name, site in common.sp_settings.get('sites').items():
+		for name, site in sorted(common.sp_settings.get('sites').items()):
+
+			# flag the sites that are already connected
+			title = name
+			if name == common.sp_site:
+				title = self.wc.prefix + name
+			elif sites.registry.is_connected(name):
+				title = name + ' (connected)'
 
 			# and add them to the quick panel options and our sites container
-			self.options.append([name, site['username'] + '@' + site['host']], )
-			self.sites.append(site)
+			self.options.append([title, site['username'] + '@' + site['host']], )
+			self.sites.append(name)
 
 		# show the quick panel
 		self.wc.show_quick_panel(self.options, self.panel_callback)
@@ -143,24 +154,15 @@ class WordpressConnectCommand(sublime_plugin.WindowCommand):
 		# the user cancelled the panel
 		if index == -1:
 			return
-		site = self.sites[index]
-
-		url = 'http://' + site['host'] + '/xmlrpc.php'
-
-		# create threaded API call because the http connections could take awhile
-		thread = plugin.WordpressConnectCall(url, site['username'], site['password'])
 
-		# add the thread to the list
-		self.wc.add_thread(thread)
-
-		# initiate any threads we have
-		self.wc.init_threads(self.thread_callback)
+		# connect on the worker pool because the http connections could take awhile, sites already connected are reused
+		plugin.submit(plugin.use_site, (self.sites[index], ), self.thread_callback)
 
 	""" Called when the thread has finished executing """
 	def thread_callback(self, result):
 		#pprint.pprint(vars(result))
 		# display a status message
-		sublime.status_message('Connected to ' + common.sp_wp.url + ' successfully.')
+		sublime.status_message('Connected to ' + common.sp_wp.blog.get('blog_title', common.sp_wp.url) + ' successfully.')
 
 		# show the wordpress actions panel
 		self.window.run_command('wordpress_actions')
@@ -173,5 +175,1103 @@ class WordpressDisconnectCommand(sublime_plugin.WindowCommand):
 		return True
 
 	def run(self, *args, **kwargs):
+		sites.registry.drop(common.sp_site)
 		common.sp_wp = None
+		common.sp_site = None
 		common.sp_settings = sublime.load_settings('Wordpress.sublime-settings')
+
+
+""" Opens a post of the connected site, from its mirrored file when mirroring is on, fetching it into the mirror first if needed """
+def open_post(window, post_id):
+	m = mirror.site_mirror(store.site_key(common.sp_wp))
+	if m == None:
+		window.run_command('wordpress_edit_post', {'id': post_id})
+		return
+
+	path = m.find(post_id)
+	if path != None:
+		window.open_file(path)
+		return
+
+	sublime.status_message('Fetching post ' + str(post_id) + '...')
+	plugin.submit(m.pull, (common.sp_wp, str(post_id)), window.open_file)
+
+class WordpressBrowsePostsCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that lists posts page by page, showing the first page as soon as it arrives """
+	def __init__(self, *args, **kwargs):
+		super(WordpressBrowsePostsCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+		self.pager = None
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		# initialize anything we need for this command
+		self.setup_command(*args, **kwargs)
+
+	""" Called right before the rest of the command runs """
+	def setup_command(self, *args, **kwargs):
+		self.post_type = kwargs.get('post_type', 'post')
+
+		# stop whatever an earlier run of this command was still fetching
+		if self.pager != None:
+			self.pager.cancel()
+
+		page_size = common.sp_settings.get('post_page_size', 50)
+		self.pager = store.PostPager(common.sp_wp, {'post_type': self.post_type}, page_size, on_page = self.page_callback, on_error = self.page_callback)
+		self.waiting = True
+
+		sublime.status_message('Loading ' + self.post_type + 's...')
+		self.pager.start()
+
+	""" Called from a worker thread when another page of posts has arrived """
+	def page_callback(self, posts):
+		sublime.set_timeout(self.show_posts, 0)
+
+	""" Shows every post loaded so far """
+	def show_posts(self):
+		# only reopen the panel if the user is waiting on it
+		if not self.waiting:
+			return
+		self.waiting = False
+
+		error = self.pager.take_error()
+		if error != None:
+			sublime.error_message('Could not load ' + self.post_type + 's: ' + str(error))
+
+		self.posts = list(self.pager.posts)
+		self.options = []
+
+		for post in self.posts:
+			self.options.append([post.title or '(no title)', 'ID ' + str(post.id) + ': ' + post.post_status])
+
+		if not self.pager.is_done():
+			self.options.append(['Load more...', str(len(self.posts)) + ' ' + self.post_type + 's loaded so far'])
+
+		self.wc.show_quick_panel(self.options, self.panel_callback)
+
+	""" Called when the quick panel is closed """
+	def panel_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			self.pager.cancel()
+			return
+
+		# load the next page, which has usually been prefetched already
+		if index == len(self.posts):
+			self.waiting = True
+			sublime.status_message('Loading more ' + self.post_type + 's...')
+			self.pager.more()
+			return
+
+		self.pager.cancel()
+		open_post(self.window, self.posts[index].id)
+
+class WordpressSavePostChangesCommand(sublime_plugin.TextCommand):
+	""" Sublime Text Command to save the active post, sending only what changed since it was opened """
+	def __init__(self, *args, **kwargs):
+		super(WordpressSavePostChangesCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressTextCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled() and self.view.get_status('Post ID') != ''
+
+	""" Called when the command is ran """
+	def run(self, edit, *args, **kwargs):
+		self.post_id = self.view.get_status('Post ID')
+		self.content = self.view.substr(sublime.Region(0, self.view.size()))
+
+		sublime.status_message('Saving post ' + self.post_id + '...')
+
+		# the post is usually still among the recently opened ones
+		plugin.submit(store.full_post, (common.sp_wp, self.post_id), self.post_callback)
+
+	""" Called when the post has been loaded """
+	def post_callback(self, post):
+		post.content = self.content
+		plugin.save_post(post, self.save_callback)
+
+	""" Called when the post has been saved, or found unchanged """
+	def save_callback(self, result):
+		if result == None:
+			sublime.status_message('Post ' + self.post_id + ' has no changes to save.')
+			return
+
+		sublime.status_message('Post ' + self.post_id + ' saved, sending it in the background.')
+
+class WordpressFailedWritesCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that lists the queued writes the current site refused, to send them again or drop them """
+	def __init__(self, *args, **kwargs):
+		super(WordpressFailedWritesCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		self.journal = plugin.write_journal()
+		self.failures = self.journal.failures()
+
+		if not self.failures:
+			sublime.status_message('No failed writes.')
+			return
+
+		self.options = [['Retry All', '%d failed writes' % len(self.failures)], ['Drop All', 'forget every failed write']]
+		for entry in self.failures:
+			self.options.append([journal.describe(entry), entry['error']])
+
+		self.wc.show_quick_panel(self.options, self.panel_callback)
+
+	""" Called when the user has chosen a write, or all of them """
+	def panel_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == 0:
+			self.journal.retry_failed()
+			sublime.status_message('Sending %d failed writes again.' % len(self.failures))
+			return
+
+		if index == 1:
+			self.journal.drop_failed()
+			sublime.status_message('Dropped %d failed writes.' % len(self.failures))
+			return
+
+		self.entry = self.failures[index - 2]
+		self.wc.show_quick_panel(['Retry', 'Drop'], self.action_callback)
+
+	""" Called when the user has chosen what to do with the write """
+	def action_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == 0:
+			self.journal.retry_failed([self.entry['seq']])
+			sublime.status_message('Sending ' + journal.describe(self.entry) + ' again.')
+
+		if index == 1:
+			self.journal.drop_failed([self.entry['seq']])
+			sublime.status_message('Dropped ' + journal.describe(self.entry) + '.')
+
+class WordpressTransferStatsCommand(sublime_plugin.WindowCommand):
+	""" Sublime command to show how many bytes went over the wire for the connected site, and how many they decoded to """
+	def __init__(self, *args, **kwargs):
+		super(WordpressTransferStatsCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled() and hasattr(common.sp_wp.transport, 'stats')
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		sublime.status_message(common.sp_wp.transport.stats.summary())
+
+""" Appends text to the output panel cross-site commands report into """
+def append_output(window, text):
+	panel = window.get_output_panel('wordpress_sites')
+	panel.run_command('append', {'characters': text})
+	window.run_command('show_panel', {'panel': 'output.wordpress_sites'})
+
+class WordpressSearchAllSitesCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that searches the posts of every configured site at once, listing matches as each site answers """
+	def __init__(self, *args, **kwargs):
+		super(WordpressSearchAllSitesCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return len(sites.configured()) > 0
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		# initialize anything we need for this command
+		self.setup_command(*args, **kwargs)
+
+	""" Called right before the rest of the command runs """
+	def setup_command(self, *args, **kwargs):
+		self.window.show_input_panel('Search All Sites', '', self.doDone, None, None)
+
+	""" Called when the input panel has received input """
+	def doDone(self, query):
+		self.query = query
+		self.results = []
+
+		append_output(self.window, 'Searching every site for "' + query + '"...\n')
+		sites.registry.fan_out(sorted(sites.configured().keys()), self.search, self.result_callback, self.done_callback)
+
+	""" Searches one site, called from a worker thread """
+	def search(self, label, wp):
+		return store.list_posts(wp, {'s': self.query, 'number': 20})
+
+	""" Called from a worker thread as each site answers """
+	def result_callback(self, label, posts, error):
+		sublime.set_timeout(lambda: self.show_result(label, posts, error), 0)
+
+	""" Adds the matches of one site to the output panel """
+	def show_result(self, label, posts, error):
+		if error != None:
+			append_output(self.window, label + ': ' + str(error) + '\n')
+			return
+
+		append_output(self.window, label + ': ' + str(len(posts)) + ' found\n')
+
+		for post in posts:
+			self.results.append((label, post))
+			append_output(self.window, '    ' + str(post.id) + '  ' + (post.title or '(no title)') + '\n')
+
+	""" Called from a worker thread once every site has answered """
+	def done_callback(self):
+		sublime.set_timeout(self.show_results, 0)
+
+	""" Lets the user pick one of the matches to open """
+	def show_results(self):
+		if not self.results:
+			sublime.status_message('No posts found for "' + self.query + '".')
+			return
+
+		self.options = []
+		for label, post in self.results:
+			self.options.append([post.title or '(no title)', label + ', ID ' + str(post.id) + ': ' + post.post_status])
+
+		self.wc.show_quick_panel(self.options, self.panel_callback)
+
+	""" Called when the quick panel is closed """
+	def panel_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		label, post = self.results[index]
+
+		# switch to the post's site before opening it
+		plugin.submit(plugin.use_site, (label, ), lambda wp: open_post(self.window, post.id))
+
+class WordpressListSiteOptionsCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that fetches a few options from every configured site at once """
+	def __init__(self, *args, **kwargs):
+		super(WordpressListSiteOptionsCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return len(sites.configured()) > 0
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		self.options = kwargs.get('options', ['blog_title', 'software_version', 'home_url'])
+
+		append_output(self.window, 'Fetching ' + ', '.join(self.options) + ' from every site...\n')
+		sites.registry.fan_out(sorted(sites.configured().keys()), self.fetch, self.result_callback, self.done_callback)
+
+	""" Fetches the options of one site, called from a worker thread """
+	def fetch(self, label, wp):
+		return wp.call(GetOptions(self.options))
+
+	""" Called from a worker thread as each site answers """
+	def result_callback(self, label, options, error):
+		if error != None:
+			text = label + ': ' + str(error) + '\n'
+		else:
+			text = label + ': ' + ', '.join(str(option) for option in sorted(options, key = lambda o: o.name)) + '\n'
+
+		sublime.set_timeout(lambda: append_output(self.window, text), 0)
+
+	""" Called from a worker thread once every site has answered """
+	def done_callback(self):
+		sublime.set_timeout(lambda: sublime.status_message('Fetched options from ' + str(len(sites.configured())) + ' sites.'), 0)
+
+class WordpressSearchLocalPostsCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that searches the posts cached for the connected site without going to the server """
+	def __init__(self, *args, **kwargs):
+		super(WordpressSearchLocalPostsCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		# initialize anything we need for this command
+		self.setup_command(*args, **kwargs)
+
+	""" Called right before the rest of the command runs """
+	def setup_command(self, *args, **kwargs):
+		self.post_type = kwargs.get('post_type', None)
+		self.index = search.index(store.site_key(common.sp_wp))
+
+		# fill an empty index with the titles of every post in the background
+		if not self.index.docs:
+			for post_type in ['post', 'page']:
+				plugin.submit(store.post_store(self.index.site, post_type).sync, (common.sp_wp, ), priority = executor.BACKGROUND)
+
+		self.window.show_input_panel('Search Posts', kwargs.get('query', ''), self.doDone, None, None)
+
+	""" Called when the input panel has received input """
+	def doDone(self, query):
+		self.query = query
+		self.results = self.index.search(query, 50, self.post_type)
+		self.options = []
+
+		for post_id, title, score in self.results:
+			doc = self.index.docs.get(post_id, {})
+			self.options.append([title or '(no title)', 'ID ' + post_id + ': ' + doc.get('post_type', '') + ', ' + doc.get('post_status', '')])
+
+		self.options.append(['Search on the server...', 'Ask WordPress for "' + query + '" instead'])
+		self.wc.show_quick_panel(self.options, self.panel_callback)
+
+	""" Called when the quick panel is closed """
+	def panel_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == len(self.results):
+			self.window.run_command('wordpress_search_post')
+			return
+
+		open_post(self.window, self.results[index][0])
+
+class WordpressPerformanceCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that shows how long recent XML-RPC calls took, per method and per phase """
+	def __init__(self, *args, **kwargs):
+		super(WordpressPerformanceCommand, self).__init__(*args, **kwargs)
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return True
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		summary = metrics.calls.summary()
+		phases = ''.join('%9s' % phase for phase in metrics.PHASES)
+		lines = ['%-26s %6s %6s %9s %9s%s %10s %10s' % ('method', 'calls', 'errors', 'p50 ms', 'p95 ms', phases, 'sent B', 'recv B')]
+
+		# slowest methods first
+		for method, row in sorted(summary.items(), key = lambda item: -item[1]['p95_ms']):
+			timings = ''.join('%9.1f' % row[phase + '_p50_ms'] for phase in metrics.PHASES)
+			lines.append('%-26s %6d %6d %9.1f %9.1f%s %10d %10d' % (method, row['calls'], row['errors'], row['p50_ms'], row['p95_ms'], timings, row['request_bytes'], row['response_bytes']))
+
+		if not summary:
+			lines.append('No XML-RPC calls recorded yet.')
+
+		# what the worker pool and the transport are up to
+		stats = executor.pool.stats()
+		lines.append('')
+		lines.append('Worker pool: %(active)d running, %(interactive)d interactive and %(background)d background queued, %(completed)d done, %(workers)d threads' % stats)
+
+		if common.sp_wp != None and hasattr(common.sp_wp.transport, 'stats'):
+			lines.append('Transfers: ' + common.sp_wp.transport.stats.summary())
+
+		if common.sp_wp != None:
+			lines.append('Session cache: %(hits)d hits, %(misses)d misses, %(entries)d lookups held' % common.sp_wp.session.stats())
+
+		panel = self.window.get_output_panel('wordpress_performance')
+		panel.run_command('append', {'characters': '\n'.join(lines) + '\n\n'})
+		self.window.run_command('show_panel', {'panel': 'output.wordpress_performance'})
+
+class WordpressExportCallLogCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that writes the recorded XML-RPC calls to a file as JSON lines """
+	def __init__(self, *args, **kwargs):
+		super(WordpressExportCallLogCommand, self).__init__(*args, **kwargs)
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return True
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		path = os.path.join(common.cache_path(), 'calls-' + time.strftime('%Y%m%d-%H%M%S') + '.jsonl')
+		self.window.show_input_panel('Export Calls To', kwargs.get('path', path), self.doDone, None, None)
+
+	""" Called when the input panel has received input """
+	def doDone(self, path):
+		count = metrics.calls.export(os.path.expanduser(path))
+		sublime.status_message('Exported ' + str(count) + ' calls to ' + path + '.')
+
+""" Shows a status in the status bar of a window's active view, or clears it when text is None """
+def show_status(window, key, text):
+	view = window.active_view()
+	if view == None:
+		return
+
+	if text:
+		view.set_status(key, text)
+	else:
+		view.erase_status(key)
+
+""" Starts or resumes a bulk edit on the connected site, with its progress in the status bar and its report shown when done """
+def run_bulk_edit(window, job, retry_failed = False):
+	bulk.running[job.job_id] = job
+
+	def progress(job):
+		counts = job.counts()
+		text = 'WordPress bulk edit: %d of %d posts done' % (len(job.posts) - counts['remaining'], len(job.posts))
+		sublime.set_timeout(lambda: show_status(window, 'wordpress_bulk', text), 0)
+
+	def done(job):
+		bulk.running.pop(job.job_id, None)
+		sublime.set_timeout(lambda: bulk_edit_done(window, job), 0)
+
+	concurrency = common.sp_settings.get('bulk_concurrency', 8)
+	job.run(common.sp_wp, bulk.pool, concurrency, retry_failed, progress, done)
+
+""" Called on the UI thread when a bulk edit has stopped, shows its report in a new view """
+def bulk_edit_done(window, job):
+	show_status(window, 'wordpress_bulk', None)
+
+	# nothing left to resume, so the checkpoint has served its purpose
+	if not job.remaining(retry_failed = True):
+		job.forget()
+
+	view = window.new_file()
+	view.set_name('Bulk Edit ' + job.job_id)
+	view.set_scratch(True)
+	view.run_command('append', {'characters': job.report()})
+
+	counts = job.counts()
+	sublime.status_message('Bulk edit finished: %d updated, %d failed, %d not done' % (counts['updated'], counts['failed'], counts['remaining']))
+
+class WordpressBulkEditCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that applies the same status, parent or term changes to many posts at once """
+	def __init__(self, *args, **kwargs):
+		super(WordpressBulkEditCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		# initialize anything we need for this command
+		self.setup_command(*args, **kwargs)
+
+	""" Called right before the rest of the command runs """
+	def setup_command(self, *args, **kwargs):
+		self.post_type = kwargs.get('post_type', 'post')
+		self.posts = []
+		self.picked = set()
+		self.selection = ''
+		self.changes = {'fields': {}, 'add_terms': {}, 'remove_terms': {}, 'names': {}}
+
+		self.options = [
+			'Every ' + self.post_type + ' with a status',
+			'Every ' + self.post_type + ' in a term',
+			'Every ' + self.post_type + ' matching a search',
+			'Pick ' + self.post_type + 's one by one',
+		]
+		self.wc.show_quick_panel(self.options, self.choose_selection_callback)
+
+	""" Called when the user has chosen how to select posts """
+	def choose_selection_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == 0:
+			self.choose_status(self.select_by_status)
+
+		if index == 1:
+			self.choose_term(self.select_by_term)
+
+		if index == 2:
+			self.window.show_input_panel('Search ' + self.post_type + 's For', '', self.select_by_search, None, None)
+
+		if index == 3:
+			# the local post store knows every post, so the picker doesn't need to wait on GetPosts pages
+			posts = store.post_store(store.site_key(common.sp_wp), self.post_type)
+			plugin.submit(posts.sync, (common.sp_wp, ), self.choose_posts)
+
+	def select_by_status(self, status, label):
+		self.select({'post_type': self.post_type, 'post_status': status}, 'every ' + self.post_type + ' with status ' + label)
+
+	def select_by_term(self, term):
+		predicate = bulk.has_term(term.id)
+		self.select({'post_type': self.post_type, 'post_status': 'any'}, 'every ' + self.post_type + ' in ' + term.name, predicate, bulk.SELECT_FIELDS + ['terms'])
+
+	def select_by_search(self, query):
+		self.select({'post_type': self.post_type, 'post_status': 'any', 's': query}, 'every ' + self.post_type + ' matching "' + query + '"')
+
+	""" Walks every post matching a filter on the worker pool, then asks for the changes to make """
+	def select(self, filter, selection, predicate = None, fields = bulk.SELECT_FIELDS):
+		self.selection = selection
+		sublime.status_message('Finding ' + selection + '...')
+		plugin.submit(bulk.select_posts, (common.sp_wp, filter, predicate, fields), self.selected_posts)
+
+	""" Called when the selected posts are known """
+	def selected_posts(self, posts):
+		self.posts = posts
+
+		if not self.posts:
+			sublime.status_message('No posts found for ' + self.selection + '.')
+			return
+
+		self.choose_change()
+
+	""" Shows every post of the post type, marking the ones picked so far """
+	def choose_posts(self, posts):
+		self.candidates = posts
+		self.post_options = [['Done', str(len(self.picked)) + ' picked']]
+
+		for post in self.candidates:
+			self.post_options.append(self.post_option(post))
+
+		self.wc.show_quick_panel(self.post_options, self.choose_posts_callback)
+
+	""" Returns the quick panel row for a post """
+	def post_option(self, post):
+		title = post['title'] or '(no title)'
+		if post['id'] in self.picked:
+			title = self.wc.prefix + title
+
+		return [title, 'ID ' + post['id'] + ': ' + post['post_status']]
+
+	""" Called when the user has picked or unpicked a post """
+	def choose_posts_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == 0:
+			self.selection = str(len(self.picked)) + ' picked ' + self.post_type + 's'
+			self.selected_posts([{'id': p['id'], 'title': p['title']} for p in self.candidates if p['id'] in self.picked])
+			return
+
+		post = self.candidates[index - 1]
+
+		if post['id'] in self.picked:
+			self.picked.remove(post['id'])
+		else:
+			self.picked.add(post['id'])
+
+		# only the toggled row and the count change
+		self.post_options[0] = ['Done', str(len(self.picked)) + ' picked']
+		self.post_options[index] = self.post_option(post)
+		self.wc.show_quick_panel(self.post_options, self.choose_posts_callback)
+
+	""" Shows the changes made so far and the ones that can be added """
+	def choose_change(self):
+		self.change_options = [
+			['Start', 'Edit ' + str(len(self.posts)) + ' posts: ' + bulk.describe(self.changes)],
+			'Set the status',
+			'Set the parent',
+			'Add a term',
+			'Remove a term',
+		]
+		self.wc.show_quick_panel(self.change_options, self.choose_change_callback)
+
+	""" Called when the user has chosen a change, or to start """
+	def choose_change_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == 0:
+			self.start()
+
+		if index == 1:
+			self.choose_status(self.set_status)
+
+		if index == 2:
+			self.window.show_input_panel('Parent ID (0 for none)', '0', self.set_parent, None, None)
+
+		if index == 3:
+			self.choose_term(lambda term: self.change_term(term, 'add_terms', 'remove_terms'))
+
+		if index == 4:
+			self.choose_term(lambda term: self.change_term(term, 'remove_terms', 'add_terms'))
+
+	def set_status(self, status, label):
+		self.changes['fields']['post_status'] = status
+		self.choose_change()
+
+	def set_parent(self, parent_id):
+		self.changes['fields']['post_parent'] = parent_id.strip() or '0'
+		self.choose_change()
+
+	""" Adds a term to one list of changes, taking it off the opposite one """
+	def change_term(self, term, key, opposite):
+		term_id = str(term.id)
+		ids = self.changes[key].setdefault(term.taxonomy, [])
+		if term_id not in ids:
+			ids.append(term_id)
+
+		if term_id in self.changes[opposite].get(term.taxonomy, []):
+			self.changes[opposite][term.taxonomy].remove(term_id)
+
+		self.changes['names'][term_id] = term.name
+		self.choose_change()
+
+	""" Starts the bulk edit with the changes chosen """
+	def start(self):
+		if bulk.describe(self.changes) == 'nothing':
+			sublime.status_message('Choose at least one change first.')
+			self.choose_change()
+			return
+
+		job = bulk.BulkEdit(store.site_key(common.sp_wp), self.posts, self.changes, self.selection)
+		run_bulk_edit(self.window, job)
+
+	""" Asks for a post status, then calls then(status, label) """
+	def choose_status(self, then):
+		def choose(statuses):
+			keys = sorted(statuses.keys())
+			self.wc.show_quick_panel([statuses[k] for k in keys], lambda index: index != -1 and then(keys[index], statuses[keys[index]]))
+
+		plugin.api_call(GetPostStatusList(), choose)
+
+	""" Asks for a taxonomy and one of its terms, then calls then(term) """
+	def choose_term(self, then):
+		def choose_taxonomy(taxes):
+			self.wc.show_quick_panel([tax.name for tax in taxes], lambda index: index != -1 and plugin.load_terms(taxes[index].name, choose_term))
+
+		def choose_term(terms):
+			tree = terms.tree()
+			self.wc.show_quick_panel(['    ' * depth + term.name for term, depth in tree], lambda index: index != -1 and then(tree[index][0]))
+
+		plugin.api_call(GetTaxonomies(), choose_taxonomy)
+
+class WordpressResumeBulkEditCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that lists the bulk edits of the current site that didn't finish, to resume or discard them """
+	def __init__(self, *args, **kwargs):
+		super(WordpressResumeBulkEditCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		self.jobs = [job for job in bulk.unfinished(store.site_key(common.sp_wp)) if job.job_id not in bulk.running]
+
+		if not self.jobs:
+			sublime.status_message('No unfinished bulk edits.')
+			return
+
+		self.options = []
+		for job in self.jobs:
+			counts = job.counts()
+			self.options.append([job.job_id + ': ' + job.description, bulk.describe(job.changes) + ' (%d left, %d failed)' % (counts['remaining'], counts['failed'])])
+
+		self.wc.show_quick_panel(self.options, self.panel_callback)
+
+	""" Called when the user has chosen a job """
+	def panel_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		self.job = self.jobs[index]
+		self.wc.show_quick_panel(['Resume', 'Show Report', 'Discard'], self.action_callback)
+
+	""" Called when the user has chosen what to do with the job """
+	def action_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == 0:
+			# posts that failed get another try along with the ones never sent
+			run_bulk_edit(self.window, self.job, retry_failed = True)
+
+		if index == 1:
+			bulk_edit_done(self.window, self.job)
+
+		if index == 2:
+			self.job.forget()
+			sublime.status_message('Discarded bulk edit ' + self.job.job_id + '.')
+
+class WordpressCancelBulkEditCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that stops every running bulk edit, they can be resumed later """
+	def is_enabled(self):
+		return len(bulk.running) > 0
+
+	def run(self, *args, **kwargs):
+		for job in list(bulk.running.values()):
+			job.cancel()
+
+class WordpressExportSiteCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that writes every post, term, media item and option of the current site to a WXR or JSON lines file """
+	def __init__(self, *args, **kwargs):
+		super(WordpressExportSiteCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		path = os.path.join('~', store.site_key(common.sp_wp).replace(':', '-') + '-' + time.strftime('%Y%m%d') + '.jsonl')
+		self.window.show_input_panel('Export Site To (.jsonl or .xml)', kwargs.get('path', path), self.doDone, None, None)
+
+	""" Called when the input panel has received input """
+	def doDone(self, path):
+		self.path = os.path.expanduser(path)
+
+		def progress(counts):
+			text = 'WordPress export: %(term)d terms, %(post)d posts, %(media)d media items' % counts
+			sublime.set_timeout(lambda: show_status(self.window, 'wordpress_archive', text), 0)
+
+		sublime.status_message('Exporting ' + store.site_key(common.sp_wp) + '...')
+		future = plugin.submit(archive.export_site, (common.sp_wp, self.path, progress), self.exported, pool = archive.jobs)
+		future.add_done_callback(lambda f: sublime.set_timeout(lambda: show_status(self.window, 'wordpress_archive', None), 0))
+
+	""" Called when the export has been written """
+	def exported(self, counts):
+		sublime.status_message('Exported %(post)d posts, %(term)d terms, %(media)d media items and %(option)d options to ' % counts + self.path + '.')
+
+class WordpressImportSiteCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that recreates the contents of a WXR or JSON lines export on the current site """
+	def __init__(self, *args, **kwargs):
+		super(WordpressImportSiteCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled() and len(archive.running) == 0
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		self.window.show_input_panel('Import Site From (.jsonl or .xml)', kwargs.get('path', '~/'), self.doDone, None, None)
+
+	""" Called when the input panel has received input """
+	def doDone(self, path):
+		self.path = os.path.expanduser(path)
+
+		if not os.path.isfile(self.path):
+			sublime.error_message('No such file: ' + self.path)
+			return
+
+		self.options = [
+			['Posts, terms and media', 'Leaves the settings of ' + store.site_key(common.sp_wp) + ' alone'],
+			['Posts, terms, media and settings', 'Also sets every writable option the export has'],
+		]
+		self.wc.show_quick_panel(self.options, self.panel_callback)
+
+	""" Called when the user has chosen what to import """
+	def panel_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		window = self.window
+		site = store.site_key(common.sp_wp)
+
+		def progress(importer):
+			counts = importer.counts
+			text = 'WordPress import: %d terms, %d posts, %d media items' % tuple(counts[kind]['imported'] + counts[kind]['reused'] for kind in ('term', 'post', 'media'))
+			sublime.set_timeout(lambda: show_status(window, 'wordpress_archive', text), 0)
+
+		concurrency = common.sp_settings.get('import_concurrency', 4)
+		importer = archive.Importer(common.sp_wp, archive.workers, concurrency, options = index == 1, progress = progress)
+		archive.running.append(importer)
+
+		def run():
+			try:
+				return importer.run(archive.read_records(self.path))
+			finally:
+				archive.running.remove(importer)
+				importer.save_ids(os.path.join(common.cache_path(site, 'imports'), os.path.basename(self.path) + '.ids.json'))
+
+		sublime.status_message('Importing ' + os.path.basename(self.path) + ' into ' + site + '...')
+		future = plugin.submit(run, (), self.imported, pool = archive.jobs)
+		future.add_done_callback(lambda f: sublime.set_timeout(lambda: show_status(window, 'wordpress_archive', None), 0))
+
+	""" Called when the import has finished, shows its report in a new view """
+	def imported(self, report):
+		view = self.window.new_file()
+		view.set_name('Import ' + os.path.basename(self.path))
+		view.set_scratch(True)
+		view.run_command('append', {'characters': report})
+
+class WordpressCancelImportCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that stops reading a running site import, whatever it has already sent still finishes """
+	def is_enabled(self):
+		return len(archive.running) > 0
+
+	def run(self, *args, **kwargs):
+		for importer in list(archive.running):
+			importer.cancel()
+
+class WordpressSyncMirrorCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that syncs the local mirror of the current site's posts and pages in both directions """
+	def __init__(self, *args, **kwargs):
+		super(WordpressSyncMirrorCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled() and mirror.root() != None
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		window = self.window
+		self.mirror = mirror.site_mirror(store.site_key(common.sp_wp))
+
+		def progress(done, total):
+			text = 'WordPress mirror: %d of %d posts synced' % (done, total)
+			sublime.set_timeout(lambda: show_status(window, 'wordpress_mirror', text), 0)
+
+		sublime.status_message('Syncing ' + self.mirror.directory + '...')
+		future = plugin.submit(self.mirror.sync, (common.sp_wp, mirror.pool, kwargs.get('post_types', mirror.POST_TYPES), progress), self.synced, executor.BACKGROUND)
+		future.add_done_callback(lambda f: sublime.set_timeout(lambda: show_status(window, 'wordpress_mirror', None), 0))
+
+	""" Called when the sync has finished """
+	def synced(self, report):
+		summary = mirror.describe(report)
+		sublime.status_message('Mirror synced: ' + summary.split('\n')[0])
+
+		# only bother the user when something needs their attention
+		if report['conflicts'] or report['kept'] or report['failed']:
+			append_output(self.window, 'Mirror of ' + self.mirror.site + '\n' + summary)
+
+class WordpressResolveMirrorConflictsCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that lists mirrored posts changed both here and on the site, to keep one side """
+	def __init__(self, *args, **kwargs):
+		super(WordpressResolveMirrorConflictsCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled() and mirror.root() != None
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		self.mirror = mirror.site_mirror(store.site_key(common.sp_wp))
+		self.conflicts = self.mirror.conflicts()
+
+		if not self.conflicts:
+			sublime.status_message('No mirror conflicts.')
+			return
+
+		self.options = [[meta['title'] or '(no title)', path] for path, meta in self.conflicts]
+		self.wc.show_quick_panel(self.options, self.panel_callback)
+
+	""" Called when the user has chosen a conflict """
+	def panel_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		self.path = self.conflicts[index][0]
+		self.wc.show_quick_panel(['Compare', 'Keep Local Version', "Keep Site's Version"], self.action_callback)
+
+	""" Called when the user has chosen how to settle the conflict """
+	def action_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == 0:
+			self.window.open_file(self.path)
+			self.window.open_file(mirror.remote_path(self.path))
+
+		if index in (1, 2):
+			plugin.submit(self.mirror.resolve, (common.sp_wp, self.path, index == 1), self.resolved)
+
+	""" Called when the conflict has been settled """
+	def resolved(self, result):
+		sublime.status_message('Resolved the conflict on ' + os.path.basename(self.path) + '.')
+
+class WordpressMirrorUpload(sublime_plugin.EventListener):
+	""" Sends a mirrored post to its site whenever its file is saved, if upload_on_save is on """
+	def on_post_save(self, view):
+		if common.sp_settings == None or not common.sp_settings.get('upload_on_save', True):
+			return
+
+		path = view.file_name()
+		m, meta = mirror.file_mirror(path)
+		if m == None:
+			return
+
+		# files of sites that aren't connected go up with their next sync
+		wp = plugin.site_client(meta['site'])
+		if wp == None:
+			sublime.status_message('Not connected to ' + meta['site'] + ', ' + os.path.basename(path) + ' will be sent on the next sync.')
+			return
+
+		def sent(future):
+			if isinstance(future.error, mirror.Conflict):
+				message = lambda: sublime.error_message(meta['title'] + ' was also changed on the site. Its version was saved as ' + mirror.remote_path(path) + ', see Resolve Mirror Conflicts.')
+			elif future.error != None:
+				message = lambda: sublime.error_message('Could not send ' + meta['title'] + ': ' + str(future.error))
+			elif future.value:
+				message = lambda: sublime.status_message(meta['title'] + ' sent to ' + meta['site'] + '.')
+			else:
+				return
+
+			sublime.set_timeout(message, 0)
+
+		mirror.pool.submit(m.push, (wp, path)).add_done_callback(sent)
+
+""" Returns the id, type and title of the post the active view is editing, None if it isn't one """
+def active_post(window):
+	view = window.active_view()
+	if view == None:
+		return None
+
+	if view.get_status('Post ID'):
+		return {'id': view.get_status('Post ID'), 'post_type': view.get_status('Post Type') or 'post', 'title': view.get_status('Post Title')}
+
+	m, meta = mirror.file_mirror(view.file_name())
+	if m != None and common.sp_wp != None and meta['site'] == store.site_key(common.sp_wp):
+		return {'id': meta['id'], 'post_type': meta['post_type'], 'title': meta['title']}
+
+	return None
+
+class WordpressBrowseMediaCommand(sublime_plugin.WindowCommand):
+	""" Sublime command that pages through the media library, previewing thumbnails, to use an item in the active post """
+	def __init__(self, *args, **kwargs):
+		super(WordpressBrowseMediaCommand, self).__init__(*args, **kwargs)
+		self.wc = command.WordpressCommand()
+
+	""" Called to determine if the command should be enabled """
+	def is_enabled(self):
+		return self.wc.is_enabled()
+
+	""" Called when the command is ran """
+	def run(self, *args, **kwargs):
+		# initialize anything we need for this command
+		self.setup_command(*args, **kwargs)
+
+	""" Called right before the rest of the command runs """
+	def setup_command(self, *args, **kwargs):
+		self.library = library.media_library(store.site_key(common.sp_wp))
+		self.post = active_post(self.window)
+
+		# filters passed as arguments skip the filter panel
+		if 'mime_type' in kwargs or 'parent_id' in kwargs:
+			self.browse(dict((k, str(kwargs[k])) for k in ('mime_type', 'parent_id') if k in kwargs))
+			return
+
+		self.filters = [('All media', {}), ('Images', {'mime_type': 'image'}), ('Unattached', {'parent_id': '0'})]
+		if self.post != None:
+			self.filters.insert(1, ('Attached to ' + (self.post['title'] or 'this ' + self.post['post_type']), {'parent_id': str(self.post['id'])}))
+
+		self.wc.show_quick_panel([label for label, filter in self.filters], lambda index: index != -1 and self.browse(self.filters[index][1]))
+
+	""" Starts listing the library with a GetMediaLibrary filter """
+	def browse(self, filter):
+		self.filter = filter
+		self.items = []
+		self.pages = 0
+		self.last_page = False
+		self.load_page(refresh = False)
+
+		# the cached first page shows right away, so check the site for newer items behind it
+		plugin.submit(self.library.page, (common.sp_wp, filter, 0, library.PAGE_SIZE, True), priority = executor.BACKGROUND)
+
+	""" Loads the next page, from the disk cache if it is there """
+	def load_page(self, refresh):
+		sublime.status_message('Loading media...')
+		plugin.submit(self.library.page, (common.sp_wp, self.filter, self.pages, library.PAGE_SIZE, refresh), self.page_callback)
+
+	""" Called when a page of items has been loaded """
+	def page_callback(self, items):
+		self.items.extend(items)
+		self.pages += 1
+		self.last_page = len(items) < library.PAGE_SIZE
+
+		# thumbnails of this page and the page after it get ready in the background
+		plugin.submit(self.library.warm, (items, ), priority = executor.BACKGROUND)
+		if not self.last_page:
+			plugin.submit(self.library.page, (common.sp_wp, self.filter, self.pages), priority = executor.BACKGROUND)
+
+		self.show_items()
+
+	""" Shows every item loaded so far """
+	def show_items(self):
+		self.options = [[item.get('title') or '(no title)', library.describe(item)] for item in self.items]
+
+		if not self.last_page:
+			self.options.append(['Load more...', str(len(self.items)) + ' items loaded so far'])
+
+		self.options.append(['Refresh', 'Check the site for new or changed items'])
+
+		# Sublime Text 2 has no highlight callback and no popups to preview in
+		if int(sublime.version()) >= 3070:
+			sublime.set_timeout(lambda: self.window.show_quick_panel(self.options, self.panel_callback, 0, 0, self.highlight_callback), 30)
+		else:
+			self.wc.show_quick_panel(self.options, self.panel_callback)
+
+	""" Called as the selection moves through the panel, previews the item's thumbnail """
+	def highlight_callback(self, index):
+		view = self.window.active_view()
+		if view == None or index >= len(self.items):
+			return
+
+		def show(path):
+			if path:
+				view.show_popup('<img src="file://' + path.replace('\\', '/') + '">', 0, -1, 400, 400)
+
+		plugin.submit(self.library.thumbnail, (self.items[index], ), show)
+
+	""" Called when the quick panel is closed """
+	def panel_callback(self, index):
+		view = self.window.active_view()
+		if view != None and hasattr(view, 'hide_popup'):
+			view.hide_popup()
+
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		if index == len(self.items) and not self.last_page:
+			self.load_page(refresh = False)
+			return
+
+		if index >= len(self.items):
+			self.library.forget(self.filter)
+			self.browse(self.filter)
+			return
+
+		self.item = self.items[index]
+		self.actions = []
+
+		if self.post != None:
+			self.actions.append(['Set as Featured Image', 'Of ' + (self.post['title'] or self.post['post_type'] + ' ' + str(self.post['id']))])
+		self.actions.append(['Insert', 'Adds the item to the active view at the cursor'])
+		self.actions.append(['Copy URL', self.item.get('link', '')])
+
+		self.wc.show_quick_panel(self.actions, self.action_callback)
+
+	""" Called when the user has chosen what to do with the item """
+	def action_callback(self, index):
+		# the user cancelled the panel
+		if index == -1:
+			return
+
+		action = self.actions[index][0]
+		link = self.item.get('link', '')
+
+		if action == 'Set as Featured Image':
+			self.window.run_command('wordpress_assign_featured_image', {
+				'post_id': self.post['id'],
+				'attachment_id': str(self.item['attachment_id']),
+				'post_type': self.post['post_type'],
+				'post_title': self.post['title'],
+			})
+
+		if action == 'Insert':
+			metadata = self.item.get('metadata')
+			if isinstance(metadata, dict) and metadata.get('width'):
+				html = '<img src="' + link + '" alt="' + (self.item.get('title') or '') + '" class="wp-image-' + str(self.item['attachment_id']) + '" />'
+			else:
+				html = '<a href="' + link + '">' + (self.item.get('title') or link) + '</a>'
+			self.window.active_view().run_command('insert', {'characters': html})
+
+		if action == 'Copy URL':
+			sublime.set_clipboard(link)
+			sublime.status_message('Copied ' + link + '.')